@@ -0,0 +1 @@
+"""Performance benchmarks of the fight engine, see bench_fight.py"""
@@ -0,0 +1,141 @@
+"""
+Benchmarks of the fight engine hot paths (fight, target selection, to-hit lookups).
+
+Runs representative scenarios, reports fights/sec, time per combat round and peak
+memory per fight, writes them as JSON and compares them with a stored baseline.
+Scenarios slower than the baseline by more than the tolerance are flagged, and the
+exit code is 1.
+
+Usage (from the repository root):
+
+    python -m benchmarks.bench_fight                         # run and compare with baseline.json
+    python -m benchmarks.bench_fight -o results.json         # also write the results
+    python -m benchmarks.bench_fight --save-baseline         # store the results as the new baseline
+    python -m benchmarks.bench_fight -s titans -s boarding   # only some scenarios
+
+The baseline is machine dependent : regenerate it with --save-baseline on the machine
+used for comparisons.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+from libse4x import FightStats, Upgrades, fight
+from libse4x.ships import *
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+# name: (att_fleet, att_upgrades, def_fleet, def_upgrades, fight() options)
+SCENARIOS = {
+    'skirmish': (
+        [S_SCOUT]*3 + [S_DESTRO]*2, Upgrades(attack=1),
+        [S_CRUISER]*2 + [S_SCOUT], Upgrades(defense=1), {}),
+    'dn_vs_fighters': (
+        [S_DREAD]*2, Upgrades(attack=3, defense=3),
+        [S_FIGHTER]*6 + [S_CARRIER]*2, Upgrades(attack=1, defense=1, fighter=3), {}),
+    'boarding': (
+        [S_BOARD]*6 + [S_CRUISER]*2, Upgrades(boarding=2),
+        [S_CRUISER]*4 + [S_BB]*2, Upgrades(security=1), {}),
+    'titans': (
+        [S_TITAN]*2, Upgrades(attack=3, defense=3),
+        [S_FIGHTER]*12 + [S_CARRIER]*4, Upgrades(fighter=3), {}),
+    'replicators': (
+        [S_SCOUT]*30 + [S_DESTRO]*25, Upgrades(attack=1, defense=1),
+        [S_CRUISER]*20 + [S_BC]*10, Upgrades(attack=2, defense=1), {}),
+    'asteroids': (
+        [S_DREAD]*6, Upgrades(attack=3, defense=3, tactics=2),
+        [S_BB]*8, Upgrades(attack=2, defense=2), {'asteroids': True}),
+    'nebula': (
+        [S_RAIDER_CLK]*6, Upgrades(attack=1, cloaking=2),
+        [S_DESTRO]*10, Upgrades(attack=1, defense=1), {'nebula': True}),
+}
+
+def run_scenario(scenario, min_time=1., seed=0):
+    """Runs fights of a scenario for at least min_time seconds, returns the measures"""
+    att_fleet, att_upgrades, def_fleet, def_upgrades, options = scenario
+    random.seed(seed)
+    stats = FightStats()
+    start = time.perf_counter()
+    elapsed = 0.
+    while elapsed < min_time:
+        for _ in range(10):
+            fight(att_fleet, att_upgrades, def_fleet, def_upgrades, stats=stats, **options)
+        elapsed = time.perf_counter() - start
+    nb_rounds = sum(k * v for k, v in stats.rounds.items())
+
+    # memory is measured separately, tracemalloc slows everything down
+    tracemalloc.start()
+    for _ in range(10):
+        fight(att_fleet, att_upgrades, def_fleet, def_upgrades, **options)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'fights': stats.nb_sims,
+        'fights_per_sec': stats.nb_sims / elapsed,
+        'rounds_per_fight': stats.rounds_mean,
+        'us_per_round': 1e6 * elapsed / max(nb_rounds, 1),
+        'peak_kib': peak / 1024,
+    }
+
+def compare(results, baseline, tolerance):
+    """Names of the scenarios slower than the baseline by more than tolerance (e.g. 0.2 = 20%)"""
+    regressions = []
+    for name, result in results.items():
+        if name in baseline and result['fights_per_sec'] < baseline[name]['fights_per_sec'] * (1 - tolerance):
+            regressions.append(name)
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n', maxsplit=1)[0])
+    parser.add_argument('-s', '--scenario', action='append', choices=sorted(SCENARIOS),
+                        help='scenario to run (default: all)')
+    parser.add_argument('-t', '--min-time', type=float, default=1., help='seconds per scenario')
+    parser.add_argument('-o', '--output', help='JSON file to write the results to')
+    parser.add_argument('-b', '--baseline', default=BASELINE_PATH, help='baseline JSON file')
+    parser.add_argument('--tolerance', type=float, default=.2,
+                        help='allowed slowdown vs. baseline before flagging a regression')
+    parser.add_argument('--save-baseline', action='store_true', help='store the results as the baseline')
+    args = parser.parse_args(argv)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)['scenarios']
+
+    results = {}
+    print('{:16} {:>10} {:>10} {:>10} {:>10} {:>10}'.format(
+        'scenario', 'fights/s', 'baseline', 'rounds', 'us/round', 'peak KiB'))
+    for name in args.scenario or SCENARIOS:
+        result = results[name] = run_scenario(SCENARIOS[name], args.min_time)
+        reference = baseline.get(name, {}).get('fights_per_sec')
+        print('{:16} {:10.0f} {:>10} {:10.1f} {:10.1f} {:10.1f}'.format(
+            name, result['fights_per_sec'], '{:.0f}'.format(reference) if reference else '-',
+            result['rounds_per_fight'], result['us_per_round'], result['peak_kib']))
+
+    report = {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'scenarios': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        return 0
+
+    regressions = compare(results, baseline, args.tolerance)
+    for name in regressions:
+        print('REGRESSION: {} is more than {:.0%} slower than the baseline'.format(name, args.tolerance))
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -112,11 +112,18 @@ Credits:
     PRODUCERS: Andy Lewis, Gene Billingsley, Mark Simonitch, Rodger MacGowan, & Tony Curtis
 """
 
+import heapq
 import random
-from collections import defaultdict, namedtuple
-from copy import deepcopy
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from copy import copy
 from operator import itemgetter
 
+from libse4x.dice import hit_distribution
+from libse4x.events import (CAPTURE, FIGHT_END, FIGHT_START, HIT, IMMORTAL, KILL, ROLL, ROUND_START, SHIP, TARGET,
+                            TARGETING)
+from libse4x.stats import FightStats
+
 #pylint: disable-msg=too-many-arguments
 
 """
@@ -203,6 +210,113 @@ class Upgrades:
         result.__dict__.update(self.__dict__)
         return result
 
+    def key(self):
+        """Hashable tuple of all the upgrade values"""
+        return tuple(sorted(self.__dict__.items()))
+
+"""
+=============================================================================
+Compiled ship types
+Ship dictionaries are turned into interned ShipType records, with the special
+rules of each ship as boolean flags instead of substrings of its name.
+- ground    ground combat unit
+- ddx       upgrades capped at size+1
+- boarding  captures instead of hitting
+- fighter   fighter tech applies, +1 vs titans
+- raider    cloaking tech applies
+- titan     2 damage, can't be boarded, 1 is not an auto-hit against it
+- cloaked   +1 attack on first round of combat
+=============================================================================
+"""
+ShipType = namedtuple('ShipType', ['name', 'cost', 'prio', 'att', 'defense', 'size',
+                                   'ground', 'ddx', 'boarding', 'fighter', 'raider', 'titan', 'cloaked'])
+
+SHIP_TYPES = {}
+
+def ship_type(ship):
+    """Interned ShipType record of a ship dictionary"""
+    key = (ship['name'], ship['cost'], ship['prio'], ship['att'], ship['def'], ship['size'], bool(ship.get('ground')))
+    found = SHIP_TYPES.get(key)
+    if found is None:
+        name = ship['name']
+        found = ShipType(*key, 'DDX' in name, 'Boarding' in name, 'Fighter' in name, 'Raider' in name,
+                         'Titan' in name, 'clkd' in name)
+        SHIP_TYPES[key] = found
+    return found
+
+# =============================================================================
+class CombatState:
+    """
+    Snapshot of a fight between two combat rounds, see fight(state=...)
+        ships           extended ship dictionaries (see fight()), in their current firing order,
+                        their id being their index in att_fleet + def_fleet
+        nb_round        next combat round to fight
+        last_round      last combat round fought, 0 if none
+        nb_att          number of attacking ships left
+        nb_def          number of defending ships left
+        att_cp_lost     CP lost by the attacker so far
+        def_cp_lost     CP lost by the defender so far
+        immortal        side with the immortal power, None if none
+        retreated       side that retreated, ending the fight, None if none
+    An empty CombatState() is filled by the first fight() it is given to.
+    """
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self):
+        self.ships = []
+        self.nb_round = 1
+        self.last_round = 0
+        self.nb_att = 0
+        self.nb_def = 0
+        self.att_cp_lost = 0
+        self.def_cp_lost = 0
+        self.immortal = None
+        self.retreated = None
+
+    @property
+    def finished(self):
+        return bool(self.ships) and (self.nb_att <= 0 or self.nb_def <= 0 or self.retreated is not None)
+
+    def copy(self):
+        """Independent copy of the state, to fight another continuation from it"""
+        result = copy(self)
+        result.ships = [dict(x) for x in self.ships]
+        return result
+
+    def fork(self, count):
+        """count independent copies of the state"""
+        return [self.copy() for _ in range(count)]
+
+    def as_dict(self):
+        """JSON compatible dictionary of the state, upgrades listed once in 'upgrades'"""
+        upgrades = []
+        indexes = {}
+        ships = []
+        for ship in self.ships:
+            if id(ship['upgrades']) not in indexes:
+                indexes[id(ship['upgrades'])] = len(upgrades)
+                upgrades.append(dict(ship['upgrades'].__dict__))
+            ships.append(dict(ship, upgrades=indexes[id(ship['upgrades'])]))
+        result = dict(self.__dict__)
+        result.update(ships=ships, upgrades=upgrades)
+        return result
+
+    @classmethod
+    def from_dict(cls, values):
+        """CombatState from a dictionary returned by as_dict()"""
+        result = cls()
+        upgrades = [Upgrades(**x) for x in values['upgrades']]
+        result.__dict__.update({key: value for key, value in values.items() if key in result.__dict__})
+        result.ships = [dict(ship, upgrades=upgrades[ship['upgrades']]) for ship in values['ships']]
+        return result
+
+    def __eq__(self, other):
+        return isinstance(other, CombatState) and self.as_dict() == other.as_dict()
+
+    def __repr__(self):
+        return '<CombatState round {}: {} ATT vs. {} DEF, CP lost {}-{}>'.format(
+            self.nb_round, self.nb_att, self.nb_def, self.att_cp_lost, self.def_cp_lost)
+
 # =============================================================================
 # Private methods
 # =============================================================================
@@ -210,81 +324,92 @@ class Upgrades:
 ATTACKER = 'ATT'
 DEFENDER = 'DEF'
 
-def roll_die():
-    """Simulate a single roll of a 10-sided die"""
+# version of the fight rules, to be increased whenever fight() gives different results
+ENGINE_VERSION = 1
+
+# attack_score() only depends on the round number through these thresholds :
+# first round, rounds 2-3, rounds 4+
+ROUND_CLASSES = (1, 2, 4)
+
+def round_class(nb_round):
+    """Index in ROUND_CLASSES of the rules applicable to round nb_round"""
+    if nb_round == 1:
+        return 0
+    elif nb_round < 4:
+        return 1
+    return 2
+
+def roll_die(dice=None):
+    """Simulate a single roll of a 10-sided die, from the dice source if given (see libse4x.dice)"""
+    if dice is not None:
+        return dice.roll()
     roll = random.randint(1, 10)
     return roll
 
-def roll_attack(att_ship, def_ship, att_upgrades, def_upgrades, bonus_fleet=0, nb_round=0):
+def attack_score(att_ship, def_ship, att_upgrades, def_upgrades, bonus_fleet=0, nb_round=0):
     """
-    Simulates a roll between attacker ship with attacker upgrades
-                         vs. defender ship with defender upgrades
+    Computes the modified score to roll under for attacker ship with attacker upgrades
+                                              vs. defender ship with defender upgrades
     Returns :
-        1+   attacker has 1+ hit or boarded defender
-        0    attacker has 0 hit (missed)
-
-    DONE : raider +1 bonus on first round of combat
-    TODO : transport upgrades
+        tohit   the attack hits on a roll <= tohit
+        None    the attacker can't hit this defender this round
     """
 
-    att_name = att_ship['name']
-    def_name = def_ship['name']
+    att_type = ship_type(att_ship)
+    def_type = ship_type(def_ship)
 
     # Att/def upgrades are capped by hull size, except for DDX
-    if 'DDX' in att_name:
-        att_up = min(att_upgrades.attack, att_ship['size']+1)
+    if att_type.ddx:
+        att_up = min(att_upgrades.attack, att_type.size+1)
     else:
-        att_up = min(att_upgrades.attack, att_ship['size'])
+        att_up = min(att_upgrades.attack, att_type.size)
 
-    if 'DDX' in def_name:
-        def_up = min(def_upgrades.defense, def_ship['size']+1)
+    if def_type.ddx:
+        def_up = min(def_upgrades.defense, def_type.size+1)
     else:
-        def_up = min(def_upgrades.defense, def_ship['size'])
+        def_up = min(def_upgrades.defense, def_type.size)
 
     # Fighter 3 upgrade gives +1 def
-    if 'Fighter' in def_name and def_upgrades.fighter >= 3:
+    if def_type.fighter and def_upgrades.fighter >= 3:
         def_up += 1
 
     # Base formula (no specials) :
     # roll = attacker_att + attacker_upgrade - defender_defense - defender_upgrade
-    tohit = att_ship['att'] + att_up - def_ship['def'] - def_up
+    tohit = att_type.att + att_up - def_type.defense - def_up
 
     # - boarding ATT : attack score = 4 + boarding_tech - defender_size - defender_security
-    if 'Boarding' in att_name:
-        tohit = att_ship['att'] + att_upgrades.boarding - 1 - def_ship['size'] - def_upgrades.security
+    if att_type.boarding:
+        tohit = att_type.att + att_upgrades.boarding - 1 - def_type.size - def_upgrades.security
 
     # - fighter ATT = 4 + fighter_tech + attack_upgrade - defender_defense - defender_upgrade
-    elif 'Fighter' in att_name:
+    elif att_type.fighter:
         tohit += att_upgrades.fighter - 1
 
     # - raider ATT : attack score = 3 + raider_tech + attack_upgrade - defender_defense - defender_upgrade
     #                               (+1 if first round of combat)
-    elif 'Raider' in att_name:
+    elif att_type.raider:
         tohit += att_upgrades.cloaking - 1
 
 
-    if 'Titan' in def_ship['name']:
+    if def_type.titan:
         # - titan DEF : titans cannot be boarded
-        if 'Boarding' in att_name:
-            result = 0
-            return result
+        if att_type.boarding:
+            return None
         # - titan DEF : fighters get +1 att vs titan
-        elif 'Fighter' in att_name:
+        elif att_type.fighter:
             tohit += 1
 
-    roll = roll_die()
-
     # fleet size bonus, doesn't apply to boarding, and only benefits Fighters vs Titans
-    if not 'Boarding' in att_name and ('Fighter' in att_name or (not 'Titan' in def_ship['name'])) and not att_ship.get('ground'):
+    if not att_type.boarding and (att_type.fighter or not def_type.titan) and not att_type.ground:
         tohit += bonus_fleet
 
     # cloaked ships have +1 attack in first round of combat
-    if nb_round == 1 and 'clkd' in att_name:
+    if nb_round == 1 and att_type.cloaked:
         tohit += 1
 
     # Attacker's ground combat units don't fire on first round unless they have ground 3
-    if nb_round == 1 and att_ship.get('ground') and att_upgrades.transport < 3 and att_ship['side'] == ATTACKER:
-        return 0, 10, 0
+    if nb_round == 1 and att_type.ground and att_upgrades.transport < 3 and att_ship['side'] == ATTACKER:
+        return None
 
     if att_upgrades.hivemind and nb_round >= 4:
         tohit += 1
@@ -293,9 +418,32 @@ def roll_attack(att_ship, def_ship, att_upgrades, def_upgrades, bonus_fleet=0, n
 
     # a 1 roll is an auto hit
     # - titan DEF : 1 does not auto-hit
-    if not 'Titan' in def_ship['name']:
+    if not def_type.titan:
         tohit = max(tohit, 1)
 
+    return tohit
+
+def roll_attack(att_ship, def_ship, att_upgrades, def_upgrades, bonus_fleet=0, nb_round=0, dice=None):
+    """
+    Simulates a roll between attacker ship with attacker upgrades
+                         vs. defender ship with defender upgrades
+    The die is rolled from the dice source if given (see libse4x.dice).
+    Returns (hits, roll, tohit), with hits :
+        1+   attacker has 1+ hit or boarded defender
+        0    attacker has 0 hit (missed)
+
+    DONE : raider +1 bonus on first round of combat
+    TODO : transport upgrades
+    """
+
+    tohit = attack_score(att_ship, def_ship, att_upgrades, def_upgrades, bonus_fleet, nb_round)
+
+    roll = roll_die(dice)
+
+    # the attacker can't hit at all (titan boarded, ground units landing)
+    if tohit is None:
+        return 0, 10, 0
+
     if roll <= tohit:
         result = 1
     else:
@@ -303,11 +451,79 @@ def roll_attack(att_ship, def_ship, att_upgrades, def_upgrades, bonus_fleet=0, n
 
 
     # - titan ATT : 2 damage
-    if 'Titan' in att_name:
+    if ship_type(att_ship).titan:
         result *= 2
 
     return result, roll, tohit
 
+SIDES = (ATTACKER, DEFENDER)
+
+TOHIT_TABLES = {}
+
+def compile_tohit(ships):
+    """
+    Precomputes the attack_score() of all the ships of a fight against each other, so that
+    a shot is just a table lookup. Ships are extended ship dictionaries (see fight()).
+    Returns (tids, types, table) :
+        tids    type index of each ship, identical ships on the same side share a type
+        types   ShipType of each type index
+        table   table[round_class][bonus][att_side][att_tid][def_tid] = attack_score(), with
+                att_side the index in SIDES of the current side of the attacker
+    Tables are cached by fleet composition and upgrades, repeated fights between the same
+    fleets compile them only once.
+    """
+    upgrades_keys = {}
+    for ship in ships:
+        upgrades = ship['upgrades']
+        if id(upgrades) not in upgrades_keys:
+            upgrades_keys[id(upgrades)] = upgrades.key()
+    ship_keys = [(ship['side'], ship_type(ship), upgrades_keys[id(ship['upgrades'])]) for ship in ships]
+    key = tuple(ship_keys)
+    if key in TOHIT_TABLES:
+        return TOHIT_TABLES[key]
+
+    indexes = {}
+    tids = []
+    samples = []
+    for ship, ship_key in zip(ships, ship_keys):
+        if ship_key not in indexes:
+            indexes[ship_key] = len(samples)
+            samples.append(ship)
+        tids.append(indexes[ship_key])
+
+    table = [[[[[attack_score(dict(att_ship, side=side), def_ship, att_ship['upgrades'], def_ship['upgrades'],
+                               bonus, nb_round)
+                 for def_ship in samples]
+                for att_ship in samples]
+               for side in SIDES]
+              for bonus in (0, 1)]
+             for nb_round in ROUND_CLASSES]
+
+    if len(TOHIT_TABLES) > 1000:
+        TOHIT_TABLES.clear()
+    TOHIT_TABLES[key] = (tids, [ship_type(x) for x in samples], table)
+    return TOHIT_TABLES[key]
+
+# find_defender() target priorities
+P_WOUNDED, P_BOARDING, P_HP1, P_HP2, P_OTHER = range(5)
+
+def target_priority(ship):
+    """Priority of a ship as a target, lower is shot first"""
+    # shoot already wounded enemies first
+    if ship['hp'] < ship['size']:
+        return P_WOUNDED
+    # shoot boarders in priority (?)
+    if 'Boarding' in ship['name']:
+        return P_BOARDING
+    # shoot 1 hp ships
+    if ship['size'] == 1:
+        return P_HP1
+    # shoot 2 hp ships
+    if ship['size'] == 2:
+        return P_HP2
+    # otherwise just shoot the first one (??!)
+    return P_OTHER
+
 def find_defender(ships, side):
     """
     Crude method to find something approximating the best target when attacking
@@ -317,40 +533,90 @@ def find_defender(ships, side):
             'ground': True, 'order': 5.8, 'hp': 1, 'upgrades': Upgrades(...), 'hasfired': False, 'skipuntil': 0,
             'side': 'DEF'
         }
+    Returns the index of the first enemy with the best target_priority(), None if there is no enemy left
     TODO: more useful shape, hard to tell which ship has the highest attack for example, as upgrades aren't applied
           (not trivial for all cases though, as it may depend on ship<->ship interactions, eg point defense
     """
-    enemies = [x for x in ships if x['side'] != side and x['hp'] > 0]
-    if not enemies:
-        return None
-
-    # shoot already wounded enemies first
-    wounded = [x for x in enemies if x['hp'] < x['size']]
-    if wounded:
-        found = ships.index(wounded[0])
-        return found
-
-    # shoot boarders in priority (?)
-    boarding = [x for x in enemies if 'Boarding' in x['name']]
-    if boarding:
-        found = ships.index(boarding[0])
-        return found
-
-    # shoot 1 hp ships
-    hp_1 = [x for x in enemies if x['size'] == 1]
-    if hp_1:
-        found = ships.index(hp_1[0])
-        return found
+    found = None
+    found_prio = None
+    for i, ship in enumerate(ships):
+        if ship['side'] == side or ship['hp'] <= 0:
+            continue
+        prio = target_priority(ship)
+        if found is None or prio < found_prio:
+            found = i
+            found_prio = prio
+            if prio == P_WOUNDED:
+                break
+    return found
 
-    # shoot 2 hp ships
-    hp_2 = [x for x in enemies if x['size'] == 2]
-    if hp_2:
-        found = ships.index(hp_2[0])
-        return found
+class TargetIndex:
+    """
+    Index of the ships of a fight by side and target_priority(), to find the same target as
+    find_defender() without scanning all the ships for every shot. Each bucket is a heap of
+    ship indexes, so that the first ship in the list is found first : a lookup reads the top
+    of at most P_OTHER + 1 buckets, each stale entry it skips costs an O(log n) pop, and each
+    update() an O(log n) push, n being the number of ships.
+    Entries are checked lazily when looked up : update() must be called after a ship is hit or
+    captured, nothing is needed when a ship is destroyed.
+        skipped     number of stale entries skipped by the lookups, starting from skipped
+    """
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, ships, skipped=0):
+        self.ships = ships
+        self.skipped = skipped
+        self.buckets = {ATTACKER: [[] for _ in range(P_OTHER + 1)],
+                        DEFENDER: [[] for _ in range(P_OTHER + 1)]}
+        for i, ship in enumerate(ships):
+            if ship['hp'] > 0:
+                self.buckets[ship['side']][target_priority(ship)].append(i)
+        for buckets in self.buckets.values():
+            for bucket in buckets:
+                heapq.heapify(bucket)
+
+    def update(self, i):
+        """Registers the new state of ship i"""
+        ship = self.ships[i]
+        if ship['hp'] > 0:
+            heapq.heappush(self.buckets[ship['side']][target_priority(ship)], i)
+
+    def find_defender(self, side):
+        """Same as find_defender(ships, side)"""
+        enemy = DEFENDER if side == ATTACKER else ATTACKER
+        for prio, bucket in enumerate(self.buckets[enemy]):
+            while bucket:
+                ship = self.ships[bucket[0]]
+                if ship['hp'] > 0 and ship['side'] == enemy and target_priority(ship) == prio:
+                    return bucket[0]
+                # stale entry: destroyed, captured or wounded since it was indexed
+                heapq.heappop(bucket)
+                self.skipped += 1
+        return None
 
-    # otherwise just shoot the first one (??!)
-    found = ships.index(enemies[0])
-    return found
+def init_ships(fleet, upgrades, side, asteroids=False, nebula=False):
+    """
+    Builds the list of extended ship dictionaries of one side at the start of a fight
+    (see fight() for the properties added to the ships)
+    """
+    # attackers fire after defenders of the same priority
+    base_order = .9 if side == ATTACKER else .8
+    ships = []
+    for x in fleet:
+        ship = dict(x)
+        if asteroids or nebula:
+            ship['order'] = base_order - (upgrades.tactics + ship.get('tactics', 0)) / 5
+        else:
+            ship['order'] = ship['prio'] + base_order - (upgrades.tactics + ship.get('tactics', 0)) / 5
+        ship['hp'] = ship['size']
+        ship['upgrades'] = upgrades
+        ship['hasfired'] = False
+        ship['skipuntil'] = 0
+        ship['side'] = side
+        if upgrades.giant:
+            ship['size'] += 1
+        ships.append(ship)
+    return ships
 
 def minidump_ships(ships):
     """Debug logging: dump all the ships in the fight and their state"""
@@ -371,11 +637,147 @@ def show_roll(roll, tohit, iatt, attacker, idef, defender):
     print('    {} {:13} [{}] rolls {:2}/{:2} vs. {} {:13} [{}]'
           .format(attacker['side'], attacker['name'], iatt, roll, tohit, defender['side'], defender['name'], idef))
 
+def fight_stats(att_fleet, att_upgrades, def_fleet, def_upgrades, nb_sims, asteroids=False, nebula=False,
+                stop_at_round=None, seed=None, verbose=False, dice=None, state=None, retreat=None, events=None):
+    """
+    Runs nb_sims fights, returns their FightStats
+    If seed is given, the random generator is seeded first for reproducible results.
+    If dice is given, the rolls come from this source instead (see libse4x.dice).
+    If state is given, each fight is a continuation from a copy of this CombatState, the
+    fleets are then ignored.
+    retreat is the retreat decision hook of each fight, see fight().
+    events is the event sink of all the fights, see fight().
+    """
+    if seed is not None:
+        random.seed(seed)
+    if state is not None:
+        stats = FightStats(state.nb_att, state.nb_def)
+    else:
+        stats = FightStats(len(att_fleet), len(def_fleet))
+    for i in range(nb_sims):
+        fight(
+            att_fleet, att_upgrades,
+            def_fleet, def_upgrades,
+            asteroids=asteroids, nebula=nebula, verbose=verbose,
+            stop_at_round=stop_at_round, stats=stats, dice=dice,
+            state=state.copy() if state is not None else None, retreat=retreat, events=events,
+        )
+    return stats
+
+def fight_stats_task(task):
+    """Worker process entry point, task is a tuple of fight_stats() arguments"""
+    return fight_stats(*task)
+
+def split_sims(nb_sims, workers, seed=None):
+    """
+    Splits nb_sims simulations between workers, returns a list of (nb_sims, seed) chunks.
+    Each chunk gets its own seed, derived from the master seed (random if seed is None).
+    """
+    rng = random.Random(seed)
+    chunk, extra = divmod(nb_sims, workers)
+    return [(chunk + (1 if i < extra else 0), rng.getrandbits(64)) for i in range(workers)]
+
+def run_matchups(matchups, nb_sims, asteroids=False, nebula=False, stop_at_round=None, workers=None, seed=None,
+                 pool=None, dice=None):
+    """
+    Runs nb_sims fights for each (att_fleet, att_upgrades, def_fleet, def_upgrades) matchup,
+    returns a list of FightStats, in the same order as matchups.
+    With workers > 1, the fights of each matchup are split across a pool of worker processes,
+    each one receiving the fleets once along with its own seed derived from the master seed :
+    the same seed and number of workers always give the same results.
+    An already running pool of workers processes can be given to avoid starting a new one.
+    With a dice source, each worker rolls from its own independent source spawned from it.
+    """
+    rng = random.Random(seed)
+    matchup_seeds = [rng.getrandbits(64) if seed is not None else None for _ in matchups]
+    if not workers or workers <= 1:
+        return [fight_stats(*matchup, nb_sims, asteroids, nebula, stop_at_round, matchup_seed, dice=dice)
+                for matchup, matchup_seed in zip(matchups, matchup_seeds)]
+
+    tasks = []
+    for matchup, matchup_seed in zip(matchups, matchup_seeds):
+        chunk_dice = dice.spawn(workers) if dice is not None else [None] * workers
+        for (chunk_sims, chunk_seed), worker_dice in zip(split_sims(nb_sims, workers, matchup_seed), chunk_dice):
+            tasks.append((*matchup, chunk_sims, asteroids, nebula, stop_at_round, chunk_seed, False, worker_dice))
+    if pool is None:
+        with ProcessPoolExecutor(max_workers=workers) as new_pool:
+            results = list(new_pool.map(fight_stats_task, tasks))
+    else:
+        results = list(pool.map(fight_stats_task, tasks))
+    return [FightStats.merged(results[i:i + workers]) for i in range(0, len(results), workers)]
+
+# number of fights between two checks of the confidence intervals in adaptive mode
+CHUNK_SIMS = 200
+
+def run_adaptive(matchup, target_ci, max_sims, asteroids=False, nebula=False, stop_at_round=None, workers=None,
+                 seed=None, chunk_sims=CHUNK_SIMS, stats=None, dice=None, pool=None):
+    """
+    Runs fights of the (att_fleet, att_upgrades, def_fleet, def_upgrades) matchup by chunks of
+    chunk_sims, until the results are settled within target_ci (see FightStats.is_settled())
+    or max_sims fights have been run. Returns the FightStats, nb_sims is the number of fights used.
+    If stats is given, the new fights are added to it. With workers > 1, an already running pool
+    of worker processes can be given, otherwise one is started for the chunks and shut down after.
+    """
+    att_fleet, _, def_fleet, _ = matchup
+    att_cost = sum(x['cost'] for x in att_fleet)
+    def_cost = sum(x['cost'] for x in def_fleet)
+    rng = random.Random(seed)
+    if stats is None:
+        stats = FightStats(len(att_fleet), len(def_fleet))
+    own_pool = ProcessPoolExecutor(max_workers=workers) if pool is None and workers and workers > 1 else None
+    pool = pool or own_pool
+    try:
+        while stats.nb_sims < max_sims and not stats.is_settled(target_ci, att_cost, def_cost):
+            chunk_seed = rng.getrandbits(64) if seed is not None else None
+            [chunk] = run_matchups([matchup], min(chunk_sims, max_sims - stats.nb_sims),
+                                   asteroids, nebula, stop_at_round, workers, chunk_seed, pool, dice)
+            stats.merge(chunk)
+    finally:
+        if own_pool is not None:
+            own_pool.shutdown()
+    return stats
+
+def run_matchup(matchup, nb_sims, asteroids=False, nebula=False, stop_at_round=None, workers=None, seed=None,
+                target_ci=None, max_sims=None, cache=None, dice=None, pool=None):
+    """
+    Runs the fights of one (att_fleet, att_upgrades, def_fleet, def_upgrades) matchup, nb_sims fights
+    or in adaptive mode if target_ci is given (see run_adaptive()), returns their FightStats.
+    With a ResultCache, the stored results are used and only the missing fights are run and stored :
+    the result can have more than nb_sims fights. The cache is not used with a dice source, since the
+    stored fights were not rolled with it. With workers > 1, an already running pool of worker
+    processes can be given to avoid starting a new one.
+    Raises ValueError if nb_sims < 1 without target_ci.
+    """
+    if not target_ci and nb_sims < 1:
+        raise ValueError('nb_sims must be at least 1, got {}'.format(nb_sims))
+    if dice is not None:
+        cache = None
+    stats = None
+    if cache is not None:
+        stats = cache.get(*matchup, asteroids, nebula, stop_at_round)
+        if stats is not None and seed is not None:
+            # new fights must not replay the stored ones
+            seed = '{}:{}'.format(seed, stats.nb_sims)
+    nb_stored = stats.nb_sims if stats is not None else 0
+
+    if target_ci:
+        stats = run_adaptive(matchup, target_ci, max_sims, asteroids, nebula, stop_at_round, workers, seed,
+                             stats=stats, dice=dice, pool=pool)
+    elif nb_sims > nb_stored:
+        [new_stats] = run_matchups([matchup], nb_sims - nb_stored, asteroids, nebula, stop_at_round, workers, seed,
+                                   pool=pool, dice=dice)
+        stats = new_stats if stats is None else stats.merge(new_stats)
+
+    if cache is not None and stats.nb_sims > nb_stored:
+        cache.put(stats, *matchup, asteroids, nebula, stop_at_round)
+    return stats
+
 # =============================================================================
 # Public methods
 # =============================================================================
 
-def fight(att_fleet, att_upgrades, def_fleet, def_upgrades, verbose=False, asteroids=False, nebula=False, stop_at_round=None):
+def fight(att_fleet, att_upgrades, def_fleet, def_upgrades, verbose=False, asteroids=False, nebula=False, stop_at_round=None,
+          stats=None, events=None, dice=None, state=None, retreat=None):
     """
     Simulate a full fight between att_fleet and def_fleet.
     Input :
@@ -385,12 +787,24 @@ def fight(att_fleet, att_upgrades, def_fleet, def_upgrades, verbose=False, aster
                         e.g. [S_CRUISER,S_CRUISER]
         xyz_upgrades    upgrades for all ships in the xyz fleet
         verbose         if True, output debugging log with detailed rolls and ships state
+        stats           if given, FightStats where the result of the fight is recorded
+        events          if given, sink of the structured event log of the fight (see libse4x.events)
+        dice            if given, source of the die rolls (see libse4x.dice), instead of the random module
+        state           if given, CombatState of the fight : a fight is resumed from a state taken
+                        at the end of a previous fight(stop_at_round=...), the fleets and upgrades
+                        are then ignored, and an empty CombatState() starts a new fight. At the
+                        end, the state is updated to the end of the fight (or of stop_at_round).
+        retreat         if given, retreat decision hook called at the start of each round after the
+                        first, for each side : retreat(side, nb_round, ships) returns True for side
+                        to retreat, which ends the fight with the ships left on both sides
+                        (counted as a draw in stats, see libse4x.retreat)
 
     ships : list of ships extended with following properties :
                 order      firing order (lower fires first)
                 hp         hp left (max size)
                 upgrades   upgrades of this ship
                 hasfired   flag if still has to fire each round
+                id         index of the ship in att_fleet + def_fleet
                 skipuntil  if > 0, the ship is inactive until the round number 'skipuntil'
                 side       1 = attacker
                            0 = defender
@@ -403,75 +817,101 @@ def fight(att_fleet, att_upgrades, def_fleet, def_upgrades, verbose=False, aster
     TODO : asteroids/nebula probably buggy for boarding
     """
 
-    if att_upgrades.immortal:
-        immortal = ATTACKER
-    elif def_upgrades.immortal:
-        immortal = DEFENDER
+    if state is not None and state.ships:
+        # resume the fight from the snapshot, its ships are updated in place
+        ships = state.ships
+        immortal = state.immortal
+        att_cp_lost = state.att_cp_lost
+        def_cp_lost = state.def_cp_lost
+        nb_att = state.nb_att
+        nb_def = state.nb_def
+        nb_round = state.nb_round
+        last_round = state.last_round
+        retreated = state.retreated
     else:
-        immortal = None
-
-    if asteroids:
-        att_upgrades.attack = 0
-        def_upgrades.attack = 0
-    if nebula:
-        att_upgrades.defense = 0
-        def_upgrades.defense = 0
-
-    # CP lost on either side
-    att_cp_lost = 0
-    def_cp_lost = 0
-
-    att_ships = []
-    def_ships = []
-    for x in att_fleet:
-        ship = dict(x)
-        if asteroids or nebula:
-            ship['order'] = .9 - (att_upgrades.tactics + ship.get('tactics', 0)) / 5
+        if att_upgrades.immortal:
+            immortal = ATTACKER
+        elif def_upgrades.immortal:
+            immortal = DEFENDER
         else:
-            ship['order'] = ship['prio'] + .9 - (att_upgrades.tactics + ship.get('tactics', 0)) / 5
-        ship['hp'] = ship['size']
-        ship['upgrades'] = att_upgrades
-        ship['hasfired'] = False
-        ship['skipuntil'] = 0
-        ship['side'] = ATTACKER
-        if att_upgrades.giant:
-            ship['size'] += 1
-        att_ships.append(ship)
-    for x in def_fleet:
-        ship = dict(x)
-        if asteroids or nebula:
-            ship['order'] = .8 - (def_upgrades.tactics + ship.get('tactics', 0)) / 5
-        else:
-            ship['order'] = ship['prio'] + .8 - (def_upgrades.tactics + ship.get('tactics', 0)) / 5
-        ship['hp'] = ship['size']
-        ship['upgrades'] = def_upgrades
-        ship['hasfired'] = False
-        ship['skipuntil'] = 0
-        ship['side'] = DEFENDER
-        if def_upgrades.giant:
-            ship['size'] += 1
-        def_ships.append(ship)
+            immortal = None
 
-    ships = att_ships
-    ships.extend(def_ships)
+        # terrain cancels upgrades, on copies to leave the caller's upgrades untouched
+        if asteroids or nebula:
+            att_upgrades = copy(att_upgrades)
+            def_upgrades = copy(def_upgrades)
+        if asteroids:
+            att_upgrades.attack = 0
+            def_upgrades.attack = 0
+        if nebula:
+            att_upgrades.defense = 0
+            def_upgrades.defense = 0
+
+        # CP lost on either side
+        att_cp_lost = 0
+        def_cp_lost = 0
+
+        att_ships = init_ships(att_fleet, att_upgrades, ATTACKER, asteroids, nebula)
+        def_ships = init_ships(def_fleet, def_upgrades, DEFENDER, asteroids, nebula)
+
+        ships = att_ships
+        ships.extend(def_ships)
+        for i, ship in enumerate(ships):
+            ship['id'] = i
+
+        nb_att = len(att_fleet)
+        nb_def = len(def_fleet)
+        nb_round = 1
+        last_round = 0
+        retreated = None
+        # dice keyed by fight, round and ship start a new set of rolls (see libse4x.dice.KeyedDice)
+        new_fight = getattr(dice, 'new_fight', None)
+        if new_fight:
+            new_fight()
+        if state is not None:
+            state.ships = ships
+            state.immortal = immortal
+
+    # all the to-hit scores of the fight are looked up in a precompiled table
+    tids, types, tohit_table = compile_tohit(ships)
+    for ship, tid in zip(ships, tids):
+        ship['tid'] = tid
     ships_sorted = sorted(ships, key=itemgetter('order'))
 
-    nb_att = len(att_fleet)
-    nb_def = len(def_fleet)
     capture = False # no capture last round
-    nb_round = 1
-
+    # ships are private copies of the fleet's ships, all changes are applied to them in place
+    next_ships = ships_sorted
+    targets = TargetIndex(ships_sorted)
+    # None when there is no event sink, so that events cost a single test
+    emit = events.emit if events is not None else None
+    roll_d10 = dice.roll if dice is not None else roll_die
+    # dice with a roll for each ship and round (see libse4x.dice.KeyedDice)
+    roll_for = getattr(dice, 'roll_for', None)
+
+    if emit:
+        emit(FIGHT_START, 0, nb_att, nb_def)
+        for ship in ships:
+            emit(SHIP, 0, ship['id'], SIDES.index(ship['side']), ship['hp'], ship['cost'])
     if verbose:
         print('Combat starting. {} ATT vs. {} DEF'.format(nb_att, nb_def))
         minidump_ships(ships_sorted)
         print('-'*80)
 
-    while nb_att > 0 and nb_def > 0:
+    while nb_att > 0 and nb_def > 0 and retreated is None:
         # Main fight loop : new combat round
 
+        # Retreats are decided at the start of each round after the first, attacker first
+        if retreat is not None and nb_round > 1:
+            retreated = next((side for side in SIDES if retreat(side, nb_round, ships_sorted)), None)
+            if retreated is not None:
+                if verbose:
+                    print('{} retreats before round {}'.format(retreated, nb_round))
+                break
+
         # Make sure ships are still sorted by order (if a ship is captured and switches side)
         if capture:
             ships_sorted = sorted(ships_sorted, key=itemgetter('order'))
+            targets = TargetIndex(ships_sorted, targets.skipped)
             capture = False
 
         # If there are fighters AND point defense scouts, have them fire in A
@@ -492,14 +932,20 @@ def fight(att_fleet, att_upgrades, def_fleet, def_upgrades, verbose=False, aster
         # Reset immortal use
         immortal_used = False
 
+        round_table = tohit_table[round_class(nb_round)]
+        if emit:
+            emit(ROUND_START, nb_round, nb_att, nb_def, SIDES.index(fleet_bonus) if fleet_bonus else -1)
+
         # By firing order, each ship tht has not fired yet at an enemy
-        next_ships = deepcopy(ships_sorted)
+        next_ships = ships_sorted
 
         for i_att, _ in enumerate(ships_sorted):
 
             att_ship = next_ships[i_att]
 
-            i_def = find_defender(next_ships, att_ship['side'])
+            i_def = targets.find_defender(att_ship['side'])
+            if emit:
+                emit(TARGET, nb_round, att_ship['id'], next_ships[i_def]['id'] if i_def is not None else -1)
             if i_def is None:
                 if verbose:
                     print('No more defenders found vs. {} {}. Fight finished!'.format(att_ship['side'], att_ship['name']))
@@ -518,15 +964,28 @@ def fight(att_fleet, att_upgrades, def_fleet, def_upgrades, verbose=False, aster
                 print(att_ship)
                 continue
 
+            att_type = types[att_ship['tid']]
             bonus = 1 if att_ship['side'] == fleet_bonus else 0
-            hits, roll, tohit = roll_attack(att_ship, def_ship, att_ship['upgrades'], def_ship['upgrades'], bonus, nb_round)
+            side = 0 if att_ship['side'] == ATTACKER else 1
+            tohit = round_table[bonus][side][att_ship['tid']][def_ship['tid']]
+            roll = roll_for(nb_round, att_ship['id']) if roll_for else roll_d10()
+            if tohit is None:
+                # the attacker can't hit at all, same as roll_attack()
+                hits, roll, tohit = 0, 10, 0
+            elif roll <= tohit:
+                # - titan ATT : 2 damage
+                hits = 2 if att_type.titan else 1
+            else:
+                hits = 0
             if verbose:
                 show_roll(roll, tohit, i_att, att_ship, i_def, def_ship)
+            if emit:
+                emit(ROLL, nb_round, att_ship['id'], def_ship['id'], roll, tohit)
 
             att_ship['hasfired'] = True
 
             # Special case of boarding
-            if 'Boarding' in att_ship['name']:
+            if att_type.boarding:
                 if hits > 0:
                     # vessel captured
                     if verbose:
@@ -551,6 +1010,9 @@ def fight(att_fleet, att_upgrades, def_fleet, def_upgrades, verbose=False, aster
                     def_ship['order'] = def_ship['prio'] + .8 + prio_malus - (def_ship['upgrades'].tactics + def_ship.get('tactics', 0)) / 5
                     # captured ships can't fire for one round
                     def_ship['skipuntil'] = nb_round + 2
+                    targets.update(i_def)
+                    if emit:
+                        emit(CAPTURE, nb_round, att_ship['id'], def_ship['id'], SIDES.index(def_ship['side']))
                     if verbose:
                         minidump_ships(next_ships)
             # General case
@@ -559,15 +1021,22 @@ def fight(att_fleet, att_upgrades, def_fleet, def_upgrades, verbose=False, aster
                     if immortal == def_ship['side'] and not immortal_used:
                         immortal_used = True
                         hits -= 1
+                        if emit:
+                            emit(IMMORTAL, nb_round, att_ship['id'], def_ship['id'])
                         if verbose:
                             print("** Immortal used **")
                     if hits > 0:
                         def_ship['hp'] -= hits
+                        targets.update(i_def)
+                        if emit:
+                            emit(HIT, nb_round, att_ship['id'], def_ship['id'], hits, def_ship['hp'])
                         if verbose:
                             print("{} {} [{}] hit by {} [{}] (roll:{}/{})".format(def_ship['side'], def_ship['name'], i_def, att_ship['name'], i_att, roll, tohit))
                         # Check if defender has been destroyed
                         if def_ship['hp'] <= 0:
                             # vessel destroyed
+                            if emit:
+                                emit(KILL, nb_round, att_ship['id'], def_ship['id'], def_ship['cost'])
                             if verbose:
                                 print("{} {} [{}] destroyed by {} [{}] (roll:{}/{})".format(def_ship['side'], def_ship['name'], i_def, att_ship['name'], i_att, roll, tohit))
                             if def_ship['side'] == DEFENDER:
@@ -579,7 +1048,7 @@ def fight(att_fleet, att_upgrades, def_fleet, def_upgrades, verbose=False, aster
                         if verbose:
                             minidump_ships(next_ships)
 
-        ships_sorted = next_ships
+        last_round = nb_round
         if verbose:
             print('Combat round {} finished. Ships left : {} ATT vs. {} DEF'.format(nb_round, nb_att, nb_def))
             print('-'*80)
@@ -594,45 +1063,67 @@ def fight(att_fleet, att_upgrades, def_fleet, def_upgrades, verbose=False, aster
         minidump_ships(next_ships)
         print('='*80)
 
-    return (nb_att, nb_def, next_ships, att_cp_lost, def_cp_lost)
-
+    if state is not None:
+        # ships are kept in firing order, so that a resumed fight breaks ties of order the same way
+        state.ships = ships_sorted
+        state.nb_round = last_round + 1
+        state.last_round = last_round
+        state.nb_att = nb_att
+        state.nb_def = nb_def
+        state.att_cp_lost = att_cp_lost
+        state.def_cp_lost = def_cp_lost
+        state.retreated = retreated
+    if emit:
+        emit(TARGETING, last_round, targets.skipped)
+        emit(FIGHT_END, last_round, nb_att, nb_def, att_cp_lost, def_cp_lost)
+    if stats is not None:
+        stats.add(nb_att, nb_def, att_cp_lost, def_cp_lost, last_round)
 
-def multifight(att_fleet, att_upgrades, def_fleet, def_upgrades, nb_sims=2000, asteroids=False, nebula=False, stop_at_round=None):
-    att_wins = 0
-    def_wins = 0
-    att_cps_lost = 0
-    def_cps_lost = 0
-    verbose = True if nb_sims == 1 else False
-    for i in range(nb_sims):
-        nb_att, nb_def, next_ships, att_cp_lost, def_cp_lost = fight(
-            att_fleet, att_upgrades,
-            def_fleet, def_upgrades,
-            asteroids=asteroids, nebula=nebula, verbose=verbose,
-            stop_at_round=stop_at_round,
-        )
-        att_cps_lost += att_cp_lost
-        def_cps_lost += def_cp_lost
-        if nb_att == 0:
-            def_wins += 1
-        else:
-            att_wins += 1
-
-    print('{:5} sims, ATT({}) won {:2.0f}% [lost:{:.1f}], DEF({}) won {:2.0f}% [lost:{:.1f}]'.format(
-        nb_sims,
-        len(att_fleet), 100. * att_wins / nb_sims, 1. * att_cps_lost / nb_sims,
-        len(def_fleet), 100. * def_wins / nb_sims, 1. * def_cps_lost / nb_sims,
-        )
-    )
+    return (nb_att, nb_def, next_ships, att_cp_lost, def_cp_lost)
 
-    print('{:2.0f}%-{:2.0f}%/{:.0f}-{:.0f}'.format(
-        100. * att_wins / nb_sims,
-        100. * def_wins / nb_sims,
-        1. * att_cps_lost / nb_sims,
-        1. * def_cps_lost / nb_sims,
-        )
-    )
 
-def multisim(attackers, defenders, nb_sims=2000, asteroids=False, nebula=False):
+def multifight(att_fleet, att_upgrades, def_fleet, def_upgrades, nb_sims=2000, asteroids=False, nebula=False,
+               stop_at_round=None, workers=None, seed=None, show=True, target_ci=None, max_sims=100000, cache=None,
+               dice=None, instruments=None):
+    """
+    Simulate nb_sims fights between att_fleet and def_fleet
+    Input : same as fight(), plus
+        nb_sims         number of fights to simulate
+        workers         if > 1, number of worker processes to split the simulations between
+        seed            master seed, for reproducible results with the same number of workers
+        show            if True, print the winrate and average CP lost for each side
+        target_ci       adaptive mode : instead of nb_sims, run fights until the 95% confidence
+                        intervals of the win rates are within +/- target_ci (e.g. 0.01), and the
+                        ones of the CP lost within +/- target_ci times the CP cost of the fleet
+        max_sims        maximum number of fights in adaptive mode
+        cache           ResultCache (see libse4x.cache) : stored results are reused, and only
+                        the missing fights are run and added to them
+        dice            source of the die rolls (see libse4x.dice), each worker gets its own
+                        independent source spawned from it
+        instruments     Instruments (see libse4x.profiling) counting and timing what the fight
+                        engine does : the nb_sims fights are then run in this process, without
+                        workers, adaptive mode or cache
+    Returns the FightStats of the fights, with the number of fights actually run in nb_sims
+    """
+    if instruments is not None:
+        with instruments.timing():
+            stats = fight_stats(att_fleet, att_upgrades, def_fleet, def_upgrades, nb_sims, asteroids, nebula,
+                                stop_at_round, seed, dice=dice, events=instruments)
+    elif nb_sims == 1 and not target_ci:
+        # single fight with verbose output
+        stats = fight_stats(att_fleet, att_upgrades, def_fleet, def_upgrades, nb_sims, asteroids, nebula,
+                            stop_at_round, seed, verbose=show, dice=dice)
+    else:
+        stats = run_matchup((att_fleet, att_upgrades, def_fleet, def_upgrades), nb_sims, asteroids, nebula,
+                            stop_at_round, workers, seed, target_ci, max_sims, cache, dice)
+    if show:
+        stats.show()
+        if instruments is not None:
+            instruments.show()
+    return stats
+
+def multisim(attackers, defenders, nb_sims=2000, asteroids=False, nebula=False, workers=None, seed=None, show=True,
+             target_ci=None, max_sims=100000, cache=None, dice=None):
     """
     Runs multiple simulations using multifight, all the combinations of attacking and defending fleets
     against each other.
@@ -643,48 +1134,54 @@ def multisim(attackers, defenders, nb_sims=2000, asteroids=False, nebula=False):
                 ([S_SC]*8+[S_CA]*2, Upgrades(attack=1)),
                 ([S_SC]*8+[S_CA], Upgrades(attack=1, defense=1)),
             ]
+        workers         if > 1, number of worker processes to split the simulations between
+        seed            master seed, for reproducible results with the same number of workers
+        show            if True, print the results of each combination
+        target_ci       adaptive mode, see multifight()
+        max_sims        maximum number of fights per combination in adaptive mode
+        cache           ResultCache, see multifight()
+        dice            source of the die rolls, see multifight()
+    Returns the FightStats of each combination, results[i_att][i_def]
     """
-    for att_fleet, att_upgrades in attackers:
-        for def_fleet, def_upgrades in defenders:
+    matchups = [(att_fleet, att_upgrades, def_fleet, def_upgrades)
+                for att_fleet, att_upgrades in attackers
+                for def_fleet, def_upgrades in defenders]
+    if target_ci or cache is not None:
+        rng = random.Random(seed)
+        all_stats = [run_matchup(matchup, nb_sims, asteroids, nebula, None, workers,
+                                 rng.getrandbits(64) if seed is not None else None, target_ci, max_sims, cache, dice)
+                     for matchup in matchups]
+    else:
+        all_stats = run_matchups(matchups, nb_sims, asteroids, nebula, None, workers, seed, dice=dice)
+    if show:
+        for stats in all_stats:
             print("-"*60)
-            #print(att_fleet)
-            #print(def_fleet)
-            multifight(att_fleet, att_upgrades, def_fleet, def_upgrades, nb_sims, asteroids, nebula)
+            stats.show()
+    nb_def = len(defenders)
+    return [all_stats[i * nb_def:(i + 1) * nb_def] for i in range(len(attackers))]
 
 
-def rolls_distribution(nb_dice, tohit):
-    nb_sims = 2000
-    results = defaultdict(int)
-    for i in range(nb_sims):
-        hits = 0
-        for i in range(nb_dice):
-            roll = roll_die()
-            if roll <= tohit:
-                hits += 1
-        results[hits] += 1
-    return {
-        k: [v, "{:.0f}%".format(100.*v/nb_sims)]
-        for k,v in dict(sorted(results.items())).items()
-    }
+def rolls_distribution(nb_dice, tohit, nb_sims=2000):
+    """
+    Distribution of the total number of hits of nb_dice dice hitting on tohit or less
+    Returns {hits: [count, percentage, probability]} with the exact probability of each
+    number of hits, and the matching count expected out of nb_sims rolls
+    Usage
+        rolls_distribution(4, 3)
+    """
+    return rolls_distribution_complex([tohit] * nb_dice, nb_sims)
 
 
-def rolls_distribution_complex(tohits):
+def rolls_distribution_complex(tohits, nb_sims=2000):
     """
-    Takes a list of (tohit) and simulates the distribution of total number of hits
+    Takes a list of (tohit) and computes the distribution of total number of hits
+    Returns {hits: [count, percentage, probability]}, see rolls_distribution()
     Usage
         rolls_distribution_complex([4,4,5,6])
         rolls_distribution_complex([3]*4)       equivalent to rolls_distribution(4, 3)
     """
-    nb_sims = 2000
-    results = defaultdict(int)
-    for i in range(nb_sims):
-        hits = 0
-        for tohit in tohits:
-            roll = roll_die()
-            if roll <= tohit:
-                hits += 1
-        results[hits] += 1
     return {
-        k: [v, "{:.0f}%".format(100.*v/nb_sims)]
-        for k,v in dict(sorted(results.items())).items()
+        k: [round(p * nb_sims), "{:.0f}%".format(100. * p), p]
+        for k, p in enumerate(hit_distribution(tohits))
+        if p > 0
     }
@@ -0,0 +1,7 @@
+"""Batch runner entry point, see libse4x.cli"""
+
+import sys
+
+from libse4x.cli import main
+
+sys.exit(main())
@@ -0,0 +1,201 @@
+"""
+Vectorized fight engine: simulates many independent fights at once.
+
+The state of all the fights is kept in NumPy arrays (one row per fight, one column
+per ship) and every live fight is stepped one round at a time. The rules are the
+same as in fight(): to-hit scores come from attack_score() and targets are chosen
+with the same priorities as find_defender().
+
+Requires numpy.
+
+Example usage:
+
+    from libse4x import Upgrades
+    from libse4x.batch import fight_batch
+    from libse4x.ships import *
+
+    res = fight_batch([S_DREAD]*2, Upgrades(attack=3,defense=3),
+                      [S_FIGHTER]*6 + [S_CARRIER]*2, Upgrades(attack=1,defense=1,fighter=3),
+                      nb_sims=100000)
+    print('ATT won {:.1%}'.format((res.nb_att > 0).mean()))
+"""
+
+from collections import namedtuple
+from copy import copy
+
+try:
+    import numpy as np
+except ImportError: # pragma: no cover
+    np = None
+
+from libse4x import ATTACKER, DEFENDER, P_WOUNDED, SIDES, compile_tohit, init_ships, round_class, target_priority
+
+BatchResult = namedtuple('BatchResult', ['nb_att', 'nb_def', 'att_cp_lost', 'def_cp_lost', 'rounds'])
+
+def fight_batch(att_fleet, att_upgrades, def_fleet, def_upgrades, nb_sims=10000,
+                asteroids=False, nebula=False, stop_at_round=None, seed=None):
+    """
+    Simulate nb_sims independent fights between att_fleet and def_fleet.
+    Input : same as fight(), plus
+        nb_sims         number of fights to simulate
+        seed            seed of the numpy random generator, for reproducible results
+    Returns a BatchResult of arrays with one value per fight :
+        nb_att          number of attacking ships left after the fight
+        nb_def          number of defending ships left after the fight
+        att_cp_lost     CP value of ships lost by attacker
+        def_cp_lost     CP value of ships lost by defender
+        rounds          number of combat rounds fought
+    """
+    if np is None:
+        raise ImportError('fight_batch requires numpy')
+
+    att_upgrades = copy(att_upgrades)
+    def_upgrades = copy(def_upgrades)
+    if asteroids:
+        att_upgrades.attack = 0
+        def_upgrades.attack = 0
+    if nebula:
+        att_upgrades.defense = 0
+        def_upgrades.defense = 0
+
+    if att_upgrades.immortal:
+        immortal = 0
+    elif def_upgrades.immortal:
+        immortal = 1
+    else:
+        immortal = -1
+
+    ships = (init_ships(att_fleet, att_upgrades, ATTACKER, asteroids, nebula)
+             + init_ships(def_fleet, def_upgrades, DEFENDER, asteroids, nebula))
+    nb_ships = len(ships)
+    tids, types, table = compile_tohit(ships)
+    tids = np.array(tids, dtype=np.intp)
+    # table[round_class, bonus, att_side, att_type, def_type], 0 if no hit is possible
+    table = np.array([[[[[0 if tohit is None else tohit for tohit in row] for row in by_att] for by_att in by_side]
+                        for by_side in by_bonus] for by_bonus in table], dtype=np.int16).reshape(
+                            -1, 2, len(SIDES), len(types), len(types))
+
+    # Static ship properties
+    size = np.array([x['size'] for x in ships])
+    cost = np.array([x['cost'] for x in ships])
+    is_board = np.array([types[tid].boarding for tid in tids])
+    damage = np.array([2 if types[tid].titan else 1 for tid in tids])
+    # target priority of unwounded ships
+    prio = np.array([target_priority(dict(x, hp=x['size'])) for x in ships])
+    # firing order once captured by the attacker / the defender
+    order_captured = np.array([
+        [x['prio'] + .8 + malus - (x['upgrades'].tactics + x.get('tactics', 0)) / 5 for malus in (.1, 0)]
+        for x in ships]).reshape(nb_ships, 2)
+
+    # Dynamic state, one row per fight
+    hp = np.tile(np.array([x['hp'] for x in ships]), (nb_sims, 1))
+    side = np.tile(np.array([SIDES.index(x['side']) for x in ships]), (nb_sims, 1))
+    order = np.tile(np.array([x['order'] for x in ships]), (nb_sims, 1))
+    skipuntil = np.zeros((nb_sims, nb_ships), dtype=np.int64)
+    perm = np.tile(np.argsort(order[0], kind='stable'), (nb_sims, 1))
+    nb_att = np.full(nb_sims, len(att_fleet))
+    nb_def = np.full(nb_sims, len(def_fleet))
+    att_cp_lost = np.zeros(nb_sims, dtype=np.int64)
+    def_cp_lost = np.zeros(nb_sims, dtype=np.int64)
+    rounds = np.zeros(nb_sims, dtype=np.int64)
+    captured = np.zeros(nb_sims, dtype=bool)
+
+    rng = np.random.default_rng(seed)
+    no_target = 5 * nb_ships
+    nb_round = 1
+    live = np.flatnonzero((nb_att > 0) & (nb_def > 0))
+
+    while live.size:
+        # Main fight loop : new combat round, on the fights still going on
+        nb_live = live.size
+        rows = np.arange(nb_live)
+        l_hp, l_side, l_order, l_skip = hp[live], side[live], order[live], skipuntil[live]
+        l_nb_att, l_nb_def = nb_att[live], nb_def[live]
+        l_att_cp, l_def_cp = att_cp_lost[live], def_cp_lost[live]
+        l_perm = perm[live]
+
+        # Make sure ships are still sorted by order (if a ship is captured and switches side)
+        l_captured = captured[live]
+        if l_captured.any():
+            resort = np.flatnonzero(l_captured)
+            sub = l_perm[resort]
+            sub_order = np.take_along_axis(l_order[resort], sub, axis=1)
+            l_perm[resort] = np.take_along_axis(sub, np.argsort(sub_order, axis=1, kind='stable'), axis=1)
+            perm[live] = l_perm
+            captured[live] = False
+        position = np.empty_like(l_perm)
+        np.put_along_axis(position, l_perm, np.arange(nb_ships)[None, :], axis=1)
+
+        # Check for fleet size bonus
+        fleet_bonus = np.where(l_nb_att >= 2 * l_nb_def, 0, np.where(l_nb_def >= 2 * l_nb_att, 1, -1))
+        immortal_used = np.zeros(nb_live, dtype=bool)
+        round_table = table[round_class(nb_round)]
+
+        # Pre-draw all the rolls of the round
+        rolls = rng.integers(1, 11, size=(nb_live, nb_ships))
+
+        for i_att in range(nb_ships):
+            att = l_perm[:, i_att]
+            att_side = l_side[rows, att]
+
+            # Target selection, same priorities as find_defender()
+            key = np.where(l_hp < size, P_WOUNDED, prio) * nb_ships + position
+            key[(l_side == att_side[:, None]) | (l_hp <= 0)] = no_target
+            target = key.argmin(axis=1)
+            active = ((key[rows, target] < no_target) & (l_hp[rows, att] > 0)
+                      & (l_skip[rows, att] <= nb_round))
+
+            bonus = (att_side == fleet_bonus).astype(np.intp)
+            tohit = round_table[bonus, att_side, tids[att], tids[target]]
+            hit = active & (rolls[:, i_att] <= tohit)
+            if not hit.any():
+                continue
+
+            # Special case of boarding
+            board = np.flatnonzero(hit & is_board[att])
+            if board.size:
+                tgt = target[board]
+                to_att = l_side[board, tgt] == 1
+                cost_tgt = cost[tgt]
+                l_nb_def[board] += np.where(to_att, -1, 1)
+                l_nb_att[board] += np.where(to_att, 1, -1)
+                l_def_cp[board] += np.where(to_att, cost_tgt, -cost_tgt)
+                l_att_cp[board] += np.where(to_att, -cost_tgt, cost_tgt)
+                l_side[board, tgt] = np.where(to_att, 0, 1)
+                l_order[board, tgt] = order_captured[tgt, np.where(to_att, 0, 1)]
+                # captured ships can't fire for one round
+                l_skip[board, tgt] = nb_round + 2
+                l_captured[board] = True
+
+            # General case
+            shot = np.flatnonzero(hit & ~is_board[att])
+            if shot.size:
+                tgt = target[shot]
+                hits = damage[att[shot]].copy()
+                if immortal >= 0:
+                    saved = (l_side[shot, tgt] == immortal) & ~immortal_used[shot]
+                    immortal_used[shot[saved]] = True
+                    hits -= saved
+                l_hp[shot, tgt] -= hits
+                killed = (hits > 0) & (l_hp[shot, tgt] <= 0)
+                if killed.any():
+                    dead = shot[killed]
+                    dead_tgt = tgt[killed]
+                    dead_def = l_side[dead, dead_tgt] == 1
+                    l_nb_def[dead] -= dead_def
+                    l_nb_att[dead] -= ~dead_def
+                    l_def_cp[dead] += np.where(dead_def, cost[dead_tgt], 0)
+                    l_att_cp[dead] += np.where(dead_def, 0, cost[dead_tgt])
+
+        hp[live], side[live], order[live], skipuntil[live] = l_hp, l_side, l_order, l_skip
+        nb_att[live], nb_def[live] = l_nb_att, l_nb_def
+        att_cp_lost[live], def_cp_lost[live] = l_att_cp, l_def_cp
+        captured[live] = l_captured
+        rounds[live] = nb_round
+
+        if stop_at_round and nb_round >= stop_at_round:
+            break
+        nb_round += 1
+        live = live[(l_nb_att > 0) & (l_nb_def > 0)]
+
+    return BatchResult(nb_att, nb_def, att_cp_lost, def_cp_lost, rounds)
@@ -0,0 +1,96 @@
+"""
+Persistent cache of multifight() results.
+
+Results are stored in a local SQLite file, keyed by a canonical signature of the
+matchup : both fleets as sorted counts of ship types (so [A,B] and [B,A] share the
+same entry), every Upgrades field, asteroids/nebula, stop_at_round and the engine
+version. The least recently used entries are evicted above max_entries.
+
+When more fights are asked for than are stored, only the missing ones are run and
+added to the stored ones.
+
+Example usage:
+
+    from libse4x import Upgrades, multifight
+    from libse4x.cache import ResultCache
+    from libse4x.ships import *
+
+    cache = ResultCache()
+    multifight([S_SCOUT]*6, Upgrades(), [S_DESTRO]*4, Upgrades(), nb_sims=2000, cache=cache)
+    # instant, read back from the cache
+    multifight([S_SCOUT]*6, Upgrades(), [S_DESTRO]*4, Upgrades(), nb_sims=2000, cache=cache)
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from collections import Counter
+
+from libse4x import ENGINE_VERSION
+from libse4x.stats import FightStats
+
+DEFAULT_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'libse4x', 'results.sqlite')
+
+def fleet_signature(fleet):
+    """Canonical signature of a fleet : sorted list of [ship, count], ships as sorted JSON"""
+    counts = Counter(json.dumps(ship, sort_keys=True) for ship in fleet)
+    return sorted([ship, count] for ship, count in counts.items())
+
+def matchup_key(att_fleet, att_upgrades, def_fleet, def_upgrades, asteroids=False, nebula=False,
+                stop_at_round=None):
+    """Hash of everything that determines the results of a matchup"""
+    signature = json.dumps([
+        ENGINE_VERSION,
+        fleet_signature(att_fleet), att_upgrades.key(),
+        fleet_signature(def_fleet), def_upgrades.key(),
+        bool(asteroids), bool(nebula), stop_at_round,
+    ], sort_keys=True)
+    return hashlib.sha256(signature.encode()).hexdigest()
+
+class ResultCache:
+    """
+    SQLite store of FightStats by matchup, see multifight(cache=...)
+        path            SQLite file, created if needed (':memory:' for a temporary cache)
+        max_entries     number of matchups kept, the least recently used ones are evicted
+    """
+
+    def __init__(self, path=DEFAULT_PATH, max_entries=10000):
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.max_entries = max_entries
+        self.db = sqlite3.connect(path)
+        self.db.execute('CREATE TABLE IF NOT EXISTS results '
+                        '(key TEXT PRIMARY KEY, stats TEXT NOT NULL, last_used REAL NOT NULL)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)')
+        self.db.commit()
+
+    def get(self, att_fleet, att_upgrades, def_fleet, def_upgrades, asteroids=False, nebula=False,
+            stop_at_round=None):
+        """Stored FightStats of the matchup, None if there are none"""
+        key = matchup_key(att_fleet, att_upgrades, def_fleet, def_upgrades, asteroids, nebula, stop_at_round)
+        row = self.db.execute('SELECT stats FROM results WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        self.db.execute('UPDATE results SET last_used = ? WHERE key = ?', (time.time(), key))
+        self.db.commit()
+        return FightStats.from_dict(json.loads(row[0]))
+
+    def put(self, stats, att_fleet, att_upgrades, def_fleet, def_upgrades, asteroids=False, nebula=False,
+            stop_at_round=None):
+        """Stores the FightStats of the matchup, replacing the previous ones"""
+        key = matchup_key(att_fleet, att_upgrades, def_fleet, def_upgrades, asteroids, nebula, stop_at_round)
+        self.db.execute('INSERT OR REPLACE INTO results (key, stats, last_used) VALUES (?, ?, ?)',
+                        (key, json.dumps(stats.as_dict()), time.time()))
+        self.db.execute('DELETE FROM results WHERE key IN '
+                        '(SELECT key FROM results ORDER BY last_used DESC LIMIT -1 OFFSET ?)',
+                        (self.max_entries,))
+        self.db.commit()
+
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,204 @@
+"""
+Campaigns : a fleet fighting a chain of engagements, the survivors of each fight moving
+on to the next one.
+
+The fleet is followed as a distribution of surviving fleets, a stream of (fleet, weight)
+samples flowing from stage to stage through generators. Each stage first adds up the
+weights of identical fleets (fleets are unordered, damage is repaired between fights),
+then fights each distinct fleet : the nb_sims fights of the stage are split between the
+distinct fleets in proportion to their weight, with at least min_sims fights each as long as
+that fits in nb_sims, and every fight streams a sample of the survivors, weighted by the
+share of its input fleet. Only the distinct
+fleets of a stage are kept in memory, never the whole population of samples.
+
+Enemy ships captured by boarding join the fleet with the fleet's upgrades, ships of the
+fleet captured by the enemy are lost.
+
+Example usage:
+
+    from libse4x import Upgrades
+    from libse4x.campaign import Stage, campaign
+    from libse4x.ships import *
+
+    stages = [
+        Stage([S_SCOUT]*3, Upgrades()),
+        Stage([S_DESTRO]*2 + [S_BASE], Upgrades(defense=1)),
+        Stage([S_CRUISER]*2, Upgrades(attack=1), attacking=False),
+    ]
+    for result in campaign([S_CRUISER]*4 + [S_BOARD]*2, Upgrades(attack=1, defense=1), stages, seed=1):
+        result.show()
+"""
+
+from collections import Counter, namedtuple
+from libse4x import ATTACKER, DEFENDER, Upgrades, fight
+from libse4x.dice import RandomDice
+
+Stage = namedtuple('Stage', ['fleet', 'upgrades', 'attacking', 'asteroids', 'nebula', 'stop_at_round'],
+                   defaults=(True, False, False, None))
+Stage.__doc__ = """
+Engagement of a campaign
+    fleet, upgrades     enemy fleet and its upgrades
+    attacking           if True, the campaign fleet is the attacker, else the defender
+    asteroids, nebula, stop_at_round    same as fight()
+"""
+
+def fleet_key(fleet):
+    """Hashable key of a fleet, the same for the same ships in any order"""
+    return tuple(sorted(tuple(sorted(ship.items())) for ship in fleet))
+
+def key_fleet(key):
+    """Fleet (list of ship dictionaries) of a fleet_key()"""
+    return [dict(ship) for ship in key]
+
+def fleet_names(key):
+    """Short description of a fleet_key(), e.g. '2x Cruiser, 1x Scout'"""
+    counts = Counter(dict(ship)['name'] for ship in key)
+    return ', '.join('{}x {}'.format(count, name) for name, count in sorted(counts.items())) or 'destroyed'
+
+def survivors(ships, fleets, side):
+    """
+    Fleet of the ships of side left after a fight, as they were before the fight
+        ships       extended ship dictionaries returned by fight()
+        fleets      att_fleet + def_fleet of the fight
+    """
+    return [fleets[ship['id']] for ship in ships if ship['side'] == side and ship['hp'] > 0]
+
+class StageResult:
+    """
+    Outcome of one stage of a campaign, probabilities over the whole campaign
+        stage           Stage
+        alive           probability that the fleet starts the stage with ships left
+        win             probability that the fleet destroys or captures the whole enemy fleet
+        lose            probability that the fleet is destroyed in this stage
+        draw            probability that both fleets have ships left (stop_at_round)
+        own_cp_lost     expected CP lost by the fleet in this stage
+        enemy_cp_lost   expected CP lost by the enemy
+        survivors       {fleet_key(): probability} of the fleet after the stage
+        nb_inputs       number of distinct fleets fought
+        nb_fights       number of fights simulated
+    """
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, stage):
+        self.stage = stage
+        self.alive = 0.
+        self.win = 0.
+        self.lose = 0.
+        self.draw = 0.
+        self.own_cp_lost = 0.
+        self.enemy_cp_lost = 0.
+        self.survivors = Counter()
+        self.nb_inputs = 0
+        self.nb_fights = 0
+
+    def most_likely(self, count=5):
+        """count most likely fleets after the stage, as (fleet_key(), probability)"""
+        return self.survivors.most_common(count)
+
+    def format(self):
+        """Text summary of the stage"""
+        lines = ['vs. {} : fleet alive {:.1%}, won {:.1%}, lost {:.1%}, draw {:.1%} '
+                 '[CP lost:{:.1f}, enemy:{:.1f}] ({} fleets, {} fights)'.format(
+                     fleet_names(fleet_key(self.stage.fleet)), self.alive, self.win, self.lose, self.draw,
+                     self.own_cp_lost, self.enemy_cp_lost, self.nb_inputs, self.nb_fights)]
+        for key, probability in self.most_likely():
+            lines.append('    {:6.1%} {}'.format(probability, fleet_names(key)))
+        return '\n'.join(lines)
+
+    def show(self):
+        print(self.format())
+
+def split_fights(weights, nb_sims, min_sims=20):
+    """
+    Number of fights of each fleet of {fleet_key(): weight}, destroyed fleets left out :
+    nb_sims fights in all, each fleet gets min_sims of them if they fit (else an equal share,
+    at least 1 fight) and the rest is split in proportion to the weights
+    """
+    keys = [key for key in weights if key]
+    if not keys:
+        return {}
+    floor = max(1, min(min_sims, nb_sims // len(keys)))
+    rest = max(nb_sims - floor * len(keys), 0)
+    total = sum(weights[key] for key in keys)
+    fights = {key: floor + int(rest * weights[key] / total) for key in keys}
+    # the fights lost to rounding go to the most likely fleet
+    fights[max(keys, key=weights.get)] += max(nb_sims - sum(fights.values()), 0)
+    return fights
+
+def run_stage(population, upgrades, stage, result, nb_sims=2000, min_sims=20, dice=None):
+    """
+    Generator of the (fleet_key(), weight) samples of the survivors of a stage
+    Input
+        population      iterable of (fleet_key(), weight) samples of the fleet before the stage
+        upgrades        Upgrades of the fleet
+        stage           Stage
+        result          StageResult updated with the outcome of the stage
+        nb_sims         number of fights of the stage, split between the distinct fleets
+                        (see split_fights())
+        min_sims        minimum number of fights of each distinct fleet, within nb_sims
+        dice            source of the die rolls (see libse4x.dice), the random module if None
+    """
+    # pylint: disable=too-many-arguments, too-many-locals
+    weights = Counter()
+    for key, weight in population:
+        weights[key] += weight
+    all_fights = split_fights(weights, nb_sims, min_sims)
+    side = ATTACKER if stage.attacking else DEFENDER
+    for key, weight in weights.items():
+        if not key:
+            # destroyed in a previous stage
+            result.survivors[key] += weight
+            yield key, weight
+            continue
+        result.alive += weight
+        result.nb_inputs += 1
+        fleet = key_fleet(key)
+        if stage.attacking:
+            matchup = (fleet, upgrades, stage.fleet, stage.upgrades)
+        else:
+            matchup = (stage.fleet, stage.upgrades, fleet, upgrades)
+        fleets = matchup[0] + matchup[2]
+        nb_fights = all_fights[key]
+        share = weight / nb_fights
+        for _ in range(nb_fights):
+            nb_att, nb_def, ships, att_cp_lost, def_cp_lost = fight(
+                *matchup, asteroids=stage.asteroids, nebula=stage.nebula, stop_at_round=stage.stop_at_round,
+                dice=dice)
+            nb_own, nb_enemy = (nb_att, nb_def) if stage.attacking else (nb_def, nb_att)
+            if nb_own <= 0:
+                result.lose += share
+            elif nb_enemy <= 0:
+                result.win += share
+            else:
+                result.draw += share
+            result.own_cp_lost += share * (att_cp_lost if stage.attacking else def_cp_lost)
+            result.enemy_cp_lost += share * (def_cp_lost if stage.attacking else att_cp_lost)
+            left = fleet_key(survivors(ships, fleets, side))
+            result.survivors[left] += share
+            yield left, share
+        result.nb_fights += nb_fights
+
+def campaign(fleet, upgrades, stages, nb_sims=2000, min_sims=20, seed=None):
+    """
+    Simulates fleet fighting each Stage of stages in turn, with the survivors of each stage
+    moving on to the next one.
+    Input
+        fleet, upgrades     campaign fleet and its upgrades, for all the stages
+        stages              list of Stage
+        nb_sims             number of fights of each stage, split between the distinct fleets
+                            reaching the stage in proportion to their probability (more only
+                            if there are more distinct fleets, which get 1 fight each)
+        min_sims            minimum number of fights of each distinct fleet, as long as they
+                            fit in nb_sims
+        seed                seed of the dice of the fights, for reproducible results
+    Returns the list of StageResult of each stage
+    """
+    dice = RandomDice(seed)
+    results = [StageResult(stage) for stage in stages]
+    population = iter([(fleet_key(fleet), 1.)])
+    for stage, result in zip(stages, results):
+        population = run_stage(population, upgrades or Upgrades(), stage, result, nb_sims, min_sims, dice)
+    # pulling the samples out of the last stage runs the whole chain
+    for _ in population:
+        pass
+    return results
@@ -0,0 +1,217 @@
+"""
+Batch runner : reads matchups as JSONL, writes one JSON result per line.
+
+Each input line is a matchup :
+
+    {"id": "dd-vs-ca", "att": {"S_DESTRO": 4}, "att_upgrades": {"attack": 1},
+     "def": ["S_CRUISER", "S_CRUISER", "S_SCOUT"], "def_upgrades": {},
+     "nb_sims": 2000, "asteroids": false, "nebula": false, "stop_at_round": null, "seed": 42}
+
+Fleets are lists of ship names from libse4x.ships (with or without the 'S_' prefix) or
+{ship name: count}, upgrades are Upgrades() arguments. Only the fleets are required,
+the other keys default to the command line options. 'target_ci' and 'max_sims' run the
+matchup in adaptive mode (see multifight()).
+
+Input is read lazily and at most a few matchups per worker are pending at any time,
+so memory stays bounded whatever the size of the input. Results are written as soon
+as they are available, in input order (default) or in completion order (--unordered).
+Each result carries the input line number : with -o and --resume, the matchups already
+in the output file are skipped, so a killed job picks up where it left off.
+
+Usage:
+
+    python -m libse4x matchups.jsonl -o results.jsonl -w 4
+    python -m libse4x matchups.jsonl -o results.jsonl -w 4 --resume
+    cat matchups.jsonl | python -m libse4x - > results.jsonl
+"""
+
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from libse4x import Upgrades, run_matchup
+from libse4x import ships as SHIPS
+
+# pending matchups per worker
+QUEUE_PER_WORKER = 4
+
+# default values of the optional keys of a matchup
+DEFAULTS = {
+    'nb_sims': 2000,
+    'asteroids': False,
+    'nebula': False,
+    'stop_at_round': None,
+    'seed': None,
+    'target_ci': None,
+    'max_sims': 100000,
+}
+
+def parse_fleet(fleet):
+    """
+    List of ship dictionaries from a list of ship names or {ship name: count}.
+    Raises ValueError for a name that is not a known ship.
+    """
+    if isinstance(fleet, dict):
+        fleet = [name for name, count in fleet.items() for _ in range(count)]
+    ships = []
+    for name in fleet:
+        if not isinstance(name, str):
+            raise ValueError('ship names must be strings, got {!r}'.format(name))
+        ship = getattr(SHIPS, name if name.startswith('S_') else 'S_' + name, None)
+        if not isinstance(ship, dict):
+            raise ValueError('unknown ship {!r}'.format(name))
+        ships.append(ship)
+    return ships
+
+def parse_matchup(record, defaults):
+    """
+    (matchup, options) of run_matchup() from an input record.
+    Raises ValueError, KeyError or TypeError if the record is invalid.
+    """
+    matchup = (
+        parse_fleet(record['att']), Upgrades(**record.get('att_upgrades', {})),
+        parse_fleet(record['def']), Upgrades(**record.get('def_upgrades', {})),
+    )
+    options = {key: record.get(key, value) for key, value in defaults.items()}
+    if not options['target_ci'] and options['nb_sims'] < 1:
+        raise ValueError('nb_sims must be at least 1, got {}'.format(options['nb_sims']))
+    return matchup, options
+
+def run_record(record, defaults):
+    """Result of one matchup record, {'error': message} if it is invalid"""
+    result = {}
+    try:
+        if 'id' in record:
+            result['id'] = record['id']
+        matchup, options = parse_matchup(record, defaults)
+        stats = run_matchup(matchup, options['nb_sims'], options['asteroids'], options['nebula'],
+                            options['stop_at_round'], seed=options['seed'], target_ci=options['target_ci'],
+                            max_sims=options['max_sims'])
+        result.update({
+            'nb_sims': stats.nb_sims,
+            'att_win': stats.att_win_rate,
+            'def_win': stats.def_win_rate,
+            'draw': stats.draw_rate,
+            'att_cp_lost': stats.att_cp_mean,
+            'def_cp_lost': stats.def_cp_mean,
+            'stats': stats.as_dict(),
+        })
+    except (ValueError, KeyError, TypeError) as e:
+        result['error'] = '{}: {}'.format(e.__class__.__name__, e)
+    return result
+
+def run_line(task):
+    """Result record of one input line, given as (line number, text, defaults)"""
+    nb_line, text, defaults = task
+    try:
+        record = json.loads(text)
+        if not isinstance(record, dict):
+            raise ValueError('a matchup must be a JSON object')
+    except ValueError as e:
+        return {'line': nb_line, 'error': '{}: {}'.format(e.__class__.__name__, e)}
+    if 'seed' not in record and defaults['seed'] is not None:
+        record['seed'] = '{}:{}'.format(defaults['seed'], nb_line)
+    result = {'line': nb_line}
+    result.update(run_record(record, defaults))
+    return result
+
+def read_done(path):
+    """
+    Line numbers already in an output file. An incomplete last line, from a killed job,
+    is removed from the file.
+    """
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, 'rb+') as f:
+        valid = 0
+        for line in f:
+            try:
+                done.add(json.loads(line)['line'])
+            except (ValueError, KeyError):
+                break
+            valid += len(line)
+        f.truncate(valid)
+    return done
+
+def read_tasks(lines, defaults, done):
+    """Tasks of run_line() for the non-empty input lines not done yet"""
+    for nb_line, text in enumerate(lines, 1):
+        if text.strip() and nb_line not in done:
+            yield nb_line, text, defaults
+
+def run_tasks(tasks, workers=1, ordered=True):
+    """
+    Yields the results of run_line() for the tasks, with at most QUEUE_PER_WORKER tasks per
+    worker pending or waiting to be written
+    """
+    if not workers or workers <= 1:
+        for task in tasks:
+            yield run_line(task)
+        return
+
+    max_pending = QUEUE_PER_WORKER * workers
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # task line numbers, in input order, and their futures
+        pending = {}
+        order = []
+        tasks = iter(tasks)
+        exhausted = False
+        while True:
+            while not exhausted and len(pending) < max_pending:
+                task = next(tasks, None)
+                if task is None:
+                    exhausted = True
+                    break
+                pending[task[0]] = pool.submit(run_line, task)
+                order.append(task[0])
+            if not pending:
+                return
+            if ordered:
+                # the first result must be written before any other
+                pending[order[0]].result()
+                while order and pending[order[0]].done():
+                    yield pending.pop(order.pop(0)).result()
+            else:
+                finished, _ = wait(pending.values(), return_when=FIRST_COMPLETED)
+                for future in finished:
+                    result = future.result()
+                    del pending[result['line']]
+                    order.remove(result['line'])
+                    yield result
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n', maxsplit=1)[0])
+    parser.add_argument('input', help="JSONL file of matchups, '-' for stdin")
+    parser.add_argument('-o', '--output', help='JSONL file of results (default: stdout)')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='number of worker processes')
+    parser.add_argument('-n', '--nb-sims', type=int, default=2000, help='default number of fights per matchup')
+    parser.add_argument('--seed', help='master seed, each matchup without seed gets "<seed>:<line number>"')
+    parser.add_argument('--target-ci', type=float, help='default target_ci, for adaptive mode')
+    parser.add_argument('--max-sims', type=int, default=100000, help='default max_sims of adaptive mode')
+    parser.add_argument('--unordered', action='store_true', help='write results in completion order')
+    parser.add_argument('--resume', action='store_true', help='skip the matchups already in the output file')
+    args = parser.parse_args(argv)
+
+    defaults = dict(DEFAULTS, nb_sims=args.nb_sims, seed=args.seed, target_ci=args.target_ci,
+                    max_sims=args.max_sims)
+    done = read_done(args.output) if args.output and args.resume else set()
+
+    lines = sys.stdin if args.input == '-' else open(args.input)
+    out = open(args.output, 'a' if args.resume else 'w') if args.output else sys.stdout
+    nb_errors = 0
+    try:
+        for result in run_tasks(read_tasks(lines, defaults, done), args.workers, not args.unordered):
+            if 'error' in result:
+                nb_errors += 1
+                print('line {}: {}'.format(result['line'], result['error']), file=sys.stderr)
+            out.write(json.dumps(result) + '\n')
+            out.flush()
+    finally:
+        if lines is not sys.stdin:
+            lines.close()
+        if out is not sys.stdout:
+            out.close()
+    return 1 if nb_errors else 0
@@ -0,0 +1,72 @@
+"""
+Paired comparison of two setups with common random numbers.
+
+Each fight of setup A is replayed in setup B with the same die rolls, each ship rolling
+the same die in each round of both fights (see KeyedDice) : the luck of the rolls is
+shared by both and cancels out in their difference, which is measured fight by fight.
+The confidence intervals of the differences are narrower than the ones of two
+independent multifight() runs with the same number of fights, by how much depends on
+how correlated the outcomes of the two setups are : much narrower for setups that only
+differ by an upgrade level, barely narrower for setups whose fights play out differently
+(other fleets, ships firing in another order).
+
+A setup is (att_fleet, att_upgrades, def_fleet, def_upgrades), optionally followed by a
+dictionary of fight() options (asteroids, nebula, stop_at_round).
+
+Example usage:
+
+    from libse4x import Upgrades
+    from libse4x.compare import compare
+    from libse4x.ships import *
+
+    # attack 2 or defense 2 for 4 battlecruisers vs. 5 cruisers ?
+    compare(([S_BC]*4, Upgrades(attack=2), [S_CRUISER]*5, Upgrades(attack=1, defense=1)),
+            ([S_BC]*4, Upgrades(defense=2), [S_CRUISER]*5, Upgrades(attack=1, defense=1)),
+            nb_sims=2000)
+"""
+
+import random
+from concurrent.futures import ProcessPoolExecutor
+
+from libse4x import fight, split_sims
+from libse4x.dice import KeyedDice
+from libse4x.stats import PairedStats
+
+def paired_stats(setup_a, setup_b, nb_sims, seed=None):
+    """Runs nb_sims pairs of fights, returns their PairedStats"""
+    (*matchup_a, options_a), (*matchup_b, options_b) = [
+        tuple(setup) if len(setup) == 5 else tuple(setup) + ({},) for setup in (setup_a, setup_b)]
+    rng = random.Random(seed)
+    stats = PairedStats(len(matchup_a[0]), len(matchup_a[2]))
+    for _ in range(nb_sims):
+        fight_seed = rng.getrandbits(64)
+        result_a = fight(*matchup_a, stats=stats.a, dice=KeyedDice(fight_seed), **options_a)
+        result_b = fight(*matchup_b, stats=stats.b, dice=KeyedDice(fight_seed), **options_b)
+        stats.add(result_a, result_b)
+    return stats
+
+def paired_stats_task(task):
+    """Worker process entry point, task is a tuple of paired_stats() arguments"""
+    return paired_stats(*task)
+
+def compare(setup_a, setup_b, nb_sims=2000, workers=None, seed=None, show=True):
+    """
+    Compares two setups with nb_sims pairs of fights sharing the same die rolls
+    Input
+        setup_x         (att_fleet, att_upgrades, def_fleet, def_upgrades[, fight() options])
+        workers         if > 1, number of worker processes to split the fights between
+        seed            master seed, for reproducible results with the same number of workers
+        show            if True, print both results and their differences
+    Returns the PairedStats : differences A - B of the attacker win rate and of the CP lost
+    on each side with their paired confidence intervals, and the FightStats of A and B
+    """
+    if not workers or workers <= 1:
+        stats = paired_stats(setup_a, setup_b, nb_sims, seed)
+    else:
+        tasks = [(setup_a, setup_b, chunk_sims, chunk_seed)
+                 for chunk_sims, chunk_seed in split_sims(nb_sims, workers, seed)]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            stats = PairedStats.merged(pool.map(paired_stats_task, tasks))
+    if show:
+        stats.show()
+    return stats
@@ -0,0 +1,240 @@
+"""
+Dice : exact hit distributions of d10 rolls, and sources of d10 rolls.
+
+A die hits when its roll (1-10) is <= tohit, so each die is a Bernoulli trial and
+the number of hits of several dice follows a Poisson-binomial distribution, computed
+exactly by convolving the dice one by one.
+"""
+
+import math
+import random
+from bisect import bisect
+from itertools import accumulate
+
+try:
+    import numpy as np
+except ImportError: # pragma: no cover
+    np = None
+
+def hit_probability(tohit):
+    """Probability that a d10 roll is <= tohit"""
+    return min(max(tohit, 0), 10) / 10.
+
+def hit_distribution(tohits):
+    """
+    Exact distribution of the total number of hits of dice rolled against tohits
+    Returns a list p, p[k] = probability of exactly k hits
+    Usage
+        hit_distribution([4,4,5,6])
+        hit_distribution([3]*4)         4 dice hitting on 3 or less
+    """
+    result = [1.]
+    for tohit in tohits:
+        chance = hit_probability(tohit)
+        following = [0.] * (len(result) + 1)
+        for hits, prob in enumerate(result):
+            following[hits] += prob * (1. - chance)
+            following[hits + 1] += prob * chance
+        result = following
+    return result
+
+def hit_distributions(all_tohits):
+    """
+    Exact hit distributions of many lists of tohit at once, e.g. to build lookup tables
+    Returns a list of distributions, as hit_distribution() for each list of tohit.
+    With numpy, all the lists are convolved together in a single vectorized pass.
+    """
+    if np is None:
+        return [hit_distribution(tohits) for tohits in all_tohits]
+    all_tohits = [list(tohits) for tohits in all_tohits]
+    if not all_tohits:
+        return []
+    nb_dice = max(len(tohits) for tohits in all_tohits)
+    # missing dice never hit, they don't change the distribution
+    chances = np.zeros((len(all_tohits), nb_dice))
+    for i, tohits in enumerate(all_tohits):
+        chances[i, :len(tohits)] = [hit_probability(tohit) for tohit in tohits]
+    result = np.zeros((len(all_tohits), nb_dice + 1))
+    result[:, 0] = 1.
+    for die in range(nb_dice):
+        chance = chances[:, die:die + 1]
+        result[:, 1:] = result[:, 1:] * (1. - chance) + result[:, :-1] * chance
+        result[:, :1] *= 1. - chance
+    return [row[:len(tohits) + 1].tolist() for row, tohits in zip(result, all_tohits)]
+
+"""
+=============================================================================
+Dice sources : d10 rolls for fight(), roll_attack() and multifight(dice=...)
+
+Rolls are drawn in large blocks and handed out one at a time by roll(). Each source
+has its own state, seeded explicitly, and spawn() gives independent sources for
+parallel workers. Without a source, rolls come from the global random module.
+=============================================================================
+"""
+
+class BlockDice:
+    """
+    Base class of dice drawing their rolls by blocks of block rolls.
+    Subclasses define draw(count), returning a list of rolls.
+    """
+
+    def __init__(self, block):
+        self.block = block
+        self.roll = self.stream().__next__
+
+    def stream(self):
+        while True:
+            yield from self.draw(self.block)
+
+    def draw(self, count):
+        raise NotImplementedError
+
+    def spawn(self, count):
+        """count new independent dice sources"""
+        raise NotImplementedError
+
+    def __getstate__(self):
+        # the rolls left in the current block are dropped, the generator can't be pickled
+        state = dict(self.__dict__)
+        del state['roll']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.roll = self.stream().__next__
+
+class RandomDice(BlockDice):
+    """Dice from a private random.Random, rolls drawn from random bytes with rejection sampling"""
+
+    def __init__(self, seed=None, block=4096):
+        self.rng = random.Random(seed)
+        super().__init__(block)
+
+    def draw(self, count):
+        # bytes of 250 and more would make some rolls more likely, they are rejected
+        data = self.rng.getrandbits(8 * count).to_bytes(count, 'little')
+        return [byte % 10 + 1 for byte in data if byte < 250]
+
+    def spawn(self, count):
+        return [RandomDice(self.rng.getrandbits(64), self.block) for _ in range(count)]
+
+class NumpyDice(BlockDice):
+    """Dice from a numpy Generator, with independent streams spawned from its SeedSequence"""
+
+    def __init__(self, seed=None, block=65536):
+        if np is None:
+            raise ImportError('NumpyDice requires numpy')
+        self.seed_sequence = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+        self.rng = np.random.default_rng(self.seed_sequence)
+        super().__init__(block)
+
+    def draw(self, count):
+        return self.rng.integers(1, 11, count, dtype=np.int8).tolist()
+
+    def spawn(self, count):
+        return [NumpyDice(child, self.block) for child in self.seed_sequence.spawn(count)]
+
+class ScriptedDice(BlockDice):
+    """Dice returning the given rolls in order, for tests. IndexError once they are all used."""
+
+    def __init__(self, rolls):
+        self.rolls = list(rolls)
+        super().__init__(len(self.rolls))
+
+    def stream(self):
+        yield from self.rolls
+        raise IndexError('all the {} scripted rolls have been used'.format(len(self.rolls)))
+
+    def spawn(self, count):
+        return [ScriptedDice(self.rolls) for _ in range(count)]
+
+class KeyedDice:
+    """
+    Dice giving each ship its own roll for each round, whatever happened before in the
+    fight : the same ship rolls the same in the n-th fight of every source with the same
+    seed, even if other ships died or missed. Used for common random numbers, see
+    libse4x.compare.
+    fight() calls new_fight() at the start of each new fight, so that the fights rolled
+    from one source differ, then roll_for(nb_round, ship id). roll() gives rolls in sequence.
+    """
+
+    def __init__(self, seed=0, block=64):
+        self.seed = seed
+        self.block = block
+        self.fight = 0
+        self.rounds = {}
+        self.sequence = RandomDice(seed, block)
+
+    def new_fight(self):
+        self.fight += 1
+        self.rounds = {}
+
+    def roll(self):
+        return self.sequence.roll()
+
+    def roll_for(self, nb_round, ship):
+        rolls = self.rounds.get(nb_round)
+        if rolls is None or ship >= len(rolls):
+            # the rolls of a round only depend on the seed, the fight and the round
+            rng = random.Random((self.seed * 1000003 + self.fight) * 1000003 + nb_round)
+            rolls = self.rounds[nb_round] = []
+            while ship >= len(rolls):
+                data = rng.getrandbits(8 * self.block).to_bytes(self.block, 'little')
+                rolls += [byte % 10 + 1 for byte in data if byte < 250]
+        return rolls[ship]
+
+    def spawn(self, count):
+        return [KeyedDice(self.sequence.rng.getrandbits(64), self.block) for _ in range(count)]
+
+class TiltedDice:
+    """
+    Dice with biased rolls for importance sampling, see libse4x.rare : the rolls of ship i
+    follow the distribution att_probabilities of the rolls 1..10 for the ships of the
+    attacking fleet (i < att_size) and def_probabilities for the others, uniform if None.
+        weight      likelihood ratio of the rolls since the last reset(), the product of
+                    (1/10) / probability of the roll over the rolls : weighted by it, biased
+                    fights give unbiased estimates
+        counts      number of rolls of each value (index 1..10) of each fleet (attacker,
+                    defender) since reset()
+    fight() calls roll_for(nb_round, ship id), roll() gives unbiased rolls.
+    """
+
+    def __init__(self, att_size, att_probabilities=None, def_probabilities=None, seed=None):
+        self.att_size = att_size
+        self.probabilities = [list(x) if x is not None else [.1] * 10 for x in (att_probabilities, def_probabilities)]
+        if any(min(x) <= 0 for x in self.probabilities):
+            raise ValueError('every roll must have a positive probability')
+        self.rng = random.Random(seed)
+        # cumulative distribution and likelihood ratio of each roll, for each fleet
+        self.cdfs = [list(accumulate(x)) for x in self.probabilities]
+        self.ratios = [[0.] + [.1 / p for p in x] for x in self.probabilities]
+        self.weight = 1.
+        self.counts = [[0] * 11, [0] * 11]
+
+    def reset(self):
+        self.weight = 1.
+        self.counts = [[0] * 11, [0] * 11]
+
+    def roll(self):
+        return self.rng.randint(1, 10)
+
+    def roll_for(self, nb_round, ship):
+        # pylint: disable=unused-argument
+        fleet = 0 if ship < self.att_size else 1
+        cdf = self.cdfs[fleet]
+        roll = min(bisect(cdf, self.rng.random() * cdf[-1]) + 1, 10)
+        self.weight *= self.ratios[fleet][roll]
+        self.counts[fleet][roll] += 1
+        return roll
+
+    def spawn(self, count):
+        return [TiltedDice(self.att_size, *self.probabilities, seed=self.rng.getrandbits(64)) for _ in range(count)]
+
+def tilted_probabilities(tilt):
+    """
+    Probabilities of the rolls 1..10 of a d10 exponentially tilted by tilt : proportional to
+    exp(-tilt * roll), more hits for a positive tilt, less for a negative one
+    """
+    weights = [math.exp(-tilt * roll) for roll in range(1, 11)]
+    total = sum(weights)
+    return [x / total for x in weights]
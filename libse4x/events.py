@@ -0,0 +1,135 @@
+"""
+Structured event log of fights, an alternative to the verbose output of fight().
+
+Every event is a fixed-size binary record (kind, round, a, b, c, d) of 12 bytes, sent to
+a sink given to fight(events=...) : an in-memory RingBuffer keeping the last events, or
+an EventFile writing them to a buffered binary file. When no sink is given, fight() does
+not build any event.
+
+Ships are identified by their index in att_fleet + def_fleet. Meaning of a, b, c, d by kind :
+    FIGHT_START     nb_att, nb_def
+    SHIP            ship, side (0 = ATT, 1 = DEF), hp, cost   (one per ship, after FIGHT_START)
+    ROUND_START     nb_att, nb_def, side with the fleet size bonus (-1 if none)
+    TARGET          attacker, target   (target lookup of each ship in firing order, -1 if none,
+                                        then the ship fires unless dead, captured or done)
+    ROLL            attacker, target, roll, tohit
+    HIT             attacker, target, damage, hp left
+    KILL            attacker, target, cost of the target
+    CAPTURE         attacker, target, new side of the target
+    IMMORTAL        attacker, target
+    FIGHT_END       nb_att, nb_def, att_cp_lost, def_cp_lost
+    TARGETING       stale entries skipped while looking for targets (just before FIGHT_END)
+
+Example usage:
+
+    from libse4x import Upgrades, fight
+    from libse4x.events import RingBuffer, format_events
+    from libse4x.ships import *
+
+    log = RingBuffer()
+    att_fleet, def_fleet = [S_BOARD]*2, [S_CRUISER]*2
+    fight(att_fleet, Upgrades(), def_fleet, Upgrades(), events=log)
+    print('\\n'.join(format_events(log.events(), att_fleet + def_fleet)))
+"""
+
+import struct
+from collections import namedtuple
+
+FIGHT_START, SHIP, ROUND_START, ROLL, HIT, KILL, CAPTURE, IMMORTAL, FIGHT_END, TARGETING, TARGET = range(11)
+KIND_NAMES = ('FIGHT_START', 'SHIP', 'ROUND_START', 'ROLL', 'HIT', 'KILL', 'CAPTURE', 'IMMORTAL', 'FIGHT_END',
+              'TARGETING', 'TARGET')
+
+# kind, round, a, b, c, d
+RECORD = struct.Struct('<BxHhhhh')
+
+Event = namedtuple('Event', ['kind', 'round', 'a', 'b', 'c', 'd'])
+
+class RingBuffer:
+    """
+    In-memory sink keeping the last capacity events
+        count           number of events received, including the overwritten ones
+    """
+
+    def __init__(self, capacity=65536):
+        self.capacity = capacity
+        self.buffer = bytearray(capacity * RECORD.size)
+        self.count = 0
+
+    def emit(self, kind, nb_round, a=0, b=0, c=0, d=0):
+        RECORD.pack_into(self.buffer, (self.count % self.capacity) * RECORD.size, kind, nb_round, a, b, c, d)
+        self.count += 1
+
+    def events(self):
+        """Kept events, oldest first"""
+        start = max(0, self.count - self.capacity)
+        for i in range(start, self.count):
+            yield Event(*RECORD.unpack_from(self.buffer, (i % self.capacity) * RECORD.size))
+
+    def clear(self):
+        self.count = 0
+
+class EventFile:
+    """Sink appending the events to a binary file, read back with read_events()"""
+
+    def __init__(self, path, buffering=1 << 16):
+        self.path = path
+        self.file = open(path, 'ab', buffering=buffering)
+
+    def emit(self, kind, nb_round, a=0, b=0, c=0, d=0):
+        self.file.write(RECORD.pack(kind, nb_round, a, b, c, d))
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def read_events(path):
+    """Events stored in a file written by EventFile"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    for values in RECORD.iter_unpack(data[:len(data) - len(data) % RECORD.size]):
+        yield Event(*values)
+
+def format_events(events, fleet=None):
+    """
+    Text log of events, one line per event.
+    fleet is att_fleet + def_fleet of the fight(s), to show ship names instead of indexes.
+    """
+    sides = ('ATT', 'DEF')
+
+    def ship(i):
+        return '{} [{}]'.format(fleet[i]['name'], i) if fleet else '[{}]'.format(i)
+
+    for event in events:
+        kind, nb_round, a, b, c, d = event
+        if kind == FIGHT_START:
+            yield 'Combat starting. {} ATT vs. {} DEF'.format(a, b)
+        elif kind == SHIP:
+            yield '{} {} at {} hp, cost {}'.format(sides[b], ship(a), c, d)
+        elif kind == ROUND_START:
+            bonus = ', fleet size bonus {}'.format(sides[c]) if c >= 0 else ''
+            yield 'Combat round {} : {} ATT vs. {} DEF{}'.format(nb_round, a, b, bonus)
+        elif kind == ROLL:
+            yield '    {} rolls {:2}/{:2} vs. {}'.format(ship(a), c, d, ship(b))
+        elif kind == HIT:
+            yield '{} hit by {} for {} ({} hp left)'.format(ship(b), ship(a), c, d)
+        elif kind == KILL:
+            yield '{} destroyed by {} ({} CP)'.format(ship(b), ship(a), c)
+        elif kind == CAPTURE:
+            yield '{} captured by {}, now {}'.format(ship(b), ship(a), sides[c])
+        elif kind == IMMORTAL:
+            yield '** Immortal used ** ({} vs. {})'.format(ship(a), ship(b))
+        elif kind == FIGHT_END:
+            yield 'Combat finished after round {}. Ships left : {} ATT vs. {} DEF, CP lost : {} - {}'.format(
+                nb_round, a, b, c, d)
+        elif kind == TARGETING:
+            yield 'Targeting : {} stale targets skipped'.format(a)
+        elif kind == TARGET:
+            if b < 0:
+                yield '    {} finds no target'.format(ship(a))
+            else:
+                yield '    {} targets {}'.format(ship(a), ship(b))
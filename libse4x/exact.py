@@ -0,0 +1,300 @@
+"""
+Exact fight outcome solver.
+
+Instead of sampling fights, the combat is treated as a Markov chain : the state at
+the start of a round is made of the hp, side, firing order and "captured last round"
+flag of every ship, and each round is expanded roll by roll into the distribution of
+states at the start of the next round. The transitions of identical states are
+memoized, so that small and medium fleets are solved in a fraction of the time
+multifight() needs, without sampling noise.
+
+From round 4 on the rules don't depend on the round number anymore : a round where
+nothing happens is then simply dropped and the other outcomes are rescaled, which
+removes the long tail of missed rounds.
+
+Fallback : when the number of distinct states goes over max_states, the chain is
+abandoned and nb_sims fights are sampled with fight() instead. The result then has
+exact=False, with the same fields filled from the samples.
+
+Example usage:
+
+    from libse4x import Upgrades
+    from libse4x.exact import solve_exact
+    from libse4x.ships import *
+
+    res = solve_exact([S_CRUISER]*2, Upgrades(attack=1), [S_DESTRO]*3, Upgrades())
+    print('ATT won {:.2%} [lost:{:.2f}]'.format(res.att_win, res.att_cp_lost))
+"""
+
+from collections import defaultdict, namedtuple
+from copy import copy
+
+from libse4x import (ATTACKER, DEFENDER, P_WOUNDED, ROUND_CLASSES, SIDES, compile_tohit, fight, init_ships,
+                    round_class, target_priority)
+
+ExactResult = namedtuple('ExactResult', [
+    'att_win', 'def_win', 'draw', 'att_cp_lost', 'def_cp_lost', 'survivors', 'exact'])
+
+class _StateSpaceTooLarge(Exception):
+    """Raised internally when the chain has more than max_states states"""
+
+class _Chain:
+    """
+    Markov chain of a fight. States are tuples (hp, side, order, skip, perm) :
+        hp      hp left of each ship (0 when dead)
+        side    side of each ship
+        order   firing order of each ship
+        skip    1 if the ship was captured last round and can't fire, else 0
+        perm    alive ships, by firing order
+    """
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, ships, immortal, max_states):
+        self.ships = ships
+        self.immortal = immortal
+        self.max_states = max_states
+        self.size = [x['size'] for x in ships]
+        self.tids, types, self.table = compile_tohit(ships)
+        self.is_board = [types[tid].boarding for tid in self.tids]
+        self.damage = [2 if types[tid].titan else 1 for tid in self.tids]
+        # target priority of unwounded ships
+        self.prio = [target_priority(dict(x, hp=x['size'])) for x in ships]
+        # firing order once captured, see fight()
+        self.order_captured = [
+            {ATTACKER: x['prio'] + .8 + .1 - (x['upgrades'].tactics + x.get('tactics', 0)) / 5,
+             DEFENDER: x['prio'] + .8 - (x['upgrades'].tactics + x.get('tactics', 0)) / 5}
+            for x in ships]
+        self.transitions = {}
+
+    def initial_state(self):
+        hp = tuple(x['hp'] for x in self.ships)
+        side = tuple(x['side'] for x in self.ships)
+        order = tuple(x['order'] for x in self.ships)
+        skip = (0,) * len(self.ships)
+        perm = tuple(sorted(range(len(self.ships)), key=lambda i: order[i]))
+        return hp, side, order, skip, perm
+
+    def chance(self, i_att, i_def, side, bonus, i_round):
+        """Probability that ship i_att on side hits ship i_def"""
+        tohit = self.table[i_round][bonus][SIDES.index(side)][self.tids[i_att]][self.tids[i_def]]
+        return 0. if tohit is None else min(max(tohit, 0), 10) / 10.
+
+    def find_defender(self, hp, side, perm, att_side):
+        """Same choice as find_defender(), ships are scanned by firing order"""
+        best = None
+        best_prio = None
+        for i in perm:
+            if side[i] == att_side or hp[i] <= 0:
+                continue
+            prio = P_WOUNDED if hp[i] < self.size[i] else self.prio[i]
+            if best is None or prio < best_prio:
+                best, best_prio = i, prio
+                if prio == P_WOUNDED:
+                    break
+        return best
+
+    def transition(self, state, i_round):
+        """Distribution of the states at the start of the next round, memoized"""
+        key = (state, i_round)
+        if key not in self.transitions:
+            self.transitions[key] = self._round(state, i_round)
+            if len(self.transitions) > self.max_states:
+                raise _StateSpaceTooLarge()
+        return self.transitions[key]
+
+    def _round(self, state, i_round):
+        """Expands one combat round roll by roll"""
+        # pylint: disable=too-many-locals
+        hp, side, order, skip, perm = state
+        nb_att = sum(1 for i in perm if side[i] == ATTACKER)
+        nb_def = len(perm) - nb_att
+        if nb_att >= 2 * nb_def:
+            fleet_bonus = ATTACKER
+        elif nb_def >= 2 * nb_att:
+            fleet_bonus = DEFENDER
+        else:
+            fleet_bonus = None
+
+        # during the round, skip is 2 for ships captured in this round
+        current = {(hp, side, order, skip, False): 1.}
+        for i_att in perm:
+            following = defaultdict(float)
+            for micro, prob in current.items():
+                m_hp, m_side, m_order, m_skip, immortal_used = micro
+                i_def = None
+                if m_hp[i_att] > 0 and not m_skip[i_att]:
+                    i_def = self.find_defender(m_hp, m_side, perm, m_side[i_att])
+                if i_def is None:
+                    following[micro] += prob
+                    continue
+                att_side = m_side[i_att]
+                chance = self.chance(i_att, i_def, att_side, int(att_side == fleet_bonus), i_round)
+                if chance < 1.:
+                    following[micro] += prob * (1. - chance)
+                if chance <= 0.:
+                    continue
+
+                if self.is_board[i_att]:
+                    new_side = ATTACKER if m_side[i_def] == DEFENDER else DEFENDER
+                    m_side = _replace(m_side, i_def, new_side)
+                    m_order = _replace(m_order, i_def, self.order_captured[i_def][new_side])
+                    m_skip = _replace(m_skip, i_def, 2)
+                else:
+                    hits = self.damage[i_att]
+                    if self.immortal == m_side[i_def] and not immortal_used:
+                        immortal_used = True
+                        hits -= 1
+                    if hits > 0:
+                        m_hp = _replace(m_hp, i_def, max(m_hp[i_def] - hits, 0))
+                following[(m_hp, m_side, m_order, m_skip, immortal_used)] += prob * chance
+            current = following
+            if len(current) > self.max_states:
+                raise _StateSpaceTooLarge()
+
+        result = defaultdict(float)
+        for (m_hp, m_side, m_order, m_skip, _), prob in current.items():
+            alive = [i for i in perm if m_hp[i] > 0]
+            # dead ships don't need their order and skip flag anymore
+            n_order = tuple(o if h > 0 else 0. for o, h in zip(m_order, m_hp))
+            n_skip = tuple(1 if s == 2 and h > 0 else 0 for s, h in zip(m_skip, m_hp))
+            n_perm = tuple(sorted(alive, key=lambda i, o=n_order: o[i]))
+            result[(m_hp, m_side, n_order, n_skip, n_perm)] += prob
+        return dict(result)
+
+def _replace(values, index, value):
+    """Copy of the tuple values with values[index] = value"""
+    return values[:index] + (value,) + values[index + 1:]
+
+def _cp_lost(ships, hp, side):
+    """CP lost by each side : ships destroyed or captured, minus ships captured from the enemy"""
+    lost = {ATTACKER: 0, DEFENDER: 0}
+    for ship, ship_hp, ship_side in zip(ships, hp, side):
+        if ship_hp <= 0 or ship_side != ship['side']:
+            lost[ship['side']] += ship['cost']
+        if ship_hp > 0 and ship_side != ship['side']:
+            lost[ship_side] -= ship['cost']
+    return lost[ATTACKER], lost[DEFENDER]
+
+def _survivors(ships, hp, side):
+    """Surviving fleet, as a sorted tuple of (side, name, hp)"""
+    return tuple(sorted((s, ship['name'], h) for ship, h, s in zip(ships, hp, side) if h > 0))
+
+def _sample(att_fleet, att_upgrades, def_fleet, def_upgrades, asteroids, nebula, stop_at_round, nb_sims):
+    """Fallback : estimates the same results with nb_sims calls to fight()"""
+    att_win = def_win = draw = 0
+    att_cps_lost = def_cps_lost = 0
+    survivors = defaultdict(float)
+    for _ in range(nb_sims):
+        nb_att, nb_def, next_ships, att_cp_lost, def_cp_lost = fight(
+            att_fleet, copy(att_upgrades), def_fleet, copy(def_upgrades),
+            asteroids=asteroids, nebula=nebula, stop_at_round=stop_at_round)
+        if nb_att == 0:
+            def_win += 1
+        elif nb_def == 0:
+            att_win += 1
+        else:
+            draw += 1
+        att_cps_lost += att_cp_lost
+        def_cps_lost += def_cp_lost
+        survivors[_survivors(next_ships, [x['hp'] for x in next_ships], [x['side'] for x in next_ships])] += 1. / nb_sims
+    return ExactResult(att_win / nb_sims, def_win / nb_sims, draw / nb_sims,
+                       att_cps_lost / nb_sims, def_cps_lost / nb_sims, dict(survivors), False)
+
+# =============================================================================
+# Public methods
+# =============================================================================
+
+def solve_exact(att_fleet, att_upgrades, def_fleet, def_upgrades, asteroids=False, nebula=False,
+                stop_at_round=None, max_states=200000, tol=1e-12, nb_sims=2000):
+    """
+    Computes the exact outcome probabilities of a fight between att_fleet and def_fleet.
+    Input : same as fight(), plus
+        max_states      above this number of distinct states, fall back to sampling
+        tol             probability left in unfinished fights under which the solver stops
+                        (only reached with ships boarding each other back and forth)
+        nb_sims         number of fights sampled by the fallback
+    Returns an ExactResult :
+        att_win         probability that the attacker wins (no defender left)
+        def_win         probability that the defender wins (no attacker left)
+        draw            probability that both sides are left after stop_at_round, or
+                        that neither side can hurt the other anymore
+        att_cp_lost     expected CP lost by the attacker
+        def_cp_lost     expected CP lost by the defender
+        survivors       {surviving fleet: probability}, fleets as sorted tuples of (side, name, hp)
+        exact           False if the result was sampled (state space too large)
+    """
+    # pylint: disable=too-many-locals
+    att_upgrades = copy(att_upgrades)
+    def_upgrades = copy(def_upgrades)
+    if asteroids:
+        att_upgrades.attack = 0
+        def_upgrades.attack = 0
+    if nebula:
+        att_upgrades.defense = 0
+        def_upgrades.defense = 0
+
+    if att_upgrades.immortal:
+        immortal = ATTACKER
+    elif def_upgrades.immortal:
+        immortal = DEFENDER
+    else:
+        immortal = None
+
+    ships = (init_ships(att_fleet, att_upgrades, ATTACKER, asteroids, nebula)
+             + init_ships(def_fleet, def_upgrades, DEFENDER, asteroids, nebula))
+    chain = _Chain(ships, immortal, max_states)
+
+    finals = defaultdict(float)
+    current = {chain.initial_state(): 1.}
+    nb_round = 1
+    try:
+        while current:
+            i_round = round_class(nb_round)
+            stationary = i_round == len(ROUND_CLASSES) - 1 and not stop_at_round
+            following = defaultdict(float)
+            for state, prob in current.items():
+                transitions = chain.transition(state, i_round)
+                if stationary:
+                    # drop the rounds where nothing happens, they don't change the outcome
+                    stay = transitions.get(state, 0.)
+                    if stay >= 1.:
+                        finals[state] += prob
+                        continue
+                    prob /= 1. - stay
+                for next_state, next_prob in transitions.items():
+                    if stationary and next_state == state:
+                        continue
+                    _, side, _, _, perm = next_state
+                    nb_att = sum(1 for i in perm if side[i] == ATTACKER)
+                    finished = nb_att == 0 or nb_att == len(perm)
+                    if finished or (stop_at_round and nb_round >= stop_at_round):
+                        finals[next_state] += prob * next_prob
+                    else:
+                        following[next_state] += prob * next_prob
+            current = following
+            if sum(current.values()) < tol:
+                for state, prob in current.items():
+                    finals[state] += prob
+                break
+            nb_round += 1
+    except _StateSpaceTooLarge:
+        return _sample(att_fleet, att_upgrades, def_fleet, def_upgrades, asteroids, nebula,
+                       stop_at_round, nb_sims)
+
+    att_win = def_win = draw = 0.
+    att_cps_lost = def_cps_lost = 0.
+    survivors = defaultdict(float)
+    for (hp, side, _, _, perm), prob in finals.items():
+        nb_att = sum(1 for i in perm if side[i] == ATTACKER)
+        if nb_att == 0:
+            def_win += prob
+        elif nb_att == len(perm):
+            att_win += prob
+        else:
+            draw += prob
+        att_cp_lost, def_cp_lost = _cp_lost(ships, hp, side)
+        att_cps_lost += prob * att_cp_lost
+        def_cps_lost += prob * def_cp_lost
+        survivors[_survivors(ships, hp, side)] += prob
+
+    return ExactResult(att_win, def_win, draw, att_cps_lost, def_cps_lost, dict(survivors), True)
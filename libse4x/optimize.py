@@ -0,0 +1,120 @@
+"""
+Fleet composition optimizer : finds the best fleets for a CP budget against a given fleet.
+
+Candidate fleets are all the compositions of ships from a pool that fit in the budget
+(by default only the ones with no room left for another ship). They are raced with
+successive halving : every candidate is first screened with a few fights, then only
+the best ones (by objective, plus the ones on the Pareto front of win rate vs. CP lost)
+get more fights, and so on until max_sims. Evaluations go through a ResultCache, so
+the fights of a candidate are kept and extended from one rung to the next, and across
+calls when a persistent cache is given.
+
+Example usage:
+
+    from libse4x import Upgrades
+    from libse4x.optimize import optimize_fleet
+    from libse4x.ships import *
+
+    front = optimize_fleet([S_CRUISER]*4, Upgrades(attack=1), 60,
+                           [S_SCOUT, S_DESTRO, S_CRUISER, S_BC], Upgrades(attack=1))
+    for candidate in front:
+        print(candidate.counts, candidate.stats.format_short())
+"""
+
+import random
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from libse4x import run_matchup
+from libse4x.cache import ResultCache
+
+Candidate = namedtuple('Candidate', ['fleet', 'counts', 'stats'])
+
+# objectives, to maximize
+OBJECTIVES = {
+    # attacker win rate
+    'win': lambda stats: stats.att_win_rate,
+    # CP destroyed minus CP lost
+    'cp': lambda stats: stats.def_cp_mean - stats.att_cp_mean,
+}
+
+def compositions(ship_pool, budget_cp, full_budget=True):
+    """
+    All the fleets of ships from ship_pool costing at most budget_cp, as tuples of counts
+    (one per ship of the pool). With full_budget, fleets that could still afford another
+    ship of the pool are left out.
+    """
+    costs = [ship['cost'] for ship in ship_pool]
+    if any(cost <= 0 for cost in costs):
+        raise ValueError('ships of the pool must have a positive cost')
+    cheapest = min(costs)
+
+    def build(index, budget):
+        if index == len(costs):
+            if not full_budget or budget < cheapest:
+                yield ()
+            return
+        for count in range(budget // costs[index] + 1):
+            for rest in build(index + 1, budget - count * costs[index]):
+                yield (count,) + rest
+
+    return [counts for counts in build(0, budget_cp) if any(counts)]
+
+def pareto_front(candidates):
+    """Candidates not dominated on (higher win rate, lower CP lost), by decreasing win rate"""
+    front = []
+    for candidate in sorted(candidates, key=lambda x: (-x.stats.att_win_rate, x.stats.att_cp_mean)):
+        if not front or candidate.stats.att_cp_mean < front[-1].stats.att_cp_mean:
+            front.append(candidate)
+    return front
+
+def optimize_fleet(def_fleet, def_upgrades, budget_cp, ship_pool, att_upgrades, objective='win',
+                   min_sims=50, max_sims=2000, eta=3, full_budget=True, asteroids=False, nebula=False,
+                   workers=None, seed=None, cache=None):
+    """
+    Searches the best attacking fleet of ships from ship_pool costing at most budget_cp,
+    against def_fleet.
+    Input
+        objective       'win' (attacker win rate), 'cp' (CP destroyed - CP lost), or a function
+                        of the FightStats of a candidate returning a score to maximize
+        min_sims        number of fights of the first screening of every candidate
+        max_sims        number of fights of the final candidates
+        eta             at each rung, 1/eta of the candidates are kept and get eta times more fights
+        full_budget     only consider fleets with no room left for another ship of the pool
+        cache           ResultCache to keep the evaluations in, in memory by default
+        workers         number of worker processes, one pool of them is used for the whole search
+    Returns the Pareto front of win rate vs. CP lost of the final candidates, a list of
+    Candidate(fleet, counts, stats) by decreasing win rate, counts being the number of
+    ships of each type of the pool.
+    """
+    # pylint: disable=too-many-locals
+    score = OBJECTIVES[objective] if isinstance(objective, str) else objective
+    all_counts = compositions(ship_pool, budget_cp, full_budget)
+    if cache is None:
+        cache = ResultCache(':memory:', max_entries=max(len(all_counts), 1))
+    rng = random.Random(seed)
+    pool = ProcessPoolExecutor(max_workers=workers) if workers and workers > 1 else None
+
+    def evaluate(counts, nb_sims):
+        fleet = [ship for ship, count in zip(ship_pool, counts) for _ in range(count)]
+        stats = run_matchup((fleet, att_upgrades, def_fleet, def_upgrades), nb_sims, asteroids, nebula,
+                            workers=workers, seed=rng.getrandbits(64) if seed is not None else None,
+                            cache=cache, pool=pool)
+        return Candidate(fleet, counts, stats)
+
+    try:
+        nb_sims = min(min_sims, max_sims)
+        candidates = [evaluate(counts, nb_sims) for counts in all_counts]
+        while nb_sims < max_sims and len(candidates) > 1:
+            # keep the best candidates by objective, and the Pareto front
+            ranked = sorted(candidates, key=lambda x: score(x.stats), reverse=True)
+            kept = ranked[:max(1, len(ranked) // eta)]
+            kept_counts = set(x.counts for x in kept)
+            kept += [x for x in pareto_front(candidates) if x.counts not in kept_counts]
+            nb_sims = min(nb_sims * eta, max_sims)
+            candidates = [evaluate(x.counts, nb_sims) for x in kept]
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    return pareto_front(candidates)
@@ -0,0 +1,305 @@
+"""
+Rare events : probabilities of long-shot outcomes, like 3 scouts beating a Dreadnaught or
+losing the Titan, with far fewer fights than plain sampling.
+
+An outcome of probability p needs about 100 / p plain fights for a 20% relative error.
+Two estimators get there with orders of magnitude fewer fights :
+
+importance_sampling() rolls the dice of each fleet from a biased d10 (see
+libse4x.dice.TiltedDice), making the fleet the outcome is good for hit more often and the
+other one less often, and weights each fight by the likelihood ratio of its rolls, which
+keeps the estimate unbiased. The dice are tuned by the cross-entropy method on pilot runs :
+they are first tilted further until the outcome shows up, then each fleet's dice roll each
+value as often as in the fights reaching the outcome, weighted by their likelihood ratio.
+The tuned dice thus learn which rolls matter, e.g. only 1s and 2s for the destroyers below.
+
+splitting() follows a population of fights round by round from CombatState snapshots.
+After each round, fights progressing towards the outcome (by a score, by default the
+share of the enemy's hp destroyed minus the share of own hp lost) are cloned in place of
+the others, each fight carrying a weight that keeps the estimate unbiased. Its confidence
+interval comes from independent runs. It only helps when the outcome builds up over
+several rounds, importance sampling is usually much more precise.
+
+Example usage:
+
+    from libse4x import DEFENDER, Upgrades
+    from libse4x.rare import importance_sampling, ship_lost, splitting
+    from libse4x.ships import *
+
+    importance_sampling([S_DESTRO]*3, Upgrades(), [S_BC]*4, Upgrades(attack=2, defense=1), seed=1).show()
+    # P = 7.391e-08 [6.215e-08 - 8.567e-08] by importance sampling, 14000 fights, 2644 reaching
+    # the outcome : as precise as 2.9e+09 plain fights
+
+    importance_sampling([S_CRUISER]*4, Upgrades(), [S_TITAN], Upgrades(), ship_lost('Titan', DEFENDER)).show()
+    splitting([S_SCOUT]*8, Upgrades(), [S_DREAD]*3, Upgrades()).show()
+"""
+
+import random
+from bisect import bisect
+from collections import namedtuple
+from itertools import accumulate
+from math import exp
+
+from libse4x import ATTACKER, DEFENDER, CombatState, fight
+from libse4x.dice import RandomDice, TiltedDice, tilted_probabilities
+from libse4x.stats import mean_interval, sample_variance
+
+Outcome = namedtuple('Outcome', ['test', 'favor'])
+Outcome.__doc__ = """
+Outcome of a fight to estimate the probability of
+    test        test(result) is True when the fight reaches the outcome, result being
+                (nb_att, nb_def, ships, att_cp_lost, def_cp_lost) as returned by fight()
+    favor       side the outcome is good for, whose dice are tilted towards hits
+"""
+
+OUTCOMES = {
+    'att_win': Outcome(lambda result: result[1] <= 0 < result[0], ATTACKER),
+    'def_win': Outcome(lambda result: result[0] <= 0 < result[1], DEFENDER),
+}
+
+def ship_lost(name, side=ATTACKER):
+    """Outcome where no ship named name of side is left (destroyed or captured)"""
+    def test(result):
+        return not any(ship['name'] == name and ship['side'] == side and ship['hp'] > 0 for ship in result[2])
+    return Outcome(test, DEFENDER if side == ATTACKER else ATTACKER)
+
+def get_outcome(outcome):
+    """Outcome from an Outcome or the name of one of OUTCOMES"""
+    if isinstance(outcome, str):
+        if outcome not in OUTCOMES:
+            raise ValueError('unknown outcome {}, expected one of {}'.format(outcome, ', '.join(OUTCOMES)))
+        return OUTCOMES[outcome]
+    return outcome
+
+def state_result(state):
+    """(nb_att, nb_def, ships, att_cp_lost, def_cp_lost) of a CombatState, as returned by fight()"""
+    return state.nb_att, state.nb_def, state.ships, state.att_cp_lost, state.def_cp_lost
+
+def hp_score(ships, side):
+    """Progress of side towards winning : share of the enemy's hp destroyed minus share of its own hp lost"""
+    left = {ATTACKER: 0, DEFENDER: 0}
+    total = {ATTACKER: 0, DEFENDER: 0}
+    for ship in ships:
+        total[ship['side']] += ship['size']
+        left[ship['side']] += max(ship['hp'], 0)
+    enemy = DEFENDER if side == ATTACKER else ATTACKER
+    return ((1. - left[enemy] / total[enemy] if total[enemy] else 1.)
+            - (1. - left[side] / total[side] if total[side] else 1.))
+
+class RareEstimate:
+    """
+    Estimate of the probability of an outcome
+        probability     estimated probability
+        low, high       95% confidence interval
+        nb_fights       number of fights simulated, pilot runs and clones of fights included
+        hits            number of fights reaching the outcome
+        variance        variance of the estimate times the number of fights it is made of,
+                        to compare with p (1 - p) for plain sampling
+        method          'importance sampling' or 'splitting'
+        probabilities   probabilities of the rolls 1..10 of the attacker's and the defender's dice,
+                        for importance sampling
+    """
+    # pylint: disable=too-many-instance-attributes, too-many-arguments
+
+    def __init__(self, probability, low, high, nb_fights, hits, variance, method, probabilities=None):
+        self.probability = probability
+        self.low = low
+        self.high = high
+        self.nb_fights = nb_fights
+        self.hits = hits
+        self.variance = variance
+        self.method = method
+        self.probabilities = probabilities
+
+    @property
+    def plain_fights(self):
+        """Number of plain fights giving the same precision, None if it can't be estimated"""
+        if not self.variance or not 0 < self.probability < 1:
+            return None
+        return self.nb_fights * self.probability * (1 - self.probability) / self.variance
+
+    def format(self):
+        """Text summary of the estimate"""
+        text = 'P = {:.3e} [{:.3e} - {:.3e}] by {}, {} fights, {} reaching the outcome'.format(
+            self.probability, self.low, self.high, self.method, self.nb_fights, self.hits)
+        if self.plain_fights is not None:
+            text += ' : as precise as {:.1e} plain fights'.format(self.plain_fights)
+        return text
+
+    def show(self):
+        print(self.format())
+
+def run_tilted(matchup, dice, nb_sims, test, options):
+    """nb_sims fights with dice, as (weight, reached, roll counts) samples"""
+    samples = []
+    for _ in range(nb_sims):
+        dice.reset()
+        result = fight(*matchup, dice=dice, **options)
+        samples.append((dice.weight, test(result), dice.counts))
+    return samples
+
+def importance_sampling(att_fleet, att_upgrades, def_fleet, def_upgrades, outcome='att_win', nb_sims=10000,
+                        pilot_sims=500, max_iterations=8, min_hits=20, step=.3, smoothing=.1, asteroids=False,
+                        nebula=False, stop_at_round=None, seed=None):
+    """
+    Estimates the probability of outcome by importance sampling, see the module documentation
+    Input : same as fight(), plus
+        outcome         Outcome, or the name of one of OUTCOMES ('att_win', 'def_win')
+        nb_sims         number of fights of the estimate, with the tuned dice
+        pilot_sims      number of fights of each pilot run tuning the dice
+        max_iterations  maximum number of pilot runs
+        min_hits        number of fights reaching the outcome a pilot run needs to tune the dice,
+                        with less the dice are tilted further by step
+        smoothing       share of a fair d10 mixed into the tuned dice, keeping every roll possible
+        seed            seed of the dice, for reproducible results
+    Returns a RareEstimate
+    """
+    # pylint: disable=too-many-arguments, too-many-locals
+    test, favor = get_outcome(outcome)
+    matchup = (att_fleet, att_upgrades, def_fleet, def_upgrades)
+    options = {'asteroids': asteroids, 'nebula': nebula, 'stop_at_round': stop_at_round}
+    rng = random.Random(seed)
+    # roll probabilities of the (attacker, defender) dice, and warm-up tilt towards the outcome
+    probabilities = [[.1] * 10, [.1] * 10]
+    favored = 0 if favor == ATTACKER else 1
+    tilt = 0.
+    nb_fights = 0
+    for _ in range(max_iterations):
+        dice = TiltedDice(len(att_fleet), *probabilities, seed=rng.getrandbits(64))
+        samples = run_tilted(matchup, dice, pilot_sims, test, options)
+        nb_fights += pilot_sims
+        reached = [x for x in samples if x[1]]
+        if len(reached) < min_hits:
+            # still too rare : more hits for the favoured fleet, less for the other one
+            tilt += step
+            probabilities[favored] = tilted_probabilities(tilt)
+            probabilities[1 - favored] = tilted_probabilities(-tilt)
+            continue
+        # cross-entropy update : the dice of each fleet roll each value as often as the fights
+        # reaching the outcome did, weighted by their likelihood
+        new_probabilities = []
+        for fleet in (0, 1):
+            totals = [sum(weight * counts[fleet][roll] for weight, _, counts in reached) for roll in range(1, 11)]
+            total = sum(totals)
+            if not total:
+                new_probabilities.append(probabilities[fleet])
+                continue
+            new_probabilities.append([(1 - smoothing) * x / total + smoothing / 10 for x in totals])
+        converged = max(abs(x - y) for old, new in zip(probabilities, new_probabilities)
+                        for x, y in zip(old, new)) < .01
+        probabilities = new_probabilities
+        if converged:
+            break
+
+    dice = TiltedDice(len(att_fleet), *probabilities, seed=rng.getrandbits(64))
+    total = 0.
+    total_sq = 0.
+    hits = 0
+    for weight, reached, _ in run_tilted(matchup, dice, nb_sims, test, options):
+        if reached:
+            total += weight
+            total_sq += weight * weight
+            hits += 1
+    low, high = mean_interval(total, total_sq, nb_sims)
+    return RareEstimate(total / max(nb_sims, 1), max(low, 0.), min(high, 1.), nb_fights + nb_sims, hits,
+                        sample_variance(total, total_sq, nb_sims), 'importance sampling', probabilities)
+
+def resample(states, weights, scores, previous, size, strength, rng):
+    """
+    Draws size states among states, by systematic resampling with the random.Random rng of
+    their weight times exp(strength * (score - previous score)), and reweights them so that
+    the weighted states keep the same expected values.
+    Returns (states, weights, scores, number of copies made)
+    """
+    # pylint: disable=too-many-arguments
+    potentials = [exp(strength * (x - y)) for x, y in zip(scores, previous)]
+    cumulative = list(accumulate(x * y for x, y in zip(weights, potentials)))
+    total = cumulative[-1]
+    if not total:
+        return [], [], [], 0
+    step = total / size
+    offset = rng.random() * step
+    picked = [min(bisect(cumulative, offset + i * step), len(states) - 1) for i in range(size)]
+    used = set()
+    new_states = []
+    for i in picked:
+        # the first clone of a state is the state itself, the others are copies
+        new_states.append(states[i].copy() if i in used else states[i])
+        used.add(i)
+    return new_states, [step / potentials[i] for i in picked], [scores[i] for i in picked], size - len(used)
+
+def splitting_run(matchup, test, score, favor, nb_particles, strength, max_rounds, options, rng, dice):
+    """
+    Estimate of one splitting run, its number of fights reaching the outcome and of fights simulated
+    Fights roll dice, and fights are cloned with the random.Random rng
+    """
+    # pylint: disable=too-many-arguments, too-many-locals
+    states = []
+    for _ in range(nb_particles):
+        state = CombatState()
+        fight(*matchup, stop_at_round=1, state=state, dice=dice, **options)
+        states.append(state)
+    weights = [1.] * nb_particles
+    previous = [0.] * nb_particles
+    total = 0.
+    hits = 0
+    nb_fights = nb_particles
+    while states:
+        # finished fights leave the population with their weight
+        running = ([], [], [])
+        for state, weight, last in zip(states, weights, previous):
+            if state.finished or state.last_round >= max_rounds:
+                if test(state_result(state)):
+                    total += weight
+                    hits += 1
+            else:
+                for values, value in zip(running, (state, weight, last)):
+                    values.append(value)
+        if not running[0]:
+            break
+        # the running fights progressing the most are cloned in place of the others, and fight one more round
+        scores = [score(state.ships, favor) for state in running[0]]
+        states, weights, previous, copies = resample(*running[:2], scores, running[2], len(running[0]), strength,
+                                                     rng)
+        nb_fights += copies
+        for state in states:
+            fight(None, None, None, None, stop_at_round=state.nb_round, state=state, dice=dice)
+    return total / nb_particles, hits, nb_fights
+
+def splitting(att_fleet, att_upgrades, def_fleet, def_upgrades, outcome='att_win', nb_particles=1000, nb_runs=10,
+              strength=8., score=hp_score, max_rounds=100, asteroids=False, nebula=False, seed=None):
+    """
+    Estimates the probability of outcome by splitting fights on their state after each round,
+    see the module documentation
+    Input : same as fight(), plus
+        outcome         Outcome, or the name of one of OUTCOMES ('att_win', 'def_win')
+        nb_particles    number of fights followed by each run
+        nb_runs         number of independent runs, the confidence interval comes from their spread
+        strength        strength of the selection : a fight is cloned exp(strength * score gained)
+                        times on average, 0 is plain sampling
+        score           score(ships, side) of the progress of side towards the outcome, see hp_score()
+        max_rounds      fights still going after max_rounds are stopped
+        seed            seed of the dice and of the cloning of fights, for reproducible results
+                        (the random module is left untouched)
+    Returns a RareEstimate
+    """
+    # pylint: disable=too-many-arguments, too-many-locals
+    rng = random.Random(seed)
+    dice = RandomDice(rng.getrandbits(64))
+    test, favor = get_outcome(outcome)
+    matchup = (att_fleet, att_upgrades, def_fleet, def_upgrades)
+    options = {'asteroids': asteroids, 'nebula': nebula}
+    estimates = []
+    hits = 0
+    nb_fights = 0
+    for _ in range(nb_runs):
+        estimate, reached, run_fights = splitting_run(matchup, test, score, favor, nb_particles, strength,
+                                                      max_rounds, options, rng, dice)
+        estimates.append(estimate)
+        hits += reached
+        nb_fights += run_fights
+    total = sum(estimates)
+    total_sq = sum(x * x for x in estimates)
+    low, high = mean_interval(total, total_sq, nb_runs)
+    return RareEstimate(total / max(nb_runs, 1), max(low, 0.), min(high, 1.), nb_fights, hits,
+                        sample_variance(total, total_sq, nb_runs) * nb_fights / max(nb_runs, 1), 'splitting')
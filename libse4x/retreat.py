@@ -0,0 +1,175 @@
+"""
+Retreat policies : when should a side retreat from a fight ?
+
+fight(retreat=hook) asks hook(side, nb_round, ships) at the start of each round after the
+first whether side retreats. solve_retreat() estimates the best policy of one side against
+an opponent that never retreats (or follows its own policy), using as utility the CP lost by
+the enemy minus the CP lost by the side.
+
+States are aggregated into features : ships left on each side by type and hp, and round
+class (see ROUND_CLASSES). The solver simulates fights without retreat, records the features
+and CP tallies at each round start, then finds by backward induction over these trajectories
+the expected utility of continuing from each feature, memoized across all the simulations,
+until the policy is stable. Retreating is chosen where it beats continuing.
+
+Example usage:
+
+    from libse4x import ATTACKER, Upgrades, fight_stats
+    from libse4x.retreat import solve_retreat
+    from libse4x.ships import *
+
+    policy = solve_retreat([S_CRUISER]*3, Upgrades(), [S_BC]*3, Upgrades(attack=1), ATTACKER)
+    print(policy.format())
+    stats = fight_stats([S_CRUISER]*3, Upgrades(), [S_BC]*3, Upgrades(attack=1), 2000, retreat=policy)
+"""
+
+import random
+from collections import Counter
+
+from libse4x import ATTACKER, DEFENDER, fight, round_class
+from libse4x.dice import KeyedDice, RandomDice
+
+# rounds of each round class, for display
+ROUND_LABELS = ('1', '2-3', '4+')
+
+def retreat_features(nb_round, ships):
+    """Hashable features of a fight state : round class, and ships left on each side by (name, hp)"""
+    counts = {ATTACKER: Counter(), DEFENDER: Counter()}
+    for ship in ships:
+        if ship['hp'] > 0:
+            counts[ship['side']][(ship['name'], ship['hp'])] += 1
+    return round_class(nb_round), tuple(sorted(counts[ATTACKER].items())), tuple(sorted(counts[DEFENDER].items()))
+
+def side_costs(ships):
+    """CP value of the ships left on each side, {side: cost}"""
+    costs = {ATTACKER: 0, DEFENDER: 0}
+    for ship in ships:
+        if ship['hp'] > 0:
+            costs[ship['side']] += ship['cost']
+    return costs
+
+class RetreatPolicy:
+    """
+    Retreat decisions of one side by state features, usable as fight(retreat=...) hook
+        side            side following the policy
+        table           {features: (retreat utility, estimated continue utility, number of visits)}
+        value           estimated utility of the fight for the side following the policy,
+                        measured on other fights than the ones the policy is fitted on
+        value_no_retreat  utility of the same fights without retreat
+        other           hook of the other side, or None
+    Unknown states, and states visited less than min_visits times, continue the fight.
+    """
+
+    def __init__(self, side, table, value, value_no_retreat, min_visits=20, other=None):
+        self.side = side
+        self.table = table
+        self.value = value
+        self.value_no_retreat = value_no_retreat
+        self.min_visits = min_visits
+        self.other = other
+        self.decisions = {features: retreat_utility > continue_utility and visits >= min_visits
+                          for features, (retreat_utility, continue_utility, visits) in table.items()}
+
+    def __call__(self, side, nb_round, ships):
+        if side != self.side:
+            return self.other(side, nb_round, ships) if self.other is not None else False
+        return self.decisions.get(retreat_features(nb_round, ships), False)
+
+    def retreat_states(self):
+        """Features of the states where the side retreats"""
+        return [features for features, retreat in self.decisions.items() if retreat]
+
+    def format(self):
+        """Text table of the states where the side retreats"""
+        lines = ['{} policy : utility {:+.1f} CP (never retreating : {:+.1f} CP)'.format(
+            self.side, self.value, self.value_no_retreat)]
+        for features in sorted(self.retreat_states(), key=lambda x: -self.table[x][2]):
+            nb_class, att_ships, def_ships = features
+            retreat_utility, continue_utility, visits = self.table[features]
+            lines.append('  round {} ATT {} vs. DEF {} : retreat {:+.1f} > continue {:+.1f} ({} visits)'.format(
+                ROUND_LABELS[nb_class], ', '.join('{}x{}({}hp)'.format(n, name, hp) for (name, hp), n in att_ships),
+                ', '.join('{}x{}({}hp)'.format(n, name, hp) for (name, hp), n in def_ships),
+                retreat_utility, continue_utility, visits))
+        return '\n'.join(lines)
+
+def solve_retreat(att_fleet, att_upgrades, def_fleet, def_upgrades, side=ATTACKER, nb_sims=20000, asteroids=False,
+                  nebula=False, min_visits=20, max_iterations=20, other=None, eval_sims=5000, seed=None):
+    """
+    Estimates the retreat policy of side maximizing (CP lost by the enemy) - (CP lost by side)
+    Input : same as fight(), plus
+        side            side to find the policy of
+        nb_sims         number of simulated fights the policy is estimated from
+        min_visits      states seen less often always continue
+        max_iterations  maximum number of policy updates
+        other           retreat hook of the other side, it never retreats if None
+        eval_sims       number of new fights the value of the policy is measured on
+        seed            seed of the random generator, for reproducible results
+    Returns a RetreatPolicy, to be given to fight(retreat=...)
+    """
+    # pylint: disable=too-many-locals
+    rng = random.Random(seed)
+    dice = RandomDice(rng.getrandbits(64))
+    enemy = DEFENDER if side == ATTACKER else ATTACKER
+    own_cost = sum(x['cost'] for x in (att_fleet if side == ATTACKER else def_fleet))
+    enemy_cost = sum(x['cost'] for x in (def_fleet if side == ATTACKER else att_fleet))
+
+    def utility(costs):
+        # CP lost by the enemy - CP lost by side, from the CP value of the ships left
+        return (enemy_cost - costs[enemy]) - (own_cost - costs[side])
+
+    # trajectories : [(features, retreat utility) at each round start], final utility
+    trajectories = []
+    for _ in range(nb_sims):
+        visits = []
+
+        def record(hook_side, nb_round, ships, visits=visits):
+            if hook_side == side:
+                visits.append((retreat_features(nb_round, ships), utility(side_costs(ships))))
+                return False
+            return other(hook_side, nb_round, ships) if other is not None else False
+
+        _, _, ships, _, _ = fight(att_fleet, att_upgrades, def_fleet, def_upgrades, asteroids=asteroids,
+                                  nebula=nebula, dice=dice, retreat=record)
+        trajectories.append((visits, utility(side_costs(ships))))
+
+    retreat_utilities = {}
+    for visits, _ in trajectories:
+        for features, retreat_utility in visits:
+            retreat_utilities[features] = retreat_utility
+    decisions = {}
+    table = {}
+    for _ in range(max_iterations):
+        # utility of continuing from each visit, following the current decisions afterwards
+        totals = Counter()
+        counts = Counter()
+        for visits, final in trajectories:
+            following = final
+            for features, retreat_utility in reversed(visits):
+                totals[features] += following
+                counts[features] += 1
+                if decisions.get(features):
+                    following = retreat_utility
+        table = {features: (retreat_utilities[features], totals[features] / counts[features], counts[features])
+                 for features in counts}
+        new_decisions = {features: retreat_utility > continue_utility and visits >= min_visits
+                         for features, (retreat_utility, continue_utility, visits) in table.items()}
+        if new_decisions == decisions:
+            break
+        decisions = new_decisions
+
+    # the value of the policy on the fights it was fitted on is optimistic : both values are
+    # measured on new fights, with and without retreat on the same rolls (see KeyedDice)
+    policy = RetreatPolicy(side, table, 0., 0., min_visits, other)
+    value = 0.
+    value_no_retreat = 0.
+    for _ in range(eval_sims):
+        fight_seed = rng.getrandbits(64)
+        _, _, ships, _, _ = fight(att_fleet, att_upgrades, def_fleet, def_upgrades, asteroids=asteroids,
+                                  nebula=nebula, dice=KeyedDice(fight_seed), retreat=policy)
+        value += utility(side_costs(ships))
+        _, _, ships, _, _ = fight(att_fleet, att_upgrades, def_fleet, def_upgrades, asteroids=asteroids,
+                                  nebula=nebula, dice=KeyedDice(fight_seed), retreat=other)
+        value_no_retreat += utility(side_costs(ships))
+    policy.value = value / max(eval_sims, 1)
+    policy.value_no_retreat = value_no_retreat / max(eval_sims, 1)
+    return policy
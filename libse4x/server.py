@@ -0,0 +1,244 @@
+"""
+Local HTTP simulation service.
+
+An asyncio HTTP server answering JSON requests with a pool of warm worker processes,
+so that callers (bots, web pages) don't pay the interpreter startup for each query :
+
+    POST /multifight    a matchup, same format as the lines of the batch runner (see libse4x.cli),
+                        returns the stats of the fights
+    POST /fight         a matchup, returns the result of a single fight, and its text log
+                        with "log": true
+    GET  /metrics       counters and latencies of the service
+
+Concurrent identical requests are computed once, and recent results are kept in an LRU
+cache. /multifight results are shared between identical requests even without seed, as
+any sample of the matchup is as good as another, /fight results only with a seed. Each
+response has a "meta" entry : latency_ms, sims_run (0 when the result was reused),
+cached and coalesced.
+
+The server only listens on localhost by default, and has no authentication.
+
+Usage:
+
+    python -m libse4x.server --port 8765 -w 4
+    curl -d '{"att": {"S_DESTRO": 4}, "def": ["S_CRUISER", "S_CRUISER"]}' localhost:8765/multifight
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+
+from libse4x import fight
+from libse4x.cache import matchup_key
+from libse4x.cli import DEFAULTS, parse_matchup, run_record
+from libse4x.events import RingBuffer, format_events
+
+# latencies kept for the metrics
+LATENCY_WINDOW = 1000
+
+def run_fight(record):
+    """Result of a single fight of a matchup record, {'error': message} if it is invalid"""
+    try:
+        (att_fleet, att_upgrades, def_fleet, def_upgrades), options = parse_matchup(record, DEFAULTS)
+        if options['seed'] is not None:
+            random.seed(options['seed'])
+        log = RingBuffer() if record.get('log') else None
+        nb_att, nb_def, _, att_cp_lost, def_cp_lost = fight(
+            att_fleet, att_upgrades, def_fleet, def_upgrades, asteroids=options['asteroids'],
+            nebula=options['nebula'], stop_at_round=options['stop_at_round'], events=log)
+    except (ValueError, KeyError, TypeError) as e:
+        return {'error': '{}: {}'.format(e.__class__.__name__, e)}
+    result = {'nb_att': nb_att, 'nb_def': nb_def, 'att_cp_lost': att_cp_lost, 'def_cp_lost': def_cp_lost}
+    if log is not None:
+        result['log'] = list(format_events(log.events(), att_fleet + def_fleet))
+    return result
+
+def warm_up():
+    """Run in each worker at startup, so that libse4x is imported before the first request"""
+    return True
+
+def request_key(endpoint, record):
+    """
+    Key of identical requests, None if the result must not be shared.
+    Raises ValueError, KeyError or TypeError if the request is invalid.
+    """
+    matchup, options = parse_matchup(record, DEFAULTS)
+    if endpoint == '/fight':
+        if options['seed'] is None:
+            return None
+        options['log'] = bool(record.get('log'))
+    return json.dumps([endpoint, matchup_key(*matchup, options['asteroids'], options['nebula']),
+                       sorted(options.items())], default=str)
+
+class SimServer:
+    """
+    HTTP simulation service, see the module documentation
+        host, port      address to listen on, port 0 to pick a free one (see port once started)
+        workers         number of worker processes
+        cache_size      number of results kept in the LRU cache
+    """
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, host='127.0.0.1', port=8765, workers=1, cache_size=1024):
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.cache_size = cache_size
+        self.results = OrderedDict()
+        self.in_flight = {}
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.counters = {'requests': 0, 'errors': 0, 'cached': 0, 'coalesced': 0, 'computed': 0, 'sims_run': 0}
+        self.pool = None
+        self.server = None
+
+    async def start(self):
+        self.pool = ProcessPoolExecutor(max_workers=self.workers)
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*[loop.run_in_executor(self.pool, warm_up) for _ in range(self.workers)])
+        self.server = await asyncio.start_server(self.handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+        self.pool.shutdown()
+
+    async def serve_forever(self):
+        await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+
+    # Requests
+
+    async def handle(self, reader, writer):
+        """Answers one HTTP request"""
+        try:
+            request = await reader.readline()
+            method, path, _ = request.decode('latin-1').split(' ', 2)
+            length = 0
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                if name.strip().lower() == 'content-length':
+                    length = int(value)
+            body = await reader.readexactly(length) if length else b''
+        except (ValueError, asyncio.IncompleteReadError):
+            status, result = 400, {'error': 'malformed HTTP request'}
+        else:
+            try:
+                status, result = await self.dispatch(method, path, body)
+            except Exception as e: # pylint: disable=broad-except
+                # the client always gets an answer, even when the simulation fails unexpectedly
+                self.counters['errors'] += 1
+                status, result = 500, {'error': '{}: {}'.format(e.__class__.__name__, e)}
+        try:
+            data = json.dumps(result).encode()
+            writer.write('HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\n'
+                         'Connection: close\r\n\r\n'.format(status, STATUS_TEXT[status], len(data)).encode() + data)
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def dispatch(self, method, path, body):
+        """(HTTP status, JSON result) of a request"""
+        if path == '/metrics':
+            return (200, self.metrics()) if method == 'GET' else (405, {'error': 'use GET'})
+        if path not in ('/fight', '/multifight'):
+            return 404, {'error': 'unknown path {}'.format(path)}
+        if method != 'POST':
+            return 405, {'error': 'use POST'}
+
+        start = time.perf_counter()
+        self.counters['requests'] += 1
+        try:
+            record = json.loads(body)
+            if not isinstance(record, dict):
+                raise ValueError('a matchup must be a JSON object')
+            key = request_key(path, record)
+        except (ValueError, KeyError, TypeError) as e:
+            self.counters['errors'] += 1
+            return 400, {'error': '{}: {}'.format(e.__class__.__name__, e)}
+
+        # the id is not part of the shared result
+        request_id = record.pop('id', None)
+        result, meta = await self.get_result(path, record, key)
+        meta['latency_ms'] = 1000. * (time.perf_counter() - start)
+        self.latencies.append(meta['latency_ms'])
+        if 'error' in result:
+            self.counters['errors'] += 1
+            return 400, result
+        response = dict(result, meta=meta)
+        if request_id is not None:
+            response['id'] = request_id
+        return 200, response
+
+    async def get_result(self, path, record, key):
+        """(result, meta) of a valid request, reused from the cache or identical running requests"""
+        meta = {'sims_run': 0, 'cached': False, 'coalesced': False}
+        if key is not None and key in self.results:
+            self.results.move_to_end(key)
+            self.counters['cached'] += 1
+            meta['cached'] = True
+            return self.results[key], meta
+        if key is not None and key in self.in_flight:
+            self.counters['coalesced'] += 1
+            meta['coalesced'] = True
+            return await asyncio.shield(self.in_flight[key]), meta
+
+        loop = asyncio.get_running_loop()
+        if path == '/fight':
+            future = loop.run_in_executor(self.pool, run_fight, record)
+        else:
+            future = loop.run_in_executor(self.pool, run_record, record, DEFAULTS)
+        if key is not None:
+            self.in_flight[key] = future
+        try:
+            result = await future
+        finally:
+            self.in_flight.pop(key, None)
+        self.counters['computed'] += 1
+        meta['sims_run'] = result.get('nb_sims', 1) if 'error' not in result else 0
+        self.counters['sims_run'] += meta['sims_run']
+        if key is not None and 'error' not in result:
+            self.results[key] = result
+            if len(self.results) > self.cache_size:
+                self.results.popitem(last=False)
+        return result, meta
+
+    def metrics(self):
+        """Counters, and latencies in ms of the last requests"""
+        latencies = sorted(self.latencies)
+        result = dict(self.counters, in_flight=len(self.in_flight), cache_entries=len(self.results))
+        if latencies:
+            result.update({
+                'latency_mean_ms': sum(latencies) / len(latencies),
+                'latency_p50_ms': latencies[len(latencies) // 2],
+                'latency_p95_ms': latencies[min(len(latencies) - 1, int(.95 * len(latencies)))],
+                'latency_max_ms': latencies[-1],
+            })
+        return result
+
+STATUS_TEXT = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+               500: 'Internal Server Error'}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n', maxsplit=1)[0])
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on')
+    parser.add_argument('-p', '--port', type=int, default=8765, help='port to listen on')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='number of worker processes')
+    parser.add_argument('--cache-size', type=int, default=1024, help='number of results kept in memory')
+    args = parser.parse_args(argv)
+    server = SimServer(args.host, args.port, args.workers, args.cache_size)
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
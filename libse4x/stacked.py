@@ -0,0 +1,284 @@
+"""
+Stacked fight engine : identical ships simulated as counted groups.
+
+fight() handles every ship on its own, which makes fleets like [S_FIGHTER]*30 + [S_CARRIER]*10
+slow although identical undamaged ships all behave the same. Here each side is made of
+groups of ships with the same type, upgrades, firing order, hp and skip-until, with a count.
+
+All the shots of a group at the same kind of target are resolved with a single binomial
+draw : as long as the hits can't use up the target group, every shot has the same target
+type and the same to-hit score, whatever the previous shots did. Hits are then applied in
+order, killing whole ships and wounding at most one, which is split off its group. Boarding
+shots are still resolved one by one, each capture splitting off the captured ship.
+
+The rules and targets are the same as fight(), the results have the same distribution but
+not the same rolls : the cost of a round grows with the number of distinct groups instead
+of the number of ships.
+
+Example usage:
+
+    from libse4x import Upgrades
+    from libse4x.stacked import stacked_stats
+    from libse4x.ships import *
+
+    stats = stacked_stats([S_DREAD]*8, Upgrades(attack=3, defense=3),
+                          [S_FIGHTER]*30 + [S_CARRIER]*10, Upgrades(attack=1, defense=1, fighter=3),
+                          nb_sims=2000)
+    stats.show()
+"""
+
+import random
+from bisect import bisect
+from copy import copy
+from math import comb
+from operator import itemgetter
+
+from libse4x import ATTACKER, DEFENDER, SIDES, compile_tohit, init_ships, round_class, target_priority
+from libse4x.stats import FightStats
+
+# BINOMIAL_CDFS[nb_dice, tohit] = cumulative distribution of the hits of nb_dice dice
+BINOMIAL_CDFS = {}
+
+def binomial_cdf(nb_dice, tohit):
+    """Cumulative distribution of the number of hits of nb_dice d10 rolls <= tohit"""
+    key = (nb_dice, tohit)
+    cdf = BINOMIAL_CDFS.get(key)
+    if cdf is None:
+        chance = min(max(tohit, 0), 10) / 10.
+        cdf = []
+        total = 0.
+        for hits in range(nb_dice + 1):
+            total += comb(nb_dice, hits) * chance ** hits * (1. - chance) ** (nb_dice - hits)
+            cdf.append(total)
+        if len(BINOMIAL_CDFS) > 10000:
+            BINOMIAL_CDFS.clear()
+        BINOMIAL_CDFS[key] = cdf
+    return cdf
+
+def roll_hits(nb_dice, tohit, rng=random):
+    """Number of hits of nb_dice d10 rolls <= tohit, with a single random draw of rng"""
+    cdf = binomial_cdf(nb_dice, tohit)
+    return min(bisect(cdf, rng.random() * cdf[-1]), nb_dice)
+
+def init_groups(att_fleet, att_upgrades, def_fleet, def_upgrades, asteroids=False, nebula=False):
+    """
+    Start of a fight, returns (groups, tohit_table, immortal) :
+        groups          groups of both fleets, in firing order
+        tohit_table     to-hit table of the fight (see compile_tohit())
+        immortal        side with the immortal power, None if none
+    Groups are extended ship dictionaries (see fight()) with in addition :
+        count       number of ships in the group
+        tid         type index in the to-hit table (see compile_tohit())
+        key         position in the firing order, ties of order are broken by key
+        firedround  last round the group fired
+    Only identical ships next to each other in the firing order are grouped, so that
+    ships of the same order keep firing in the same sequence as in fight().
+    """
+    if att_upgrades.immortal:
+        immortal = ATTACKER
+    elif def_upgrades.immortal:
+        immortal = DEFENDER
+    else:
+        immortal = None
+
+    # terrain cancels upgrades, on copies to leave the caller's upgrades untouched
+    if asteroids or nebula:
+        att_upgrades = copy(att_upgrades)
+        def_upgrades = copy(def_upgrades)
+    if asteroids:
+        att_upgrades.attack = 0
+        def_upgrades.attack = 0
+    if nebula:
+        att_upgrades.defense = 0
+        def_upgrades.defense = 0
+
+    ships = (init_ships(att_fleet, att_upgrades, ATTACKER, asteroids, nebula)
+             + init_ships(def_fleet, def_upgrades, DEFENDER, asteroids, nebula))
+    tids, types, table = compile_tohit(ships)
+    for ship, tid in zip(ships, tids):
+        ship['tid'] = tid
+        ship['type'] = types[tid]
+    groups = []
+    for ship in sorted(ships, key=itemgetter('order')):
+        last = groups[-1] if groups else None
+        if last is not None and (last['tid'], last['order'], last['hp']) == (ship['tid'], ship['order'], ship['hp']):
+            last['count'] += 1
+            continue
+        ship['count'] = 1
+        ship['key'] = (len(groups),)
+        ship['firedround'] = 0
+        groups.append(ship)
+    return groups, table, immortal
+
+def split_group(groups, group, count):
+    """
+    Splits the first count ships off group, returns them as a new group placed just
+    before the rest of group in groups
+    """
+    first = dict(group, count=count, key=group['key'] + (0,))
+    group['count'] -= count
+    group['key'] += (1,)
+    groups.insert(next(i for i, x in enumerate(groups) if x is group), first)
+    return first
+
+def find_target(groups, side):
+    """Same target as find_defender(), as the group of the ship, None if there is no enemy left"""
+    found = None
+    found_prio = None
+    for group in groups:
+        if group['side'] == side or group['count'] <= 0:
+            continue
+        prio = target_priority(group)
+        if found is None or (prio, group['key']) < (found_prio, found['key']):
+            found = group
+            found_prio = prio
+    return found
+
+def fight_stacked(att_fleet, att_upgrades, def_fleet, def_upgrades, asteroids=False, nebula=False,
+                  stop_at_round=None, stats=None, rng=random):
+    """
+    Simulate a full fight between att_fleet and def_fleet with ships stacked in groups.
+    Input : same as fight(), plus
+        rng             random generator the rolls come from (random.Random), the random module by default
+    Returns (nb_att, nb_def, groups, att_cp_lost, def_cp_lost) as fight(), with the groups
+    of ships left instead of the ships (see init_groups()).
+    """
+    return fight_groups(*init_groups(att_fleet, att_upgrades, def_fleet, def_upgrades, asteroids, nebula),
+                        stop_at_round, stats, rng)
+
+def fight_groups(groups, tohit_table, immortal, stop_at_round=None, stats=None, rng=random):
+    """
+    Fights from groups returned by init_groups(), which are updated in place.
+    Returns the same as fight_stacked().
+    """
+    # pylint: disable=too-many-locals, too-many-branches, too-many-statements
+    att_cp_lost = 0
+    def_cp_lost = 0
+    nb_att = sum(x['count'] for x in groups if x['side'] == ATTACKER)
+    nb_def = sum(x['count'] for x in groups if x['side'] == DEFENDER)
+    nb_round = 1
+    last_round = 0
+    capture = False
+
+    while nb_att > 0 and nb_def > 0:
+        groups = [x for x in groups if x['count'] > 0]
+        # captured ships change order, and are sorted again as in fight()
+        if capture:
+            groups.sort(key=itemgetter('order', 'key'))
+            for i, group in enumerate(groups):
+                group['key'] = (i,)
+            capture = False
+
+        if nb_att >= 2 * nb_def:
+            fleet_bonus = ATTACKER
+        elif nb_def >= 2 * nb_att:
+            fleet_bonus = DEFENDER
+        else:
+            fleet_bonus = None
+        immortal_used = False
+        round_table = tohit_table[round_class(nb_round)]
+
+        # groups split during the round are inserted in groups, before the rest of the group
+        i = 0
+        while i < len(groups) and nb_att > 0 and nb_def > 0:
+            att_group = groups[i]
+            i += 1
+            if att_group['count'] <= 0 or att_group['skipuntil'] > nb_round or att_group['firedround'] == nb_round:
+                continue
+            att_group['firedround'] = nb_round
+            att_type = att_group['type']
+            bonus = 1 if att_group['side'] == fleet_bonus else 0
+            by_att = round_table[bonus][SIDES.index(att_group['side'])][att_group['tid']]
+            damage = 2 if att_type.titan else 1
+            shots = att_group['count']
+
+            while shots > 0:
+                def_group = find_target(groups, att_group['side'])
+                if def_group is None:
+                    break
+                tohit = by_att[def_group['tid']]
+                if tohit is None:
+                    # the group can't hit its target, which won't change
+                    break
+
+                if att_type.boarding:
+                    shots -= 1
+                    if roll_hits(1, tohit, rng) == 0:
+                        continue
+                    captured = split_group(groups, def_group, 1)
+                    capture = True
+                    if captured['side'] == DEFENDER:
+                        nb_def -= 1
+                        nb_att += 1
+                        captured['side'] = ATTACKER
+                        prio_malus = .1
+                        def_cp_lost += captured['cost']
+                        att_cp_lost -= captured['cost']
+                    else:
+                        nb_def += 1
+                        nb_att -= 1
+                        captured['side'] = DEFENDER
+                        prio_malus = 0
+                        def_cp_lost -= captured['cost']
+                        att_cp_lost += captured['cost']
+                    captured['order'] = (captured['prio'] + .8 + prio_malus
+                                         - (captured['upgrades'].tactics + captured.get('tactics', 0)) / 5)
+                    captured['skipuntil'] = nb_round + 2
+                    captured['firedround'] = nb_round
+                    continue
+
+                # shots that can't use up the target group all have the same target type
+                hits_per_ship = -(-def_group['hp'] // damage)
+                nb_dice = min(shots, def_group['count'] * hits_per_ship)
+                hit_damage = damage
+                absorb = immortal == def_group['side'] and not immortal_used
+                if absorb and damage > 1:
+                    # the immortal only cancels 1 of the 2 damage of a titan, this shot is rolled alone
+                    nb_dice = 1
+                shots -= nb_dice
+                hits = roll_hits(nb_dice, tohit, rng)
+                if hits and absorb:
+                    immortal_used = True
+                    if damage > 1:
+                        hit_damage = 1
+                        hits_per_ship = -(-def_group['hp'] // hit_damage)
+                    else:
+                        hits -= 1
+                if not hits:
+                    continue
+
+                kills, wounds = divmod(hits, hits_per_ship)
+                if kills:
+                    def_group['count'] -= kills
+                    if def_group['side'] == DEFENDER:
+                        nb_def -= kills
+                        def_cp_lost += kills * def_group['cost']
+                    else:
+                        nb_att -= kills
+                        att_cp_lost += kills * def_group['cost']
+                if wounds:
+                    wounded = split_group(groups, def_group, 1) if def_group['count'] > 1 else def_group
+                    wounded['hp'] -= wounds * hit_damage
+
+        last_round = nb_round
+        if stop_at_round and nb_round >= stop_at_round:
+            break
+        nb_round += 1
+
+    if stats is not None:
+        stats.add(nb_att, nb_def, att_cp_lost, def_cp_lost, last_round)
+    return (nb_att, nb_def, [x for x in groups if x['count'] > 0], att_cp_lost, def_cp_lost)
+
+def stacked_stats(att_fleet, att_upgrades, def_fleet, def_upgrades, nb_sims=2000, asteroids=False, nebula=False,
+                  stop_at_round=None, seed=None):
+    """
+    Runs nb_sims fights with fight_stacked(), returns their FightStats
+    If seed is given, the rolls come from a generator seeded with it, for reproducible results.
+    """
+    rng = random.Random(seed)
+    stats = FightStats(len(att_fleet), len(def_fleet))
+    # the groups of the fleets are built once, and copied for each fight
+    groups, tohit_table, immortal = init_groups(att_fleet, att_upgrades, def_fleet, def_upgrades, asteroids, nebula)
+    for _ in range(nb_sims):
+        fight_groups([dict(x) for x in groups], tohit_table, immortal, stop_at_round, stats, rng)
+    return stats
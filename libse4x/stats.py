@@ -0,0 +1,319 @@
+"""
+Statistics of multiple fights between the same fleets.
+
+FightStats accumulates the outcome of each fight: wins, draws, CP lost on each side
+(sums and sums of squares, for means and variances), number of rounds to resolution
+and number of surviving ships. Stats of separate runs (e.g. worker processes) can be
+merged, and printing is left to format()/show().
+
+PairedStats records the fight by fight differences between two setups fought with
+the same dice (see libse4x.compare).
+"""
+
+from collections import Counter
+from math import sqrt
+
+# z-score of a 95% two-sided confidence interval
+Z95 = 1.96
+
+def wilson_interval(successes, trials, z=Z95):
+    """Wilson score confidence interval (low, high) of a proportion"""
+    if not trials:
+        return 0., 1.
+    rate = successes / trials
+    denominator = 1 + z * z / trials
+    center = (rate + z * z / (2 * trials)) / denominator
+    spread = z * sqrt(rate * (1 - rate) / trials + z * z / (4 * trials * trials)) / denominator
+    return max(0., center - spread), min(1., center + spread)
+
+def mean_interval(total, total_sq, count, z=Z95):
+    """Normal confidence interval (low, high) of a mean, from the sum and sum of squares of the values"""
+    if not count:
+        return 0., 0.
+    mean = total / count
+    spread = z * sqrt(sample_variance(total, total_sq, count) / count)
+    return mean - spread, mean + spread
+
+def sample_variance(total, total_sq, count):
+    """Unbiased variance of values, from their sum and sum of squares"""
+    if count < 2:
+        return 0.
+    return max(0., (total_sq - total * total / count) / (count - 1))
+
+class FightStats:
+    """
+    Aggregated results of multiple fights
+        nb_sims         number of fights
+        att_wins        fights won by the attacker (no defender left)
+        def_wins        fights won by the defender (no attacker left)
+        draws           fights stopped with ships left on both sides (stop_at_round)
+        att_cp_lost     total CP lost by the attacker, att_cp_lost_sq the total of the squares
+        def_cp_lost     total CP lost by the defender, def_cp_lost_sq the total of the squares
+        rounds          {number of rounds: number of fights}
+        survivors       {(attacking ships left, defending ships left): number of fights}
+        att_size        number of ships in the attacking fleet, for display
+        def_size        number of ships in the defending fleet, for display
+    """
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, att_size=0, def_size=0):
+        self.nb_sims = 0
+        self.att_wins = 0
+        self.def_wins = 0
+        self.draws = 0
+        self.att_cp_lost = 0
+        self.att_cp_lost_sq = 0
+        self.def_cp_lost = 0
+        self.def_cp_lost_sq = 0
+        self.rounds = Counter()
+        self.survivors = Counter()
+        self.att_size = att_size
+        self.def_size = def_size
+
+    def add(self, nb_att, nb_def, att_cp_lost, def_cp_lost, rounds):
+        """Records the result of one fight"""
+        self.nb_sims += 1
+        if nb_att == 0:
+            self.def_wins += 1
+        elif nb_def == 0:
+            self.att_wins += 1
+        else:
+            self.draws += 1
+        self.att_cp_lost += att_cp_lost
+        self.att_cp_lost_sq += att_cp_lost * att_cp_lost
+        self.def_cp_lost += def_cp_lost
+        self.def_cp_lost_sq += def_cp_lost * def_cp_lost
+        self.rounds[rounds] += 1
+        self.survivors[(nb_att, nb_def)] += 1
+
+    def merge(self, other):
+        """Adds the fights recorded in other FightStats, returns self"""
+        self.nb_sims += other.nb_sims
+        self.att_wins += other.att_wins
+        self.def_wins += other.def_wins
+        self.draws += other.draws
+        self.att_cp_lost += other.att_cp_lost
+        self.att_cp_lost_sq += other.att_cp_lost_sq
+        self.def_cp_lost += other.def_cp_lost
+        self.def_cp_lost_sq += other.def_cp_lost_sq
+        self.rounds.update(other.rounds)
+        self.survivors.update(other.survivors)
+        self.att_size = self.att_size or other.att_size
+        self.def_size = self.def_size or other.def_size
+        return self
+
+    @classmethod
+    def merged(cls, all_stats):
+        """New FightStats with the fights of all the given FightStats"""
+        result = cls()
+        for stats in all_stats:
+            result.merge(stats)
+        return result
+
+    def as_dict(self):
+        """JSON compatible dictionary of the stats"""
+        result = dict(self.__dict__)
+        result['rounds'] = sorted(self.rounds.items())
+        result['survivors'] = sorted([nb_att, nb_def, count] for (nb_att, nb_def), count in self.survivors.items())
+        return result
+
+    @classmethod
+    def from_dict(cls, values):
+        """FightStats from a dictionary returned by as_dict()"""
+        result = cls()
+        result.__dict__.update(values)
+        result.rounds = Counter({nb_round: count for nb_round, count in values['rounds']})
+        result.survivors = Counter({(nb_att, nb_def): count for nb_att, nb_def, count in values['survivors']})
+        return result
+
+    def __eq__(self, other):
+        return isinstance(other, FightStats) and self.__dict__ == other.__dict__
+
+    def __repr__(self):
+        return '<FightStats {}>'.format(self.format_short())
+
+    # Rates and means
+
+    @property
+    def att_win_rate(self):
+        return self.att_wins / self.nb_sims if self.nb_sims else 0.
+
+    @property
+    def def_win_rate(self):
+        return self.def_wins / self.nb_sims if self.nb_sims else 0.
+
+    @property
+    def draw_rate(self):
+        return self.draws / self.nb_sims if self.nb_sims else 0.
+
+    @property
+    def att_cp_mean(self):
+        return self.att_cp_lost / self.nb_sims if self.nb_sims else 0.
+
+    @property
+    def def_cp_mean(self):
+        return self.def_cp_lost / self.nb_sims if self.nb_sims else 0.
+
+    @property
+    def att_cp_var(self):
+        return sample_variance(self.att_cp_lost, self.att_cp_lost_sq, self.nb_sims)
+
+    @property
+    def def_cp_var(self):
+        return sample_variance(self.def_cp_lost, self.def_cp_lost_sq, self.nb_sims)
+
+    @property
+    def rounds_mean(self):
+        return sum(k * v for k, v in self.rounds.items()) / self.nb_sims if self.nb_sims else 0.
+
+    # Confidence intervals
+
+    def att_win_ci(self, z=Z95):
+        return wilson_interval(self.att_wins, self.nb_sims, z)
+
+    def def_win_ci(self, z=Z95):
+        return wilson_interval(self.def_wins, self.nb_sims, z)
+
+    def att_cp_ci(self, z=Z95):
+        return mean_interval(self.att_cp_lost, self.att_cp_lost_sq, self.nb_sims, z)
+
+    def def_cp_ci(self, z=Z95):
+        return mean_interval(self.def_cp_lost, self.def_cp_lost_sq, self.nb_sims, z)
+
+    def is_settled(self, target_ci, att_cost, def_cost, z=Z95):
+        """
+        True when the confidence intervals are narrow enough : the win rates are known within
+        +/- target_ci, and the CP lost within +/- target_ci times the CP cost of each fleet
+        """
+        if self.nb_sims < 2:
+            return False
+        for low, high in (self.att_win_ci(z), self.def_win_ci(z)):
+            if (high - low) / 2 > target_ci:
+                return False
+        for (low, high), cost in ((self.att_cp_ci(z), att_cost), (self.def_cp_ci(z), def_cost)):
+            if (high - low) / 2 > target_ci * max(cost, 1):
+                return False
+        return True
+
+    # Formatting
+
+    def format_short(self):
+        """One line summary : 'ATT%-DEF%/ATT lost-DEF lost'"""
+        return '{:2.0f}%-{:2.0f}%/{:.0f}-{:.0f}'.format(
+            100. * self.att_win_rate, 100. * self.def_win_rate, self.att_cp_mean, self.def_cp_mean)
+
+    def format(self):
+        """Same output as multifight() prints"""
+        line = '{:5} sims, ATT({}) won {:2.0f}% [lost:{:.1f}], DEF({}) won {:2.0f}% [lost:{:.1f}]'.format(
+            self.nb_sims,
+            self.att_size, 100. * self.att_win_rate, self.att_cp_mean,
+            self.def_size, 100. * self.def_win_rate, self.def_cp_mean,
+        )
+        if self.draws:
+            line += ', draws {:2.0f}%'.format(100. * self.draw_rate)
+        return line + '\n' + self.format_short()
+
+    def show(self):
+        """Prints the results"""
+        print(self.format())
+
+class PairedStats:
+    """
+    Differences between two setups A and B fought with the same dice, fight by fight
+        nb_sims         number of pairs of fights
+        a, b            FightStats of each setup
+        att_win_diff    total of (A won) - (B won) for the attacker, xyz_sq the total of the squares
+        att_cp_diff     total of (CP lost in A) - (CP lost in B) by the attacker
+        def_cp_diff     total of (CP lost in A) - (CP lost in B) by the defender
+    As both fights of a pair see the same rolls, their difference varies much less than the
+    one of independent fights, and its confidence intervals are narrower.
+    """
+
+    def __init__(self, att_size=0, def_size=0):
+        self.nb_sims = 0
+        self.a = FightStats(att_size, def_size)
+        self.b = FightStats(att_size, def_size)
+        self.att_win_diff = 0
+        self.att_win_diff_sq = 0
+        self.att_cp_diff = 0
+        self.att_cp_diff_sq = 0
+        self.def_cp_diff = 0
+        self.def_cp_diff_sq = 0
+
+    def add(self, result_a, result_b):
+        """Records a pair of fight() results, already added to a and b"""
+        nb_att_a, nb_def_a, _, att_cp_a, def_cp_a = result_a
+        nb_att_b, nb_def_b, _, att_cp_b, def_cp_b = result_b
+        win_diff = int(nb_att_a > 0 and nb_def_a == 0) - int(nb_att_b > 0 and nb_def_b == 0)
+        att_cp_diff = att_cp_a - att_cp_b
+        def_cp_diff = def_cp_a - def_cp_b
+        self.nb_sims += 1
+        self.att_win_diff += win_diff
+        self.att_win_diff_sq += win_diff * win_diff
+        self.att_cp_diff += att_cp_diff
+        self.att_cp_diff_sq += att_cp_diff * att_cp_diff
+        self.def_cp_diff += def_cp_diff
+        self.def_cp_diff_sq += def_cp_diff * def_cp_diff
+
+    def merge(self, other):
+        """Adds the pairs of fights recorded in other PairedStats, returns self"""
+        self.nb_sims += other.nb_sims
+        self.a.merge(other.a)
+        self.b.merge(other.b)
+        for name in ('att_win_diff', 'att_cp_diff', 'def_cp_diff'):
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+            setattr(self, name + '_sq', getattr(self, name + '_sq') + getattr(other, name + '_sq'))
+        return self
+
+    @classmethod
+    def merged(cls, all_stats):
+        """New PairedStats with the fights of all the given PairedStats"""
+        result = cls()
+        for stats in all_stats:
+            result.merge(stats)
+        return result
+
+    def __eq__(self, other):
+        return isinstance(other, PairedStats) and self.__dict__ == other.__dict__
+
+    # Mean differences, A - B
+
+    @property
+    def att_win_rate_diff(self):
+        return self.att_win_diff / self.nb_sims if self.nb_sims else 0.
+
+    @property
+    def att_cp_mean_diff(self):
+        return self.att_cp_diff / self.nb_sims if self.nb_sims else 0.
+
+    @property
+    def def_cp_mean_diff(self):
+        return self.def_cp_diff / self.nb_sims if self.nb_sims else 0.
+
+    # Paired confidence intervals
+
+    def att_win_diff_ci(self, z=Z95):
+        return mean_interval(self.att_win_diff, self.att_win_diff_sq, self.nb_sims, z)
+
+    def att_cp_diff_ci(self, z=Z95):
+        return mean_interval(self.att_cp_diff, self.att_cp_diff_sq, self.nb_sims, z)
+
+    def def_cp_diff_ci(self, z=Z95):
+        return mean_interval(self.def_cp_diff, self.def_cp_diff_sq, self.nb_sims, z)
+
+    # Formatting
+
+    def format(self):
+        """Results of both setups, and their differences with 95% confidence intervals"""
+        lines = ['A: ' + self.a.format_short(), 'B: ' + self.b.format_short()]
+        for label, diff, (low, high), scale, unit in (
+                ('ATT win rate', self.att_win_rate_diff, self.att_win_diff_ci(), 100., '%'),
+                ('ATT CP lost', self.att_cp_mean_diff, self.att_cp_diff_ci(), 1., ''),
+                ('DEF CP lost', self.def_cp_mean_diff, self.def_cp_diff_ci(), 1., '')):
+            lines.append('{:12} A-B {:+6.1f}{} [{:+.1f}{}, {:+.1f}{}]'.format(
+                label, scale * diff, unit, scale * low, unit, scale * high, unit))
+        return '{:5} paired sims\n'.format(self.nb_sims) + '\n'.join(lines)
+
+    def show(self):
+        """Prints the results"""
+        print(self.format())
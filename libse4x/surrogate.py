@@ -0,0 +1,253 @@
+"""
+Surrogate model : instant estimates of a matchup, learnt from simulation results.
+
+Each matchup is described by a feature vector : number of ships of each type of
+libse4x.ships, number of ships and summed attack, defense, hp and cost of each side, every
+Upgrades field of each side, and asteroids/nebula. The model is a distance weighted
+k-nearest neighbours local linear regression over a corpus of simulated matchups (from
+multisim() or sweep() results), in features scaled by their spread over the corpus.
+
+Each prediction has an uncertainty on the attacker's win rate : the spread of the win
+rates of the neighbours and the distance to them, scaled so that it matches the
+leave-one-out errors on the corpus, combined with the sampling error of the neighbours.
+estimate() falls back to simulating the matchup when the uncertainty is too high or the
+matchup is too far from the corpus.
+
+A model is saved to a single .npz file, loaded in milliseconds.
+
+Requires numpy.
+
+Example usage:
+
+    from libse4x import Upgrades, multisim
+    from libse4x.surrogate import Surrogate
+    from libse4x.ships import *
+
+    fleets = [([S_SCOUT]*n, Upgrades(attack=a)) for n in range(2, 12) for a in range(3)]
+    defenders = [([S_DESTRO]*n, Upgrades()) for n in range(2, 8)]
+    model = Surrogate()
+    model.add_multisim(fleets, defenders, multisim(fleets, defenders, 1000, workers=4, show=False))
+    model.train()
+    model.save('scouts.npz')
+
+    model = Surrogate.load('scouts.npz')
+    print(model.estimate([S_SCOUT]*7, Upgrades(attack=1), [S_DESTRO]*4, Upgrades()))
+"""
+
+import json
+from collections import namedtuple
+from copy import copy
+
+try:
+    import numpy as np
+except ImportError: # pragma: no cover
+    np = None
+
+from libse4x import Upgrades, run_matchup
+from libse4x import ships as ship_types
+
+# names of the ship types counted in the features
+SHIP_NAMES = sorted({value['name'] for name, value in vars(ship_types).items()
+                     if name.startswith('S_') and isinstance(value, dict)})
+UPGRADE_FIELDS = sorted(Upgrades().__dict__)
+
+FEATURE_NAMES = (
+    ['{}_{}'.format(side, name) for side in ('att', 'def')
+     for name in SHIP_NAMES + ['ships', 'att', 'def', 'hp', 'cost'] + ['up_' + x for x in UPGRADE_FIELDS]]
+    + ['asteroids', 'nebula'])
+
+# ridge regularization of the slopes of the local linear fits
+RIDGE = .01
+
+# weight of the distance to the nearest neighbours in the uncertainty : a matchup at
+# distance 1 (one standard deviation of one feature) adds this much to the win rate error
+DISTANCE_WEIGHT = .02
+
+Prediction = namedtuple('Prediction', ['att_win', 'att_cp_lost', 'def_cp_lost', 'uncertainty', 'distance',
+                                       'simulated'])
+
+def side_features(fleet, upgrades):
+    """Features of one side of a matchup, in FEATURE_NAMES order"""
+    counts = dict.fromkeys(SHIP_NAMES, 0)
+    for ship in fleet:
+        if ship['name'] in counts:
+            counts[ship['name']] += 1
+    return ([counts[name] for name in SHIP_NAMES]
+            + [len(fleet), sum(x['att'] for x in fleet), sum(x['def'] for x in fleet),
+               sum(x['size'] for x in fleet), sum(x['cost'] for x in fleet)]
+            + [float(getattr(upgrades, field)) for field in UPGRADE_FIELDS])
+
+def matchup_features(att_fleet, att_upgrades, def_fleet, def_upgrades, asteroids=False, nebula=False):
+    """Feature vector of a matchup, see FEATURE_NAMES"""
+    return (side_features(att_fleet, att_upgrades) + side_features(def_fleet, def_upgrades)
+            + [float(bool(asteroids)), float(bool(nebula))])
+
+class Surrogate:
+    """
+    k-nearest neighbours model of matchup results, see the module documentation
+        k               number of neighbours of a prediction
+        features        feature vector of each matchup of the corpus
+        targets         [att win rate, att CP lost, def CP lost, number of fights] of each matchup
+    train() must be called after adding matchups, before predicting.
+    """
+
+    def __init__(self, k=8):
+        if np is None:
+            raise ImportError('Surrogate requires numpy')
+        self.k = k
+        self.features = []
+        self.targets = []
+        # trained model
+        self.center = None
+        self.scale = None
+        self.points = None
+        self.values = None
+        self.calibration = 1.
+
+    # Corpus
+
+    def add(self, stats, att_fleet, att_upgrades, def_fleet, def_upgrades, asteroids=False, nebula=False):
+        """Adds the FightStats of a matchup to the corpus"""
+        if not stats.nb_sims:
+            return
+        self.features.append(matchup_features(att_fleet, att_upgrades, def_fleet, def_upgrades, asteroids, nebula))
+        self.targets.append([stats.att_win_rate, stats.att_cp_mean, stats.def_cp_mean, stats.nb_sims])
+
+    def add_multisim(self, attackers, defenders, results, asteroids=False, nebula=False):
+        """Adds the results[i_att][i_def] returned by multisim(attackers, defenders, ...)"""
+        for (att_fleet, att_upgrades), row in zip(attackers, results):
+            for (def_fleet, def_upgrades), stats in zip(defenders, row):
+                self.add(stats, att_fleet, att_upgrades, def_fleet, def_upgrades, asteroids, nebula)
+
+    def add_sweep(self, result, att_fleet, def_fleet, att_upgrades=None, def_upgrades=None, asteroids=False,
+                  nebula=False):
+        """Adds every cell of a SweepResult returned by sweep(att_fleet, def_fleet, ...)"""
+        # pylint: disable=too-many-arguments
+        shape = result.shape
+        for index in np.ndindex(*shape):
+            ups = {'att': copy(att_upgrades or Upgrades()), 'def': copy(def_upgrades or Upgrades())}
+            for (name, values), i in zip(result.axes, index):
+                side, field = name.split('_', 1)
+                setattr(ups[side], field, values[i])
+            self.add(result[index], att_fleet, ups['att'], def_fleet, ups['def'], asteroids, nebula)
+
+    # Model
+
+    def train(self):
+        """Scales the features of the corpus, and calibrates the uncertainty by leave-one-out"""
+        features = np.array(self.features, dtype=float)
+        self.center = features.mean(axis=0)
+        spread = features.std(axis=0)
+        # features that never change in the corpus keep their units
+        self.scale = np.where(spread > 0, spread, 1.)
+        self.scale_points()
+
+        self.calibration = 1.
+        if len(self.points) > self.k + 1:
+            # squared leave-one-out errors, without the sampling noise of the left out matchup
+            # and of its neighbours, compared to the squared model errors
+            residuals = []
+            errors = []
+            for i, point in enumerate(self.points):
+                win, _, _, error, sampling, _ = self.neighbours(point, exclude=i)
+                win_i, _, _, nb_sims = self.values[i]
+                residuals.append(np.square(win - win_i) - sampling - win_i * (1 - win_i) / nb_sims)
+                errors.append(np.square(error))
+            self.calibration = float(np.sqrt(max(np.mean(residuals), 0.) / max(np.mean(errors), 1e-12)))
+        return self
+
+    def scale_points(self):
+        """Scaled features and targets of the corpus, with the current center and scale"""
+        self.points = (np.array(self.features, dtype=float).reshape(-1, len(FEATURE_NAMES))
+                       - self.center) / self.scale
+        self.values = np.array(self.targets, dtype=float).reshape(-1, 4)
+
+    def neighbours(self, point, exclude=None):
+        """
+        Weighted average of the neighbours of a scaled point, returns
+        (att_win, att_cp_lost, def_cp_lost, model error, sampling variance, distance)
+        """
+        distances = np.sqrt(np.square(self.points - point).sum(axis=1))
+        if exclude is not None:
+            distances[exclude] = np.inf
+        k = min(self.k, len(distances) - (exclude is not None))
+        nearest = np.argpartition(distances, k - 1)[:k]
+        weights = 1. / (distances[nearest] + 1e-3)
+        weights /= weights.sum()
+        values = self.values[nearest]
+        # local linear fit of the targets around the point, with ridge regularization of the slopes
+        offsets = np.hstack([np.ones((k, 1)), self.points[nearest] - point])
+        weighted = offsets.T * weights
+        regularization = RIDGE * np.eye(offsets.shape[1])
+        regularization[0, 0] = 0.
+        intercept = np.linalg.solve(weighted @ offsets + regularization, weighted @ values[:, :3])[0]
+        win = min(max(intercept[0], 0.), 1.)
+        att_cp, def_cp = intercept[1:]
+        # model error from the spread of the neighbours and the distance to them, to be calibrated,
+        # and variance of the average from the sampling error of their win rates
+        spread = weights @ np.square(values[:, 0] - win)
+        distance = float(weights @ distances[nearest])
+        error = np.sqrt(spread) + DISTANCE_WEIGHT * distance
+        sampling = np.square(weights) @ (values[:, 0] * (1 - values[:, 0]) / values[:, 3])
+        return float(win), float(att_cp), float(def_cp), float(error), float(sampling), distance
+
+    def predict(self, att_fleet, att_upgrades, def_fleet, def_upgrades, asteroids=False, nebula=False):
+        """Prediction of the model for a matchup, uncertainty is the expected error on att_win"""
+        if self.points is None:
+            raise ValueError('the surrogate model must be trained first')
+        point = (np.array(matchup_features(att_fleet, att_upgrades, def_fleet, def_upgrades, asteroids, nebula))
+                 - self.center) / self.scale
+        win, att_cp, def_cp, error, sampling, distance = self.neighbours(point)
+        uncertainty = np.sqrt(np.square(self.calibration * error) + sampling)
+        return Prediction(win, att_cp, def_cp, float(uncertainty), distance, False)
+
+    def estimate(self, att_fleet, att_upgrades, def_fleet, def_upgrades, asteroids=False, nebula=False,
+                 max_uncertainty=.05, max_distance=5., nb_sims=2000, learn=False, **options):
+        """
+        Prediction of the model, or simulated result if the prediction is not reliable enough
+        Input : same as fight(), plus
+            max_uncertainty maximum uncertainty on the attacker's win rate of a prediction
+            max_distance    maximum distance to the neighbours, in scaled features
+            nb_sims         number of fights of the simulation fallback
+            learn           if True, the simulated result is added to the model
+            options         other run_matchup() arguments (workers, seed, cache...)
+        Returns a Prediction, simulated is True when it comes from run_matchup()
+        """
+        # pylint: disable=too-many-arguments
+        prediction = self.predict(att_fleet, att_upgrades, def_fleet, def_upgrades, asteroids, nebula)
+        if prediction.uncertainty <= max_uncertainty and prediction.distance <= max_distance:
+            return prediction
+        stats = run_matchup((att_fleet, att_upgrades, def_fleet, def_upgrades), nb_sims, asteroids, nebula,
+                            **options)
+        if learn:
+            self.add(stats, att_fleet, att_upgrades, def_fleet, def_upgrades, asteroids, nebula)
+            self.scale_points()
+        low, high = stats.att_win_ci()
+        return Prediction(stats.att_win_rate, stats.att_cp_mean, stats.def_cp_mean, (high - low) / 2, 0., True)
+
+    # Storage
+
+    def save(self, path):
+        """Saves the corpus and the trained model to a .npz file"""
+        if self.points is None:
+            raise ValueError('the surrogate model must be trained first')
+        np.savez(path, features=np.array(self.features, dtype=float).reshape(-1, len(FEATURE_NAMES)),
+                 targets=np.array(self.targets, dtype=float).reshape(-1, 4), center=self.center, scale=self.scale,
+                 meta=np.array(json.dumps({'k': self.k, 'calibration': self.calibration,
+                                           'feature_names': FEATURE_NAMES})))
+
+    @classmethod
+    def load(cls, path):
+        """Surrogate saved by save(), ready to predict"""
+        with np.load(path) as data:
+            meta = json.loads(str(data['meta']))
+            if meta['feature_names'] != FEATURE_NAMES:
+                raise ValueError('{} was saved with other features, it must be trained again'.format(path))
+            result = cls(meta['k'])
+            result.features = data['features'].tolist()
+            result.targets = data['targets'].tolist()
+            result.center = data['center']
+            result.scale = data['scale']
+        result.calibration = meta['calibration']
+        result.scale_points()
+        return result
@@ -0,0 +1,186 @@
+"""
+Upgrade sweeps : the same pair of fleets over a grid of upgrade levels on both sides.
+
+Grids give the values of Upgrades fields to sweep, e.g. {'attack': [0, 1, 2, 3], 'tactics': [0, 1]}.
+Many cells of a grid are the same fight : upgrades are capped by hull size (attack 3 on a
+scout is attack 1), some upgrades only matter to some ships... Each cell is reduced to
+what the fight engine actually uses (to-hit tables, firing order, hit points, immortal),
+and only one cell of each group of identical fights is simulated. The remaining cells
+are run across worker processes, the slowest ones first.
+
+Example usage:
+
+    from libse4x.sweep import sweep
+    from libse4x.ships import *
+
+    grid = {'attack': [0, 1, 2, 3], 'defense': [0, 1, 2, 3]}
+    result = sweep([S_SCOUT]*6, [S_DESTRO]*4, grid, grid, nb_sims=1000, workers=4)
+    print(result.axes)
+    print(result.values('att_win_rate'))
+    print(result.sel(att_attack=1, att_defense=0, def_attack=0, def_defense=0))
+    print(result.sel(att_attack=1, def_defense=0).values())
+"""
+
+import itertools
+import random
+from concurrent.futures import ProcessPoolExecutor
+from copy import copy
+
+from libse4x import ATTACKER, DEFENDER, Upgrades, compile_tohit, fight_stats, fight_stats_task, init_ships
+
+class SweepResult:
+    """
+    FightStats of each cell of a sweep
+        axes            list of (name, values), names are 'att_<field>' and 'def_<field>'
+        stats           nested lists of FightStats, one level per axis
+        nb_unique       number of distinct fights actually simulated
+    """
+
+    def __init__(self, axes, stats, nb_unique):
+        self.axes = axes
+        self.stats = stats
+        self.nb_unique = nb_unique
+
+    @property
+    def shape(self):
+        return tuple(len(values) for _, values in self.axes)
+
+    def __getitem__(self, index):
+        """FightStats of a cell by position on each axis"""
+        cell = self.stats
+        for i in index:
+            cell = cell[i]
+        return cell
+
+    def sel(self, **labels):
+        """
+        Selection by value on some axes, e.g. sel(att_attack=2, def_defense=1) : the FightStats
+        of a cell if every axis is given, else the SweepResult of the sub-grid over the other axes
+        """
+        unknown = set(labels) - {name for name, _ in self.axes}
+        if unknown:
+            raise KeyError('unknown axes {}, expected some of {}'.format(
+                ', '.join(sorted(unknown)), ', '.join(name for name, _ in self.axes)))
+
+        def select(cell, axes):
+            if not axes:
+                return cell
+            (name, values), rest = axes[0], axes[1:]
+            if name in labels:
+                return select(cell[values.index(labels[name])], rest)
+            return [select(x, rest) for x in cell]
+
+        stats = select(self.stats, self.axes)
+        axes = [(name, values) for name, values in self.axes if name not in labels]
+        if not axes:
+            return stats
+
+        def cells(cell):
+            return [y for x in cell for y in cells(x)] if isinstance(cell, list) else [cell]
+        # identical fights of the sweep share the same FightStats
+        return SweepResult(axes, stats, len({id(x) for x in cells(stats)}))
+
+    def values(self, metric='att_win_rate'):
+        """Nested lists of a FightStats attribute, e.g. 'att_win_rate', 'att_cp_mean'"""
+        def extract(cell):
+            return [extract(x) for x in cell] if isinstance(cell, list) else getattr(cell, metric)
+        return extract(self.stats)
+
+def freeze(value):
+    """Nested lists as nested tuples, to be hashed"""
+    return tuple(freeze(x) for x in value) if isinstance(value, list) else value
+
+def fight_signature(att_fleet, att_upgrades, def_fleet, def_upgrades, asteroids=False, nebula=False):
+    """
+    Everything the fight engine uses from fleets and upgrades : fights with the same
+    signature give the same results
+    """
+    att_upgrades = copy(att_upgrades)
+    def_upgrades = copy(def_upgrades)
+    if asteroids:
+        att_upgrades.attack = 0
+        def_upgrades.attack = 0
+    if nebula:
+        att_upgrades.defense = 0
+        def_upgrades.defense = 0
+    ships = (init_ships(att_fleet, att_upgrades, ATTACKER, asteroids, nebula)
+             + init_ships(def_fleet, def_upgrades, DEFENDER, asteroids, nebula))
+    tids, _, table = compile_tohit(ships)
+    return (
+        tuple(tids), freeze(table),
+        tuple((x['side'], round(x['order'], 6), x['hp'], x['size'], x['prio'], x['cost']) for x in ships),
+        bool(att_upgrades.immortal), bool(def_upgrades.immortal),
+    )
+
+def fight_cost(att_fleet, def_fleet, signature):
+    """Rough estimate of the time of a fight : number of ships times number of rounds to destroy them"""
+    table = signature[1]
+    # average hit chance in the later rounds, without fleet size bonus
+    chances = [max(0, min(10, tohit)) / 10. for by_att in table[-1][0] for row in by_att for tohit in row
+               if tohit is not None]
+    chance = max(sum(chances) / len(chances), .05) if chances else .05
+    hp = sum(x['size'] for x in att_fleet + def_fleet)
+    return (len(att_fleet) + len(def_fleet)) * hp / chance
+
+def grid_cells(grid):
+    """Axes (field, values) and list of {field: value} of every cell of a grid, in row-major order"""
+    axes = sorted(grid.items())
+    return axes, [dict(zip([name for name, _ in axes], values))
+                  for values in itertools.product(*[values for _, values in axes])]
+
+def nest(flat, shape):
+    """Nested lists of the given shape from a flat list in row-major order"""
+    if not shape:
+        return flat[0]
+    size = len(flat) // shape[0]
+    return [nest(flat[i * size:(i + 1) * size], shape[1:]) for i in range(shape[0])]
+
+def sweep(att_fleet, def_fleet, att_upgrade_grid, def_upgrade_grid, att_upgrades=None, def_upgrades=None,
+          nb_sims=2000, asteroids=False, nebula=False, stop_at_round=None, workers=None, seed=None):
+    """
+    Runs nb_sims fights between att_fleet and def_fleet for every combination of upgrades
+    of the grids.
+    Input
+        xyz_upgrade_grid    {Upgrades field: list of values} swept for the xyz fleet
+        xyz_upgrades        Upgrades of the xyz fleet for the fields that are not swept
+        workers             if > 1, number of worker processes running the cells
+        seed                master seed, for reproducible results
+    Returns a SweepResult, with the attacker's axes first then the defender's.
+    Identical fights share the same FightStats.
+    """
+    # pylint: disable=too-many-locals
+    att_axes, att_cells = grid_cells(att_upgrade_grid)
+    def_axes, def_cells = grid_cells(def_upgrade_grid)
+    att_base = att_upgrades or Upgrades()
+    def_base = def_upgrades or Upgrades()
+
+    # group identical fights
+    signatures = []
+    unique = {}
+    for att_values, def_values in itertools.product(att_cells, def_cells):
+        att_up = copy(att_base)
+        att_up.__dict__.update(att_values)
+        def_up = copy(def_base)
+        def_up.__dict__.update(def_values)
+        signature = fight_signature(att_fleet, att_up, def_fleet, def_up, asteroids, nebula)
+        if signature not in unique:
+            unique[signature] = (att_up, def_up)
+        signatures.append(signature)
+
+    rng = random.Random(seed)
+    tasks = {signature: (att_fleet, att_up, def_fleet, def_up, nb_sims, asteroids, nebula, stop_at_round,
+                         rng.getrandbits(64) if seed is not None else None)
+             for signature, (att_up, def_up) in unique.items()}
+
+    if not workers or workers <= 1:
+        results = {signature: fight_stats(*task) for signature, task in tasks.items()}
+    else:
+        # slowest fights first, so that the last ones don't keep a single worker busy
+        order = sorted(tasks, key=lambda x: fight_cost(att_fleet, def_fleet, x), reverse=True)
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = dict(zip(order, pool.map(fight_stats_task, [tasks[x] for x in order])))
+
+    axes = ([('att_' + name, list(values)) for name, values in att_axes]
+            + [('def_' + name, list(values)) for name, values in def_axes])
+    shape = tuple(len(values) for _, values in axes)
+    return SweepResult(axes, nest([results[x] for x in signatures], shape), len(unique))
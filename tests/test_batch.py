@@ -0,0 +1,43 @@
+import random
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from libse4x import Upgrades, fight
+from libse4x.batch import fight_batch
+from libse4x.ships import *
+
+def test_batch_shapes():
+    res = fight_batch([S_SCOUT]*3, Upgrades(), [S_DESTRO]*2, Upgrades(), nb_sims=100, seed=0)
+    assert res.nb_att.shape == (100,)
+    assert ((res.nb_att == 0) | (res.nb_def == 0)).all()
+    assert (res.rounds >= 1).all()
+
+def test_batch_seed():
+    a = fight_batch([S_BOARD]*2, Upgrades(), [S_CRUISER]*2, Upgrades(), nb_sims=200, seed=42)
+    b = fight_batch([S_BOARD]*2, Upgrades(), [S_CRUISER]*2, Upgrades(), nb_sims=200, seed=42)
+    assert (a.att_cp_lost == b.att_cp_lost).all()
+
+def test_batch_stop_at_round():
+    res = fight_batch([S_DREAD]*3, Upgrades(), [S_DREAD]*3, Upgrades(), nb_sims=100, stop_at_round=1, seed=0)
+    assert (res.rounds == 1).all()
+
+def test_batch_matches_fight():
+    # 4000 fight() samples against 20000 fight_batch() samples : tolerances are about 4 standard
+    # errors of the difference, 0.04 on the win rate, 1.5 CP on the mean CP lost by each side, and
+    # 0.06 of total variation distance between the distributions of surviving ships of each side
+    att_fleet, att_upgrades = [S_DREAD]*2, Upgrades(attack=3, defense=3)
+    def_fleet, def_upgrades = [S_FIGHTER]*6 + [S_CARRIER]*2, Upgrades(attack=1, defense=1, fighter=3)
+    random.seed(0)
+    nb_sims = 4000
+    results = [fight(att_fleet, att_upgrades, def_fleet, def_upgrades) for _ in range(nb_sims)]
+    nb_att, nb_def, att_cp_lost, def_cp_lost = (np.array([x[i] for x in results]) for i in (0, 1, 3, 4))
+    res = fight_batch(att_fleet, att_upgrades, def_fleet, def_upgrades, nb_sims=20000, seed=0)
+    assert abs((nb_att > 0).mean() - (res.nb_att > 0).mean()) < 0.04
+    assert abs(att_cp_lost.mean() - res.att_cp_lost.mean()) < 1.5
+    assert abs(def_cp_lost.mean() - res.def_cp_lost.mean()) < 1.5
+    for fight_left, batch_left, size in ((nb_att, res.nb_att, len(att_fleet)), (nb_def, res.nb_def, len(def_fleet))):
+        fight_dist = np.bincount(fight_left, minlength=size + 1) / nb_sims
+        batch_dist = np.bincount(batch_left, minlength=size + 1) / len(batch_left)
+        assert np.abs(fight_dist - batch_dist).sum() / 2 < 0.06
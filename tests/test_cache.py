@@ -0,0 +1,40 @@
+from libse4x import Upgrades, multifight, multisim
+from libse4x.dice import RandomDice
+from libse4x.cache import ResultCache, matchup_key
+from libse4x.ships import *
+
+def test_matchup_key():
+    key = matchup_key([S_SCOUT, S_DESTRO], Upgrades(attack=1), [S_CA], Upgrades())
+    assert key == matchup_key([S_DESTRO, S_SCOUT], Upgrades(attack=1), [S_CA], Upgrades())
+    assert key != matchup_key([S_DESTRO, S_SCOUT], Upgrades(attack=1, giant=True), [S_CA], Upgrades())
+    assert key != matchup_key([S_DESTRO, S_SCOUT], Upgrades(attack=1), [S_CA], Upgrades(), asteroids=True)
+    assert key != matchup_key([S_DESTRO, S_SCOUT], Upgrades(attack=1), [S_CA], Upgrades(), stop_at_round=2)
+
+def test_cache_reuse_and_extend(tmp_path):
+    cache = ResultCache(str(tmp_path / 'results.sqlite'))
+    matchup = ([S_SCOUT]*4, Upgrades(attack=1), [S_DESTRO]*3, Upgrades())
+    first = multifight(*matchup, nb_sims=100, seed=1, show=False, cache=cache, asteroids=True)
+    again = multifight(*matchup, nb_sims=100, seed=2, show=False, cache=cache, asteroids=True)
+    assert again == first
+    more = multifight(*matchup, nb_sims=250, seed=1, show=False, cache=cache, asteroids=True)
+    assert more.nb_sims == 250
+    assert more.att_wins >= first.att_wins
+    cache.close()
+    reopened = ResultCache(str(tmp_path / 'results.sqlite'))
+    assert reopened.get(*matchup, asteroids=True) == more
+
+def test_cache_skipped_with_dice():
+    cache = ResultCache(':memory:')
+    matchup = ([S_SCOUT]*2, Upgrades(), [S_DESTRO], Upgrades())
+    multifight(*matchup, nb_sims=20, seed=1, show=False, cache=cache)
+    stats = multifight(*matchup, nb_sims=5, show=False, cache=cache, dice=RandomDice(3))
+    assert stats.nb_sims == 5
+    assert cache.get(*matchup).nb_sims == 20
+
+def test_cache_eviction():
+    cache = ResultCache(':memory:', max_entries=2)
+    results = multisim([([S_SCOUT]*n, Upgrades()) for n in (1, 2, 3)], [([S_DESTRO], Upgrades())],
+                       nb_sims=20, show=False, cache=cache)
+    assert len(cache) == 2
+    assert cache.get([S_SCOUT], Upgrades(), [S_DESTRO], Upgrades()) is None
+    assert cache.get([S_SCOUT]*3, Upgrades(), [S_DESTRO], Upgrades()) == results[2][0]
@@ -0,0 +1,54 @@
+import random
+
+from libse4x import Upgrades, fight_stats
+from libse4x.campaign import Stage, campaign, fleet_key, fleet_names, key_fleet, split_fights
+from libse4x.ships import *
+
+def test_fleet_key():
+    key = fleet_key([S_SCOUT, S_CRUISER, S_SCOUT])
+    assert key == fleet_key([S_CRUISER, S_SCOUT, S_SCOUT])
+    assert sorted(x['name'] for x in key_fleet(key)) == ['Cruiser', 'Scout', 'Scout']
+    assert fleet_names(key) == '1x Cruiser, 2x Scout'
+    assert fleet_names(()) == 'destroyed'
+
+def test_split_fights():
+    weights = {('a',): .6, ('b',): .3, ('c',): .1, (): .5}
+    assert split_fights(weights, 100, 20) == {('a',): 44, ('b',): 32, ('c',): 24}
+    # min_sims is a floor within the budget of the stage
+    assert split_fights(weights, 30, 20) == {('a',): 10, ('b',): 10, ('c',): 10}
+    assert split_fights(weights, 2, 20) == {('a',): 1, ('b',): 1, ('c',): 1}
+    assert split_fights({(): 1.}, 100) == {}
+
+def test_single_stage_matches_fight_stats():
+    [result] = campaign([S_CRUISER]*3, Upgrades(), [Stage([S_DESTRO]*4, Upgrades())], nb_sims=3000, seed=0)
+    stats = fight_stats([S_CRUISER]*3, Upgrades(), [S_DESTRO]*4, Upgrades(), 3000, seed=1)
+    assert result.nb_inputs == 1 and result.nb_fights == 3000
+    assert abs(result.win - stats.att_win_rate) < .04
+    assert abs(result.own_cp_lost - stats.att_cp_mean) < 1.5
+    assert abs(sum(result.survivors.values()) - 1) < 1e-9
+    # the same seed gives the same results, without touching the random module
+    random.seed(7)
+    state = random.getstate()
+    [again] = campaign([S_CRUISER]*3, Upgrades(), [Stage([S_DESTRO]*4, Upgrades())], nb_sims=3000, seed=0)
+    assert random.getstate() == state
+    assert (again.win, again.survivors) == (result.win, result.survivors)
+
+def test_campaign_chain():
+    stages = [
+        Stage([S_CRUISER]*2, Upgrades()),
+        Stage([S_SCOUT]*4, Upgrades(attack=1), attacking=False),
+        Stage([S_DESTRO]*3, Upgrades(), stop_at_round=2),
+    ]
+    results = campaign([S_BOARD]*2 + [S_BC]*2, Upgrades(boarding=1), stages, nb_sims=500, min_sims=5, seed=3)
+    assert all(result.nb_fights == 500 for result in results)
+    for previous, result in zip(results, results[1:]):
+        # fleets destroyed in a stage don't fight the next ones
+        assert abs(result.alive - (previous.alive - previous.lose)) < 1e-9
+        # identical survivors are fought once, with all their weight
+        assert result.nb_inputs == sum(1 for key in previous.survivors if key)
+    for result in results:
+        assert abs(result.win + result.lose + result.draw - result.alive) < 1e-9
+        assert abs(sum(result.survivors.values()) - 1) < 1e-9
+    # captured cruisers join the fleet
+    assert any('Cruiser' in fleet_names(key) for key in results[0].survivors)
+    assert results[2].draw > 0
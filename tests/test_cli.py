@@ -0,0 +1,50 @@
+import json
+
+import pytest
+
+from libse4x import S_CRUISER, S_DESTRO
+from libse4x.cli import DEFAULTS, main, parse_fleet, run_record
+
+MATCHUPS = [
+    {'id': 'dd', 'att': {'S_DESTRO': 3}, 'att_upgrades': {'attack': 1}, 'def': ['CRUISER', 'S_CRUISER']},
+    {'att': ['S_SCOUT'], 'def': ['S_SCOUT'], 'nb_sims': 50, 'seed': 3},
+    {'att': ['S_BOARD']*2, 'def': ['S_CRUISER'], 'asteroids': True},
+    {'att': ['S_NOPE'], 'def': ['S_SCOUT']},
+]
+
+def test_parse_fleet():
+    assert parse_fleet({'S_DESTRO': 2, 'CRUISER': 1}) == [S_DESTRO, S_DESTRO, S_CRUISER]
+    with pytest.raises(ValueError):
+        parse_fleet(['S_NOPE'])
+    with pytest.raises(ValueError):
+        parse_fleet([5])
+
+def test_run_record_errors():
+    for record in ({'att': [5], 'def': ['S_SCOUT']}, {'att': ['S_SCOUT'], 'def': ['S_SCOUT'], 'nb_sims': 0}):
+        result = run_record(dict(record, id=1), DEFAULTS)
+        assert list(result) == ['id', 'error'] and result['error'].startswith('ValueError')
+
+def read_results(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+def test_cli_resume(tmp_path):
+    matchups = tmp_path / 'matchups.jsonl'
+    matchups.write_text(''.join(json.dumps(x) + '\n' for x in MATCHUPS))
+    output = str(tmp_path / 'results.jsonl')
+    assert main([str(matchups), '-o', output, '-n', '100', '--seed', '1']) == 1
+    results = read_results(output)
+    assert [x['line'] for x in results] == [1, 2, 3, 4]
+    assert results[0]['id'] == 'dd' and results[0]['nb_sims'] == 100
+    assert results[1]['nb_sims'] == 50
+    assert 'error' in results[3]
+
+    # killed job : last result lost, the one before half written
+    with open(output) as f:
+        lines = f.readlines()
+    with open(output, 'w') as f:
+        f.writelines(lines[:2] + [lines[2][:20]])
+    main([str(matchups), '-o', output, '-n', '100', '--seed', '1', '--resume', '-w', '2'])
+    resumed = read_results(output)
+    assert [x['line'] for x in resumed] == [1, 2, 3, 4]
+    assert resumed == results
@@ -0,0 +1,46 @@
+from libse4x import Upgrades, fight
+from libse4x.compare import compare
+from libse4x.dice import KeyedDice
+from libse4x.events import RingBuffer
+from libse4x.ships import *
+
+SETUP = ([S_BC]*2, Upgrades(attack=1), [S_CRUISER]*3, Upgrades(defense=1))
+
+def test_keyed_dice():
+    dice, same = KeyedDice(3), KeyedDice(3)
+    rolls = [dice.roll_for(nb_round, ship) for nb_round in (1, 2) for ship in range(100)]
+    assert set(rolls) == set(range(1, 11))
+    # rolls don't depend on the order they are asked in
+    assert same.roll_for(2, 99) == rolls[199]
+    assert [same.roll_for(1, ship) for ship in reversed(range(100))] == rolls[99::-1]
+    assert KeyedDice(3).roll_for(2, 50) == rolls[150]
+
+def test_keyed_dice_fights_differ():
+    # one source rolls differently in consecutive fights, but the same in the n-th fight of each source
+    dice, same = KeyedDice(3), KeyedDice(3)
+    matchup = ([S_SCOUT]*5, Upgrades(), [S_SCOUT]*5, Upgrades())
+    events = [RingBuffer(), RingBuffer()]
+    for log in events:
+        fight(*matchup, events=log, dice=dice)
+    assert list(events[0].events()) != list(events[1].events())
+    again = RingBuffer()
+    fight(*matchup, dice=same)
+    fight(*matchup, events=again, dice=same)
+    assert list(again.events()) == list(events[1].events())
+
+def test_compare_same_setup():
+    # identical setups see the same rolls : no difference at all
+    stats = compare(SETUP, SETUP, nb_sims=200, seed=1, show=False)
+    assert stats.nb_sims == 200
+    assert stats.a == stats.b
+    assert stats.att_win_diff_ci() == (0., 0.)
+
+def test_compare(capsys):
+    setup_b = SETUP[:1] + (Upgrades(attack=2),) + SETUP[2:] + ({'nebula': True},)
+    stats = compare(SETUP, setup_b, nb_sims=300, seed=2)
+    assert 'paired sims' in capsys.readouterr().out
+    low, high = stats.att_win_diff_ci()
+    assert low <= stats.att_win_rate_diff <= high
+    assert stats.a.nb_sims == stats.b.nb_sims == 300
+    assert abs(stats.att_win_rate_diff - (stats.a.att_win_rate - stats.b.att_win_rate)) < 1e-12
+    assert compare(SETUP, setup_b, nb_sims=300, seed=2, workers=2, show=False).nb_sims == 300
@@ -0,0 +1,29 @@
+from libse4x import rolls_distribution, rolls_distribution_complex
+from libse4x.dice import hit_distribution, hit_distributions
+
+def test_hit_distribution_binomial():
+    # 2 dice hitting on 3 or less
+    dist = hit_distribution([3, 3])
+    expected = [.7 * .7, 2 * .3 * .7, .3 * .3]
+    assert all(abs(a - b) < 1e-12 for a, b in zip(dist, expected))
+
+def test_hit_distribution_bounds():
+    assert hit_distribution([]) == [1.]
+    assert hit_distribution([0, 10]) == [0., 1., 0.]
+    assert hit_distribution([-2, 14]) == hit_distribution([0, 10])
+
+def test_hit_distributions_batch():
+    all_tohits = [[3]*4, [4, 4, 5, 6], [], [10], [1, 9]]
+    for dist, tohits in zip(hit_distributions(all_tohits), all_tohits):
+        assert len(dist) == len(tohits) + 1
+        assert all(abs(a - b) < 1e-12 for a, b in zip(dist, hit_distribution(tohits)))
+
+def test_rolls_distribution_format():
+    dist = rolls_distribution(4, 3)
+    assert sorted(dist) == [0, 1, 2, 3, 4]
+    count, percentage, prob = dist[1]
+    assert count == round(2000 * prob) and percentage == '41%'
+    assert abs(sum(p for _, _, p in dist.values()) - 1) < 1e-12
+    assert rolls_distribution_complex([3]*4) == dist
+    # impossible numbers of hits are left out
+    assert sorted(rolls_distribution_complex([10, 4])) == [1, 2]
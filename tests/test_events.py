@@ -0,0 +1,49 @@
+import random
+
+from libse4x import Upgrades, fight
+from libse4x.events import (CAPTURE, FIGHT_END, FIGHT_START, KILL, ROLL, SHIP, EventFile, RingBuffer, format_events,
+                            read_events)
+from libse4x.ships import *
+
+def test_events_match_fight():
+    att_fleet, def_fleet = [S_BOARD]*3, [S_CRUISER]*2 + [S_SCOUT]
+    random.seed(4)
+    expected = fight(att_fleet, Upgrades(), def_fleet, Upgrades())
+    random.seed(4)
+    log = RingBuffer()
+    nb_att, nb_def, _, att_cp_lost, def_cp_lost = fight(att_fleet, Upgrades(), def_fleet, Upgrades(), events=log)
+    assert (nb_att, nb_def, att_cp_lost, def_cp_lost) == (expected[0], expected[1], expected[3], expected[4])
+    events = list(log.events())
+    assert events[0][:4] == (FIGHT_START, 0, 3, 3)
+    assert [x.a for x in events if x.kind == SHIP] == list(range(6))
+    assert events[-1][2:] == (nb_att, nb_def, att_cp_lost, def_cp_lost)
+    assert events[-1].kind == FIGHT_END
+    # every kill and capture follows a successful roll of the same ships
+    for previous, event in zip(events, events[1:]):
+        if event.kind == CAPTURE:
+            assert previous.kind == ROLL and previous.c <= previous.d and previous[2:4] == event[2:4]
+    losses = sum(x.c for x in events if x.kind == KILL and x.b >= 3)
+    assert losses <= def_cp_lost + sum(x['cost'] for x in def_fleet)
+    lines = list(format_events(events, att_fleet + def_fleet))
+    assert len(lines) == len(events)
+    assert lines[0] == 'Combat starting. 3 ATT vs. 3 DEF'
+
+def test_ring_buffer_wraps():
+    log = RingBuffer(capacity=4)
+    for i in range(10):
+        log.emit(ROLL, 1, i)
+    assert log.count == 10
+    assert [x.a for x in log.events()] == [6, 7, 8, 9]
+
+def test_event_file(tmp_path):
+    path = str(tmp_path / 'events.bin')
+    log = RingBuffer()
+    with EventFile(path) as sink:
+        for _ in range(5):
+            random.seed(1)
+            fight([S_SCOUT]*3, Upgrades(), [S_DESTRO]*2, Upgrades(), events=sink)
+    random.seed(1)
+    fight([S_SCOUT]*3, Upgrades(), [S_DESTRO]*2, Upgrades(), events=log)
+    events = list(read_events(path))
+    assert len(events) == 5 * log.count
+    assert events[:log.count] == list(log.events())
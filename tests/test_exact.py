@@ -0,0 +1,27 @@
+from libse4x import Upgrades
+from libse4x.exact import solve_exact
+from libse4x.ships import *
+
+def test_exact_duel():
+    # DEF fires first and hits on 4-, ATT hits on 2- : ATT wins with p = .6 * .2 / (1 - .6 * .8)
+    res = solve_exact([S_SCOUT], Upgrades(), [S_SCOUT], Upgrades(attack=1, defense=1))
+    assert res.exact
+    assert abs(res.att_win - .12 / .52) < 1e-9
+    assert abs(res.att_win + res.def_win - 1) < 1e-9
+    assert abs(res.att_cp_lost - 6 * res.def_win) < 1e-9
+    assert abs(sum(res.survivors.values()) - 1) < 1e-9
+
+def test_exact_boarding_captures():
+    res = solve_exact([S_BOARD]*2, Upgrades(boarding=2), [S_CRUISER]*2, Upgrades(security=1))
+    # captured cruisers are counted as a gain for the attacker
+    assert res.att_cp_lost < 0
+    assert abs(res.att_win + res.def_win + res.draw - 1) < 1e-9
+
+def test_exact_stop_at_round():
+    res = solve_exact([S_BB]*2, Upgrades(), [S_BB]*2, Upgrades(), stop_at_round=1)
+    assert abs(res.draw - 1) < 1e-9
+
+def test_exact_fallback():
+    res = solve_exact([S_SCOUT]*8, Upgrades(), [S_CA]*4, Upgrades(), max_states=10, nb_sims=50)
+    assert not res.exact
+    assert abs(res.att_win + res.def_win + res.draw - 1) < 1e-9
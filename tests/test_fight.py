@@ -0,0 +1,47 @@
+import random
+
+from libse4x import ATTACKER, DEFENDER, TargetIndex, Upgrades, fight, find_defender, init_ships
+from libse4x.ships import *
+
+def test_fight_result():
+    random.seed(0)
+    nb_att, nb_def, next_ships, att_cp_lost, def_cp_lost = fight(
+        [S_DREAD]*2, Upgrades(attack=3, defense=3),
+        [S_FIGHTER]*6 + [S_CARRIER]*2, Upgrades(attack=1, defense=1, fighter=3))
+    assert nb_att == 0 or nb_def == 0
+    assert len(next_ships) == 10
+    assert nb_att == sum(1 for x in next_ships if x['side'] == ATTACKER and x['hp'] > 0)
+    assert nb_def == sum(1 for x in next_ships if x['side'] == DEFENDER and x['hp'] > 0)
+    assert att_cp_lost == sum(x['cost'] for x in next_ships if x['side'] == ATTACKER and x['hp'] <= 0)
+    assert def_cp_lost == sum(x['cost'] for x in next_ships if x['side'] == DEFENDER and x['hp'] <= 0)
+
+def test_fight_leaves_fleet_untouched():
+    fleet = [S_CRUISER]*2
+    fight(fleet, Upgrades(), [S_BOARD]*2, Upgrades(boarding=2))
+    assert fleet == [S_CA, S_CA]
+    assert S_CRUISER == {'name':'Cruiser', 'cost':12, 'prio':3, 'att':4, 'def':1, 'size':2}
+
+def test_fight_empty_fleet():
+    nb_att, nb_def, next_ships, att_cp_lost, def_cp_lost = fight([], Upgrades(), [S_SCOUT], Upgrades())
+    assert (nb_att, nb_def, att_cp_lost, def_cp_lost) == (0, 1, 0, 0)
+    assert len(next_ships) == 1
+
+def test_fight_stop_at_round():
+    nb_att, nb_def, _, _, _ = fight([S_BB]*2, Upgrades(), [S_BB]*2, Upgrades(), stop_at_round=1)
+    assert (nb_att, nb_def) == (2, 2)
+
+def test_target_index_matches_find_defender():
+    rng = random.Random(0)
+    for _ in range(50):
+        ships = (init_ships(rng.choices([S_SCOUT, S_CA, S_BB, S_BOARD], k=6), Upgrades(), ATTACKER)
+                 + init_ships(rng.choices([S_SCOUT, S_CA, S_BB, S_BOARD], k=6), Upgrades(), DEFENDER))
+        targets = TargetIndex(ships)
+        for _ in range(20):
+            i = rng.randrange(len(ships))
+            if rng.random() < .3:
+                ships[i]['side'] = ATTACKER if ships[i]['side'] == DEFENDER else DEFENDER
+            else:
+                ships[i]['hp'] -= 1
+            targets.update(i)
+            for side in (ATTACKER, DEFENDER):
+                assert targets.find_defender(side) == find_defender(ships, side)
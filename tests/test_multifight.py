@@ -0,0 +1,77 @@
+import pytest
+
+from libse4x import FightStats, Upgrades, multifight, multisim, run_matchups, split_sims
+from libse4x.dice import RandomDice
+from libse4x.ships import *
+
+MATCHUPS = [
+    ([S_SCOUT]*4, Upgrades(attack=1), [S_DESTRO]*3, Upgrades()),
+    ([S_BOARD]*2, Upgrades(), [S_CRUISER]*2, Upgrades()),
+]
+
+def test_split_sims():
+    chunks = split_sims(1001, 4, seed=1)
+    assert [n for n, _ in chunks] == [251, 250, 250, 250]
+    assert len(set(seed for _, seed in chunks)) == 4
+    assert chunks == split_sims(1001, 4, seed=1)
+
+def test_fight_stats():
+    stats = FightStats(2, 3)
+    stats.add(2, 0, 0, 10, 3)
+    stats.add(0, 1, 12, 4, 4)
+    stats.add(1, 1, 6, 4, 2)
+    assert (stats.att_wins, stats.def_wins, stats.draws) == (1, 1, 1)
+    assert stats.att_cp_mean == 6
+    assert stats.att_cp_var == 36
+    assert stats.rounds_mean == 3
+    assert stats.survivors[(2, 0)] == 1
+    low, high = stats.att_win_ci()
+    assert 0 < low < 1 / 3 < high < 1
+    merged = FightStats.merged([stats, stats])
+    assert merged.nb_sims == 6 and merged.rounds[3] == 2
+    assert merged.att_cp_var < stats.att_cp_var
+
+def test_multifight_stats(capsys):
+    stats = multifight(*MATCHUPS[0], nb_sims=100, seed=1, show=False)
+    assert capsys.readouterr().out == ''
+    assert stats.nb_sims == 100
+    assert stats.att_wins + stats.def_wins == 100
+    assert sum(stats.rounds.values()) == 100
+
+def test_multisim_stats():
+    results = multisim([MATCHUPS[0][:2], MATCHUPS[1][:2]], [MATCHUPS[0][2:]], nb_sims=50, show=False)
+    assert len(results) == 2 and len(results[0]) == 1
+    assert results[1][0].att_size == 2
+
+def test_run_matchups_serial_reproducible():
+    assert run_matchups(MATCHUPS, 200, seed=3) == run_matchups(MATCHUPS, 200, seed=3)
+
+def test_run_matchups_parallel_reproducible():
+    first = run_matchups(MATCHUPS, 200, workers=2, seed=3)
+    assert first == run_matchups(MATCHUPS, 200, workers=2, seed=3)
+    for stats in first:
+        assert stats.nb_sims == 200
+
+def test_multifight_adaptive():
+    lopsided = multifight([S_DREAD]*2, Upgrades(), [S_SCOUT]*3, Upgrades(), target_ci=0.02, seed=1, show=False)
+    close = multifight([S_SCOUT]*6, Upgrades(), [S_DESTRO]*4, Upgrades(), target_ci=0.02, seed=1, show=False)
+    assert lopsided.nb_sims < close.nb_sims
+    low, high = close.att_win_ci()
+    assert (high - low) / 2 <= 0.02
+
+def test_multifight_adaptive_max_sims():
+    stats = multifight([S_SCOUT]*6, Upgrades(), [S_DESTRO]*4, Upgrades(), target_ci=0.001, max_sims=300,
+                       seed=1, show=False)
+    assert stats.nb_sims == 300
+
+def test_multifight_no_sims():
+    with pytest.raises(ValueError):
+        multifight([S_SCOUT]*4, Upgrades(), [S_DESTRO]*3, Upgrades(), nb_sims=0, show=False)
+
+def test_multifight_dice():
+    matchup = ([S_SCOUT]*4, Upgrades(attack=1), [S_DESTRO]*3, Upgrades())
+    serial = multifight(*matchup, nb_sims=200, show=False, dice=RandomDice(5))
+    assert serial == multifight(*matchup, nb_sims=200, show=False, dice=RandomDice(5))
+    parallel = multifight(*matchup, nb_sims=200, show=False, workers=2, dice=RandomDice(5))
+    assert parallel.nb_sims == 200
+    assert parallel == multifight(*matchup, nb_sims=200, show=False, workers=2, dice=RandomDice(5))
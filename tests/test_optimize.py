@@ -0,0 +1,41 @@
+from libse4x import Upgrades
+from libse4x.optimize import compositions, optimize_fleet
+from libse4x.ships import *
+
+def test_compositions():
+    pool = [S_SCOUT, S_DESTRO, S_CRUISER]
+    assert sorted(compositions(pool, 18)) == [(0, 2, 0), (1, 0, 1), (1, 1, 0), (3, 0, 0)]
+    assert (1, 0, 0) in compositions(pool, 18, full_budget=False)
+    assert all(6*a + 9*b + 12*c <= 30 for a, b, c in compositions(pool, 30, full_budget=False))
+
+def test_optimize_fleet():
+    front = optimize_fleet([S_DESTRO]*3, Upgrades(), 36, [S_SCOUT, S_DESTRO, S_CRUISER, S_BC], Upgrades(),
+                           min_sims=20, max_sims=180, seed=1)
+    assert front
+    win_rates = [x.stats.att_win_rate for x in front]
+    cp_lost = [x.stats.att_cp_mean for x in front]
+    assert win_rates == sorted(win_rates, reverse=True)
+    assert cp_lost == sorted(cp_lost, reverse=True)
+    for candidate in front:
+        assert candidate.stats.nb_sims == 180
+        assert sum(x['cost'] for x in candidate.fleet) <= 36
+    again = optimize_fleet([S_DESTRO]*3, Upgrades(), 36, [S_SCOUT, S_DESTRO, S_CRUISER, S_BC], Upgrades(),
+                           min_sims=20, max_sims=180, seed=1)
+    assert [x.counts for x in again] == [x.counts for x in front]
+
+def test_optimize_fleet_single_pool(monkeypatch):
+    import libse4x
+    from libse4x import optimize
+    pools = []
+
+    class CountingPool(optimize.ProcessPoolExecutor):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            pools.append(self)
+
+    monkeypatch.setattr(optimize, 'ProcessPoolExecutor', CountingPool)
+    monkeypatch.setattr(libse4x, 'ProcessPoolExecutor', None)
+    front = optimize_fleet([S_DESTRO]*2, Upgrades(), 24, [S_SCOUT, S_DESTRO], Upgrades(),
+                           min_sims=20, max_sims=60, workers=2, seed=1)
+    assert front
+    assert len(pools) == 1
@@ -0,0 +1,53 @@
+import random
+
+import pytest
+
+from libse4x import Upgrades, fight, multifight
+from libse4x.events import FIGHT_END, ROLL, TARGET, TARGETING, RingBuffer
+from libse4x.profiling import Instruments, profile_scenario
+from libse4x.ships import *
+
+def test_instruments_count_events():
+    random.seed(2)
+    log = RingBuffer()
+    fight([S_BOARD]*3, Upgrades(), [S_CRUISER]*2 + [S_SCOUT], Upgrades(), events=log)
+    events = list(log.events())
+    instruments = Instruments()
+    random.seed(2)
+    fight([S_BOARD]*3, Upgrades(), [S_CRUISER]*2 + [S_SCOUT], Upgrades(), events=instruments)
+    report = instruments.report()
+    assert report['fights'] == 1
+    assert report['rolls'] == sum(1 for x in events if x.kind == ROLL)
+    assert report['stale_targets'] == sum(x.a for x in events if x.kind == TARGETING)
+    # every ship in firing order looks up a target, the ones that fire roll right after it
+    assert report['target_lookups'] == sum(1 for x in events if x.kind == TARGET)
+    shots = [(previous, event) for previous, event in zip(events, events[1:])
+             if previous.kind == TARGET and event.kind == ROLL]
+    assert len(shots) == report['rolls'] < report['target_lookups']
+    assert all(previous.b == event.b for previous, event in shots)
+    assert events[-2].kind == TARGETING and events[-1].kind == FIGHT_END
+
+def test_multifight_instruments(tmp_path):
+    instruments = Instruments()
+    stats = multifight([S_SCOUT]*6, Upgrades(), [S_DESTRO]*4, Upgrades(), 200, seed=0, show=False,
+                       instruments=instruments)
+    report = instruments.report()
+    assert report['fights'] == stats.nb_sims == 200
+    assert report['rounds'] == sum(rounds * count for rounds, count in stats.rounds.items())
+    assert report['fights_per_sec'] > 0
+    assert 0 < report['fight_s'] <= report['wall_s']
+    phases = report['targeting_s'] + report['rolling_s'] + report['damage_s']
+    assert report['targeting_s'] > 0 and report['rolling_s'] > 0 and report['damage_s'] > 0
+    assert phases + report['other_s'] == pytest.approx(report['fight_s'])
+    assert 'fights/sec' in instruments.format()
+    merged = Instruments().merge(instruments).merge(instruments)
+    assert merged.fights == 400
+
+    path = tmp_path / 'profile.txt'
+    summary = profile_scenario([S_SCOUT]*6, Upgrades(), [S_DESTRO]*4, Upgrades(), 50, path=str(path), limit=5)
+    assert 'fight' in summary
+    assert path.read_text() == summary
+    random.seed(7)
+    state = random.getstate()
+    profile_scenario([S_SCOUT]*6, Upgrades(), [S_DESTRO]*4, Upgrades(), 50, limit=5, seed=1)
+    assert random.getstate() == state
@@ -0,0 +1,58 @@
+import random
+
+import pytest
+
+from libse4x import DEFENDER, Upgrades
+from libse4x.dice import TiltedDice, tilted_probabilities
+from libse4x.exact import solve_exact
+from libse4x.rare import importance_sampling, ship_lost, splitting
+from libse4x.ships import *
+
+def test_tilted_dice():
+    dice = TiltedDice(2, tilted_probabilities(1.), None, seed=0)
+    weights = []
+    for _ in range(20000):
+        dice.reset()
+        roll = dice.roll_for(1, 0)
+        assert 1 <= roll <= 10
+        weights.append(dice.weight)
+    # the likelihood ratio of a biased roll averages to 1
+    assert sum(weights) / len(weights) == pytest.approx(1., abs=.05)
+    assert sum(dice.counts[0]) == 1
+    dice.roll_for(1, 5)
+    assert dice.counts[1][1:] != [0] * 10
+    with pytest.raises(ValueError):
+        TiltedDice(1, [0.] + [1 / 9] * 9)
+
+def test_importance_sampling_matches_exact():
+    matchup = ([S_DESTRO]*3, Upgrades(), [S_BC]*4, Upgrades(attack=2, defense=1))
+    exact = solve_exact(*matchup).att_win
+    result = importance_sampling(*matchup, seed=1)
+    assert exact < 1e-7
+    assert result.low <= exact <= result.high
+    assert result.high - result.low < exact
+    assert result.plain_fights > 1000 * result.nb_fights
+
+def test_importance_sampling_outcome():
+    matchup = ([S_CRUISER]*4, Upgrades(), [S_TITAN], Upgrades())
+    exact = solve_exact(*matchup).att_win
+    result = importance_sampling(*matchup, outcome=ship_lost('Titan', DEFENDER), nb_sims=4000, seed=0)
+    assert result.low <= exact <= result.high
+    with pytest.raises(ValueError):
+        importance_sampling(*matchup, outcome='titan')
+
+def test_splitting_matches_exact():
+    matchup = ([S_DESTRO]*4, Upgrades(), [S_BC]*4, Upgrades(attack=1))
+    exact = solve_exact(*matchup).att_win
+    result = splitting(*matchup, nb_particles=500, seed=0)
+    assert result.low <= exact <= result.high
+    assert result.hits > 100
+    # the same seed gives the same estimate, without touching the random module
+    random.seed(7)
+    state = random.getstate()
+    again = splitting(*matchup, nb_particles=500, seed=0)
+    assert random.getstate() == state
+    assert (again.probability, again.nb_fights) == (result.probability, result.nb_fights)
+    # without selection, splitting is plain sampling
+    plain = splitting(*matchup, nb_particles=200, nb_runs=2, strength=0., seed=0)
+    assert plain.nb_fights == 400
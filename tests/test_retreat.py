@@ -0,0 +1,45 @@
+import random
+
+from libse4x import ATTACKER, DEFENDER, CombatState, Upgrades, fight, fight_stats
+from libse4x.retreat import retreat_features, solve_retreat
+from libse4x.ships import *
+
+MATCHUP = ([S_CRUISER]*2, Upgrades(), [S_BC]*2, Upgrades(attack=1))
+
+def test_retreat_hook():
+    calls = []
+
+    def hook(side, nb_round, ships):
+        calls.append((side, nb_round))
+        return side == DEFENDER and nb_round == 3
+
+    random.seed(0)
+    state = CombatState()
+    nb_att, nb_def, _, _, _ = fight([S_DREAD]*2, Upgrades(), [S_DREAD]*2, Upgrades(), retreat=hook, state=state)
+    assert calls[:3] == [(ATTACKER, 2), (DEFENDER, 2), (ATTACKER, 3)]
+    assert state.retreated == DEFENDER and state.last_round == 2
+    assert nb_att > 0 and nb_def > 0 and state.finished
+
+def test_retreat_features():
+    state = CombatState()
+    fight(*MATCHUP, stop_at_round=1, state=state)
+    nb_class, att_ships, def_ships = retreat_features(2, state.ships)
+    assert nb_class == 1
+    assert sum(n for _, n in att_ships) == state.nb_att
+    assert sum(n for _, n in def_ships) == state.nb_def
+
+def test_solve_retreat():
+    policy = solve_retreat(*MATCHUP, ATTACKER, nb_sims=3000, eval_sims=3000, seed=1)
+    # values measured on new fights, paired on the same rolls
+    assert policy.value > policy.value_no_retreat
+    assert policy.retreat_states()
+    assert 'ATT policy' in policy.format()
+    # the same seed gives the same policy, without touching the random module
+    random.seed(7)
+    state = random.getstate()
+    again = solve_retreat(*MATCHUP, ATTACKER, nb_sims=3000, eval_sims=3000, seed=1)
+    assert random.getstate() == state
+    assert (again.value, again.retreat_states()) == (policy.value, policy.retreat_states())
+    with_policy = fight_stats(*MATCHUP, 3000, seed=2, retreat=policy)
+    without = fight_stats(*MATCHUP, 3000, seed=2)
+    assert (with_policy.def_cp_mean - with_policy.att_cp_mean) > (without.def_cp_mean - without.att_cp_mean)
@@ -1,5 +1,7 @@
 from libse4x import roll_attack, roll_die
-from libse4x import Upgrades
+from libse4x import ATTACKER, DEFENDER, ROUND_CLASSES, SIDES, attack_score, compile_tohit, init_ships, ship_type
+from libse4x import Upgrades, fight
+from libse4x.dice import NumpyDice, RandomDice, ScriptedDice
 from libse4x.ships import *
 
 def test_roll():
@@ -57,3 +59,62 @@ def test_attack():
     for i, line in enumerate(tests):
         _, _, tohit = roll_attack(line[0], line[2], line[1], line[3], line[4], line[5])
         assert tohit == line[6], f"[{i}] tohit expected: {line[6]} actual: {tohit}, {line}"
+
+def test_ship_type():
+    assert ship_type(S_DDX).ddx
+    assert ship_type(S_BOARD_INS).boarding
+    assert ship_type(S_RAIDER_CLK).raider and ship_type(S_RAIDER_CLK).cloaked
+    assert not ship_type(S_RAIDER_NOCLK).cloaked
+    assert ship_type(S_MILITIA).ground
+    assert ship_type(S_TITAN).titan and not ship_type(S_TITAN).fighter
+    assert ship_type(dict(S_SCOUT)) is ship_type(S_SCOUT)
+
+def test_roll_titan_boarded():
+    # titans can't be boarded
+    assert roll_attack(S_BOARD, S_TITAN, Upgrades(boarding=2), Upgrades()) == (0, 10, 0)
+
+def test_roll_attack_scripted():
+    dice = ScriptedDice([3, 4, 1, 10])
+    # hits on a roll <= tohit
+    assert roll_attack(S_SCOUT, S_SCOUT, Upgrades(), Upgrades(), dice=dice) == (1, 3, 3)
+    assert roll_attack(S_SCOUT, S_SCOUT, Upgrades(), Upgrades(), dice=dice) == (0, 4, 3)
+    # titans take 2 damage
+    assert roll_attack(S_TITAN, S_SCOUT, Upgrades(), Upgrades(), dice=dice) == (2, 1, 7)
+    assert roll_attack(S_TITAN, S_SCOUT, Upgrades(), Upgrades(), dice=dice) == (0, 10, 7)
+    try:
+        roll_die(dice)
+        assert False, 'scripted dice should be exhausted'
+    except IndexError:
+        pass
+
+def test_fight_scripted():
+    # DEF scout fires first and misses, ATT scout hits
+    nb_att, nb_def, _, att_cp_lost, def_cp_lost = fight([S_SCOUT], Upgrades(), [S_SCOUT], Upgrades(),
+                                                        dice=ScriptedDice([10, 1]))
+    assert (nb_att, nb_def, att_cp_lost, def_cp_lost) == (1, 0, 0, 6)
+
+def test_dice_sources():
+    for source in (RandomDice, NumpyDice):
+        dice, same = source(7), source(7)
+        rolls = [dice.roll() for _ in range(1000)]
+        assert set(rolls) == set(range(1, 11))
+        assert rolls == [same.roll() for _ in range(1000)]
+        first, second = source(7).spawn(2)
+        assert [first.roll() for _ in range(20)] != [second.roll() for _ in range(20)]
+
+def test_compile_tohit():
+    att_upgrades = Upgrades(attack=2, fighter=2, hivemind=True)
+    def_upgrades = Upgrades(defense=1, hivemind=True)
+    ships = (init_ships([S_FIGHTER, S_FIGHTER, S_DDX, S_MARINE_ATT], att_upgrades, ATTACKER)
+             + init_ships([S_TITAN, S_SCOUT_CG, S_BOARD], def_upgrades, DEFENDER))
+    tids, types, table = compile_tohit(ships)
+    assert tids[0] == tids[1]
+    assert len(types) == 6
+    for i_round, nb_round in enumerate(ROUND_CLASSES):
+        for bonus in (0, 1):
+            for i_side, side in enumerate(SIDES):
+                for att_ship, att_tid in zip(ships, tids):
+                    for def_ship, def_tid in zip(ships, tids):
+                        expected = attack_score(dict(att_ship, side=side), def_ship, att_ship['upgrades'],
+                                                def_ship['upgrades'], bonus, nb_round)
+                        assert table[i_round][bonus][i_side][att_tid][def_tid] == expected
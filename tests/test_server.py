@@ -0,0 +1,66 @@
+import asyncio
+import json
+
+from libse4x.server import SimServer
+
+MATCHUP = {'att': {'S_DESTRO': 4}, 'att_upgrades': {'attack': 1}, 'def': ['S_CRUISER']*3, 'nb_sims': 1000}
+
+async def request(port, method, path, body=None):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    data = json.dumps(body).encode() if body is not None else b''
+    writer.write('{} {} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {}\r\n\r\n'.format(
+        method, path, len(data)).encode() + data)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, body = response.partition(b'\r\n\r\n')
+    return int(head.split()[1]), json.loads(body)
+
+async def scenario():
+    server = SimServer(port=0, workers=1)
+    await server.start()
+    try:
+        # identical concurrent requests are computed once
+        results = await asyncio.gather(*[request(server.port, 'POST', '/multifight', dict(MATCHUP, id=i))
+                                         for i in range(3)])
+        assert all(status == 200 for status, _ in results)
+        assert [result['id'] for _, result in results] == [0, 1, 2]
+        assert sum(result['meta']['sims_run'] for _, result in results) == 1000
+        assert sum(result['meta']['coalesced'] for _, result in results) == 2
+        assert len(set(result['att_win'] for _, result in results)) == 1
+
+        status, again = await request(server.port, 'POST', '/multifight', MATCHUP)
+        assert status == 200 and again['meta']['cached']
+
+        status, single = await request(server.port, 'POST', '/fight', dict(MATCHUP, seed=3, log=True))
+        assert status == 200 and single['log'][0] == 'Combat starting. 4 ATT vs. 3 DEF'
+
+        assert (await request(server.port, 'POST', '/multifight', {'att': ['S_NOPE'], 'def': []}))[0] == 400
+        assert (await request(server.port, 'GET', '/nowhere'))[0] == 404
+
+        status, metrics = await request(server.port, 'GET', '/metrics')
+        assert status == 200
+        assert metrics['computed'] == 2 and metrics['coalesced'] == 2 and metrics['cached'] == 1
+        assert metrics['sims_run'] == 1001
+        assert metrics['errors'] == 1
+
+        # invalid options of a single fight are reported like those of /multifight
+        status, error = await request(server.port, 'POST', '/fight',
+                                      {'att': ['S_SCOUT'], 'def': ['S_SCOUT'], 'stop_at_round': 'x'})
+        assert status == 400 and error['error'].startswith('TypeError')
+        assert server.counters['errors'] == 2
+        for record in ({'att': [5], 'def': ['S_SCOUT']}, dict(MATCHUP, nb_sims=0)):
+            assert (await request(server.port, 'POST', '/multifight', record))[0] == 400
+        assert server.counters['errors'] == 4
+
+        async def broken(method, path, body):
+            raise RuntimeError('boom')
+        server.dispatch = broken
+        status, error = await request(server.port, 'POST', '/fight', MATCHUP)
+        assert status == 500 and error == {'error': 'RuntimeError: boom'}
+        assert server.counters['errors'] == 5
+    finally:
+        await server.stop()
+
+def test_server():
+    asyncio.run(scenario())
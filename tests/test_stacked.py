@@ -0,0 +1,44 @@
+import random
+
+from libse4x import Upgrades
+from libse4x.exact import solve_exact
+from libse4x.ships import *
+from libse4x.stacked import binomial_cdf, fight_stacked, init_groups, stacked_stats
+
+def test_binomial_cdf():
+    cdf = binomial_cdf(3, 5)
+    assert [round(x, 9) for x in cdf] == [.125, .5, .875, 1.]
+    assert binomial_cdf(4, 0)[0] == 1.
+
+def test_groups():
+    groups, _, _ = init_groups([S_FIGHTER]*30 + [S_CARRIER]*10, Upgrades(), [S_DREAD]*2, Upgrades())
+    assert sorted((x['side'], x['name'], x['count']) for x in groups) == [
+        ('ATT', 'Carrier', 10), ('ATT', 'Fighter', 30), ('DEF', 'Dreadnaught', 2)]
+    nb_att, nb_def, groups, _, _ = fight_stacked([S_SCOUT]*10, Upgrades(), [S_DESTRO]*8, Upgrades(), stop_at_round=1)
+    assert sum(x['count'] for x in groups if x['side'] == 'ATT') == nb_att
+    assert sum(x['count'] for x in groups if x['side'] == 'DEF') == nb_def
+
+def test_stacked_matches_exact():
+    for matchup in [
+            ([S_CRUISER]*3, Upgrades(), [S_BC]*2, Upgrades(attack=1)),
+            ([S_BOARD]*2, Upgrades(boarding=2), [S_CRUISER]*2, Upgrades(security=1)),
+            ([S_TITAN], Upgrades(), [S_DREAD]*2, Upgrades(immortal=True)),
+            ([S_BB, S_SCOUT, S_BB], Upgrades(), [S_CA, S_SHIPYARD, S_CA], Upgrades())]:
+        exact = solve_exact(*matchup)
+        stats = stacked_stats(*matchup, nb_sims=4000, seed=0)
+        assert abs(stats.att_win_rate - exact.att_win) < .03
+        assert abs(stats.att_cp_mean - exact.att_cp_lost) < 1.
+        assert abs(stats.def_cp_mean - exact.def_cp_lost) < 1.
+
+def test_stacked_stop_at_round():
+    stats = stacked_stats([S_DREAD]*3, Upgrades(), [S_DREAD]*3, Upgrades(), nb_sims=100, stop_at_round=1, seed=0)
+    assert stats.nb_sims == 100
+    assert stats.draws == 100
+
+def test_stacked_seed():
+    matchup = ([S_CRUISER]*3, Upgrades(), [S_BC]*2, Upgrades(attack=1))
+    random.seed(7)
+    state = random.getstate()
+    stats = stacked_stats(*matchup, nb_sims=200, seed=1)
+    assert random.getstate() == state
+    assert stacked_stats(*matchup, nb_sims=200, seed=1) == stats
@@ -0,0 +1,53 @@
+import json
+import random
+
+from libse4x import CombatState, Upgrades, fight, fight_stats
+from libse4x.ships import *
+
+MATCHUP = ([S_BOARD]*2 + [S_DESTRO]*3, Upgrades(attack=1, boarding=1), [S_CRUISER]*3, Upgrades(immortal=True))
+
+def test_resume_matches_full_fight():
+    for seed in range(20):
+        random.seed(seed)
+        full = fight(*MATCHUP)
+        random.seed(seed)
+        state = CombatState()
+        fight(*MATCHUP, stop_at_round=1, state=state)
+        assert state.last_round == 1 and state.nb_round == 2
+        # through JSON and back
+        state = CombatState.from_dict(json.loads(json.dumps(state.as_dict())))
+        resumed = fight(None, None, None, None, state=state)
+        assert (resumed[0], resumed[1], resumed[3], resumed[4]) == (full[0], full[1], full[3], full[4])
+        assert state.finished
+        assert [(x['id'], x['hp'], x['side']) for x in resumed[2]] == [(x['id'], x['hp'], x['side']) for x in full[2]]
+
+def test_fork():
+    state = CombatState()
+    random.seed(1)
+    fight(*MATCHUP, stop_at_round=2, state=state)
+    snapshot = state.as_dict()
+    first, second = state.fork(2)
+    fight(None, None, None, None, state=first)
+    assert state.as_dict() == snapshot
+    assert first.finished and not state.finished
+    stats = fight_stats(None, None, None, None, 200, state=state, seed=3)
+    assert stats.nb_sims == 200
+    assert min(stats.rounds) >= 3
+    assert state.as_dict() == snapshot
+
+def test_resume_keeps_firing_order():
+    # boarding captures give ships the same firing order : ties must break the same way in
+    # a resumed fight as in the uninterrupted one
+    matchup = ([S_CRUISER]*2 + [S_BOARD]*2, Upgrades(boarding=2), [S_BOARD]*2 + [S_CRUISER]*2, Upgrades(boarding=2))
+    for stop_at_round in (1, 2, 3):
+        for seed in range(300):
+            random.seed(seed)
+            full = fight(*matchup)
+            random.seed(seed)
+            state = CombatState()
+            fight(*matchup, stop_at_round=stop_at_round, state=state)
+            state = CombatState.from_dict(json.loads(json.dumps(state.as_dict())))
+            resumed = fight(None, None, None, None, state=state)
+            assert (sorted((x['id'], x['hp'], x['side']) for x in resumed[2])
+                    == sorted((x['id'], x['hp'], x['side']) for x in full[2]))
+            assert (resumed[0], resumed[1], resumed[3], resumed[4]) == (full[0], full[1], full[3], full[4])
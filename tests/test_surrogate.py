@@ -0,0 +1,58 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from libse4x import Upgrades, multisim
+from libse4x.ships import *
+from libse4x.surrogate import FEATURE_NAMES, Surrogate, matchup_features
+from libse4x.sweep import sweep
+
+ATTACKERS = [([S_SCOUT]*n, Upgrades(attack=a)) for n in range(2, 8) for a in range(2)]
+DEFENDERS = [([S_DESTRO]*n, Upgrades()) for n in range(2, 6)]
+
+@pytest.fixture(scope='module')
+def model():
+    results = multisim(ATTACKERS, DEFENDERS, 100, show=False, seed=0)
+    result = Surrogate()
+    result.add_multisim(ATTACKERS, DEFENDERS, results)
+    return result.train()
+
+def test_features():
+    features = matchup_features([S_SCOUT]*3, Upgrades(attack=2), [S_DESTRO], Upgrades(), asteroids=True)
+    assert len(features) == len(FEATURE_NAMES)
+    named = dict(zip(FEATURE_NAMES, features))
+    assert named['att_Scout'] == 3 and named['att_ships'] == 3 and named['att_hp'] == 3
+    assert named['att_up_attack'] == 2 and named['def_Destroyer'] == 1
+    assert named['asteroids'] == 1 and named['nebula'] == 0
+
+def test_predict(model):
+    assert len(model.features) == len(ATTACKERS) * len(DEFENDERS)
+    strong = model.predict([S_SCOUT]*7, Upgrades(attack=1), [S_DESTRO]*2, Upgrades())
+    weak = model.predict([S_SCOUT]*2, Upgrades(), [S_DESTRO]*5, Upgrades())
+    assert strong.att_win > .8 > .2 > weak.att_win
+    assert strong.uncertainty >= 0 and not strong.simulated
+
+def test_estimate_fallback(model):
+    # cruisers are not in the corpus at all
+    prediction = model.estimate([S_CRUISER]*3, Upgrades(), [S_DESTRO]*3, Upgrades(), nb_sims=200, learn=True, seed=1)
+    assert prediction.simulated
+    assert len(model.features) == len(ATTACKERS) * len(DEFENDERS) + 1
+    again = model.estimate([S_CRUISER]*3, Upgrades(), [S_DESTRO]*3, Upgrades(), max_uncertainty=1.)
+    assert not again.simulated
+    assert abs(again.att_win - prediction.att_win) < .05
+
+def test_save_load(model, tmp_path):
+    path = str(tmp_path / 'model.npz')
+    model.save(path)
+    loaded = Surrogate.load(path)
+    matchup = ([S_SCOUT]*5, Upgrades(attack=1), [S_DESTRO]*3, Upgrades())
+    assert loaded.predict(*matchup) == model.predict(*matchup)
+
+def test_add_sweep():
+    grid = {'attack': [0, 1]}
+    result = sweep([S_SCOUT]*3, [S_DESTRO]*2, grid, grid, nb_sims=50, seed=0)
+    model = Surrogate()
+    model.add_sweep(result, [S_SCOUT]*3, [S_DESTRO]*2)
+    assert len(model.features) == 4
+    named = [dict(zip(FEATURE_NAMES, x)) for x in model.features]
+    assert [(x['att_up_attack'], x['def_up_attack']) for x in named] == [(0, 0), (0, 1), (1, 0), (1, 1)]
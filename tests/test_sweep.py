@@ -0,0 +1,38 @@
+import pytest
+
+from libse4x import Upgrades
+from libse4x.ships import *
+from libse4x.sweep import fight_signature, sweep
+
+def test_fight_signature():
+    # upgrades are capped by hull size
+    assert (fight_signature([S_SCOUT], Upgrades(attack=1), [S_DESTRO], Upgrades())
+            == fight_signature([S_SCOUT], Upgrades(attack=3), [S_DESTRO], Upgrades()))
+    assert (fight_signature([S_SCOUT], Upgrades(attack=1), [S_DESTRO], Upgrades())
+            != fight_signature([S_SCOUT], Upgrades(), [S_DESTRO], Upgrades()))
+    assert (fight_signature([S_SCOUT], Upgrades(tactics=1), [S_DESTRO], Upgrades())
+            != fight_signature([S_SCOUT], Upgrades(), [S_DESTRO], Upgrades()))
+    # no attack in asteroids
+    assert (fight_signature([S_CA], Upgrades(attack=2), [S_DESTRO], Upgrades(), asteroids=True)
+            == fight_signature([S_CA], Upgrades(), [S_DESTRO], Upgrades(), asteroids=True))
+
+def test_sweep():
+    grid = {'attack': [0, 1, 2, 3], 'defense': [0, 1]}
+    result = sweep([S_SCOUT]*3, [S_DESTRO]*2, grid, {'defense': [0, 3]}, nb_sims=50, seed=1)
+    assert result.axes == [('att_attack', [0, 1, 2, 3]), ('att_defense', [0, 1]), ('def_defense', [0, 3])]
+    assert result.shape == (4, 2, 2)
+    assert result.nb_unique == 2 * 2 * 2
+    assert result.sel(att_attack=3, att_defense=1, def_defense=0) is result[1, 1, 0]
+    # partial selection : sub-grid over the axes left out
+    sub = result.sel(att_attack=1, def_defense=3)
+    assert sub.axes == [('att_defense', [0, 1])]
+    assert sub[1,] is result[1, 1, 1]
+    assert sub.nb_unique == 2
+    assert result.sel(def_defense=0).shape == (4, 2)
+    with pytest.raises(KeyError):
+        result.sel(def_attack=0)
+    assert result[0, 0, 0].nb_sims == 50
+    win_rates = result.values()
+    assert len(win_rates) == 4 and len(win_rates[0][0]) == 2
+    again = sweep([S_SCOUT]*3, [S_DESTRO]*2, grid, {'defense': [0, 3]}, nb_sims=50, seed=1, workers=2)
+    assert again.values() == win_rates